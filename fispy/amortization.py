@@ -0,0 +1,238 @@
+import threading
+from functools import lru_cache
+from collections import OrderedDict
+import numpy as np
+import pandas as pd
+
+
+class Schedule(object):
+    """Repayment schedules of one or more debts, month by month. Each array
+    has one row per debt (or is one dimensional for a single debt) and one
+    column per month.
+
+    :param balance: np.array of the debt left at the end of each month
+    :param payment: np.array of the amount paid each month
+    :param interest: np.array of the interest added each month
+    :param payoff: integer month of the last payment (array for many
+                   debts), -1 if the debt is not paid off in time
+    """
+
+    def __init__(self, balance, payment, interest, payoff):
+        self.balance = balance
+        self.payment = payment
+        self.interest = interest
+        self.payoff = payoff
+
+    def __len__(self):
+        return self.balance.shape[-1]
+
+    def to_frame(self):
+        """A single schedule as a pd.DataFrame, one row per month"""
+        assert self.balance.ndim == 1, "Error: to_frame() needs one debt"
+        return pd.DataFrame({'balance': self.balance,
+                             'payment': self.payment,
+                             'interest': self.interest},
+                            columns=['balance', 'payment', 'interest'])
+
+
+def _amortize_flat(debt, repayment, months):
+    """_amortize() without interest. Each debt falls by its repayment every
+    month until it is paid off, so all of its balances are worked out at
+    once with np.subtract.accumulate, which rounds exactly like the monthly
+    subtractions.
+    """
+    due = (debt != 0) & (repayment != 0)
+    ops = np.zeros((len(debt), months + 1))
+    ops[:, 0] = debt
+    ops[due, 1:] = repayment[due, None]
+    path = np.subtract.accumulate(ops, axis=1)
+    over = due[:, None] & (path[:, 1:] <= 0)
+    payoff = np.where(over.any(axis=1), over.argmax(axis=1), -1)
+    stop = np.where(payoff < 0, months, payoff)[:, None]
+    month = np.arange(months)
+    balance = np.where(month < stop, path[:, 1:], 0.0)
+    payment = np.where(month < stop, ops[:, 1:],
+                       np.where(month == stop, path[:, :-1], 0.0))
+    return balance, payment, np.zeros(balance.shape), payoff
+
+
+def _amortize(debt, repayment, rate, months):
+    """Step every debt through months of repayments at once, with the same
+    arithmetic as Portfolio.monthly_repay(): the monthly repayment is taken
+    off until it would clear the debt, and then the rest is paid. Interest,
+    when there is a rate, is added at the start of each month.
+    """
+    if months and not rate.any():
+        return _amortize_flat(debt, repayment, months)
+    n = len(debt)
+    balance = np.zeros((n, months))
+    payment = np.zeros((n, months))
+    interest = np.zeros((n, months))
+    payoff = np.full(n, -1)
+    left = debt.copy()
+    for t in range(months):
+        if not left.any():
+            break
+        added = left * rate
+        left = left + added
+        due = (left != 0) & (repayment != 0)
+        last = due & (left - repayment <= 0)
+        payment[:, t] = np.where(last, left, np.where(due, repayment, 0.0))
+        left = np.where(last, 0.0, np.where(due, left - repayment, left))
+        payoff[last] = t
+        balance[:, t] = left
+        interest[:, t] = added
+    return balance, payment, interest, payoff
+
+
+class _ScheduleRows(object):
+    """The rows amortize_many() has worked out, least recently used first,
+    so that batches sharing debts, or run again, do not redo them. Keys are
+    the exact bytes of a (debt, repayment, rate) row and the months, so a
+    row found here is the one _amortize() would give.
+
+    :param maxsize: integer number of rows to keep
+    """
+
+    def __init__(self, maxsize=1024):
+        self.maxsize = maxsize
+        self._rows = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self._rows)
+
+    def lookup(self, keys):
+        """:returns: list of the (balance, payment, interest, payoff) of
+                     each key, None for those not kept
+        """
+        found = []
+        with self._lock:
+            for key in keys:
+                row = self._rows.get(key)
+                if row is not None:
+                    self._rows.move_to_end(key)
+                found.append(row)
+            hits = len(keys) - found.count(None)
+            self.hits += hits
+            self.misses += len(keys) - hits
+        return found
+
+    def add(self, keys, rows):
+        """Keep rows, read only, dropping the least recently used beyond
+        maxsize.
+        """
+        for row in rows:
+            for values in row[:3]:
+                values.flags.writeable = False
+        with self._lock:
+            self._rows.update(zip(keys, rows))
+            while len(self._rows) > self.maxsize:
+                self._rows.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._rows.clear()
+            self.hits = 0
+            self.misses = 0
+
+
+_schedule_rows = _ScheduleRows()
+
+
+def amortize_many(debt, repayment, rate=0.0, months=600):
+    """Schedules of many debts, e.g. every mortgage of a batch of
+    portfolios. Each distinct (debt, repayment, rate) is computed once, and
+    all of them together, one vectorized step per month. The last ones
+    computed are kept, and reused by later calls with the same months.
+
+    :param debt: array of the debts, NaN or 0 for none
+    :param repayment: array of the monthly repayments, NaN or 0 for none
+    :param rate: monthly interest rate, one for all or an array of one per
+                 debt
+    :param months: integer number of months to schedule
+    :returns: a Schedule object with arrays of shape (debts, months)
+    """
+    keys = np.empty((len(debt), 3))
+    keys[:, 0] = debt
+    keys[:, 1] = repayment
+    keys[:, 2] = rate
+    keys[np.isnan(keys)] = 0.0
+    # each row as one opaque value, which np.unique sorts far faster than
+    # it does rows
+    rows = keys.view(np.dtype((np.void, keys.itemsize * 3))).ravel()
+    first, inverse = np.unique(rows, return_index=True,
+                               return_inverse=True)[1:]
+    keys = keys[first]
+    names = [(key, months) for key in rows[first].tolist()]
+    found = _schedule_rows.lookup(names)
+    todo = [i for i, row in enumerate(found) if row is None]
+    if len(todo) == len(keys):
+        balance, payment, interest, payoff = _amortize(
+            keys[:, 0], keys[:, 1], keys[:, 2], months)
+    else:
+        balance = np.empty((len(keys), months))
+        payment = np.empty((len(keys), months))
+        interest = np.empty((len(keys), months))
+        payoff = np.empty(len(keys), dtype=int)
+        for i, row in enumerate(found):
+            if row is not None:
+                balance[i], payment[i], interest[i], payoff[i] = row
+        if todo:
+            (balance[todo], payment[todo], interest[todo],
+             payoff[todo]) = _amortize(keys[todo, 0], keys[todo, 1],
+                                       keys[todo, 2], months)
+    if todo:
+        # only the last maxsize rows could be kept
+        keep = todo[-_schedule_rows.maxsize:]
+        _schedule_rows.add([names[i] for i in keep],
+                           [(balance[i].copy(), payment[i].copy(),
+                             interest[i].copy(), int(payoff[i]))
+                            for i in keep])
+    return Schedule(balance[inverse], payment[inverse], interest[inverse],
+                    payoff[inverse])
+
+
+@lru_cache(maxsize=4096)
+def amortize(debt, repayment, rate=0.0, months=600):
+    """Cached schedule of a single debt. The arrays are shared between
+    callers, and so are read only.
+
+    :param debt: float debt
+    :param repayment: float monthly repayment
+    :param rate: float monthly interest rate
+    :param months: integer number of months to schedule
+    :returns: a Schedule object
+    """
+    schedule = amortize_many([debt], [repayment], rate, months)
+    arrays = []
+    for values in (schedule.balance, schedule.payment, schedule.interest):
+        values = values[0]
+        values.flags.writeable = False
+        arrays.append(values)
+    return Schedule(*arrays, payoff=int(schedule.payoff[0]))
+
+
+def portfolio_schedules(portfolio, months=None, rate=0.0):
+    """Schedules of the debts of a Portfolio from its current month,
+    paying only the minimum repayments. Overpayments of pay_debt_asap debts
+    and properties bought later depend on the rest of the Portfolio, so
+    they are left out, and every debt is scheduled from now whatever its
+    start_date and end_date; Portfolio.solve_payoff_dates() allows for
+    them.
+
+    :param portfolio: Portfolio object
+    :param months: integer number of months, defaults to portfolio.prd
+    :param rate: monthly interest rate, one for all or one per debt
+    :returns: (list of the indices of the assets with debts, Schedule)
+    """
+    if months is None:
+        months = portfolio.prd
+    index = [i for i, asset in enumerate(portfolio.assets)
+             if asset.debt or asset.monthly_repayment]
+    debts = [portfolio.assets[i] for i in index]
+    return index, amortize_many([asset.debt or 0.0 for asset in debts],
+                                [asset.monthly_repayment or 0.0
+                                 for asset in debts], rate, months)
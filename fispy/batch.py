@@ -0,0 +1,675 @@
+import datetime as dt
+import numpy as np
+import pandas as pd
+from fispy.amortization import amortize_many
+from fispy.fispy import (ASSET_KINDS, DEFAULT_RULES, NEW_PROPERTY,
+                         STATE_FIELDS, month_timeline, quad_output,
+                         state_quads)
+
+
+def _first_month(mask):
+    """Index of the first True month of each row of mask, -1 if never"""
+    return np.where(mask.any(axis=1), mask.argmax(axis=1), -1)
+
+
+class BatchPortfolio(object):
+    """Runs many Portfolio scenarios side by side. The assets of every
+    scenario are packed into NumPy arrays of shape (assets, scenarios), and
+    each month is advanced for all scenarios at once with the same
+    arithmetic, in the same order, as Portfolio.update_monthly, so the
+    results match the scalar path bit for bit.
+
+    The rules of the portfolios (see Rule) run through their apply_batch()
+    methods, so every scenario must share the same rules. Properties bought
+    by them are kept in their own arrays. They are paid off oldest first,
+    so each scenario only tracks the block of rows from its oldest unpaid
+    property onwards through the repayment phases.
+
+    Like the scalar Portfolio, assets only take part in the months within
+    their start_date and end_date. The month each asset starts and stops is
+    worked out once, up front, and the kind masks and totals are only
+    masked again in the months one of them changes.
+
+    :param Portfolio: n number of Portfolio objects, one per scenario
+    :param prd: integer number of months to run, defaults to the prd shared
+                by all the portfolios
+    :returns: A BatchPortfolio instance
+    """
+
+    # arrays holding each Asset field that set_field() can change
+    field_columns = {'value': 'asset_value', 'debt': 'asset_debt',
+                     'monthly_income': 'asset_income',
+                     'monthly_expenses': 'asset_expenses',
+                     'monthly_repayment': 'asset_repayment',
+                     'max_cash': 'max_cash'}
+
+    def __init__(self, *portfolios, prd=None):
+        if not portfolios:
+            raise ValueError("BatchPortfolio needs at least one Portfolio")
+        if prd is None:
+            prds = set(portfolio.prd for portfolio in portfolios)
+            if len(prds) != 1:
+                raise ValueError("Portfolios have different prd values, "
+                                 "pass prd explicitly")
+            prd = prds.pop()
+        rules = set(portfolio.rules for portfolio in portfolios)
+        if len(rules) != 1:
+            raise ValueError("Portfolios have different rules")
+        self.rules = rules.pop()
+        width = max(len(portfolio.assets) for portfolio in portfolios)
+        self._allocate(prd, [portfolio.date for portfolio in portfolios],
+                       width)
+        for i, portfolio in enumerate(portfolios):
+            for j, asset in enumerate(portfolio.assets):
+                kind = asset.kind
+                self.asset_value[j, i] = asset.value or 0.0
+                self.asset_debt[j, i] = asset.debt or 0.0
+                self.asset_income[j, i] = asset.monthly_income or 0.0
+                self.asset_expenses[j, i] = asset.monthly_expenses or 0.0
+                self.asset_repayment[j, i] = asset.monthly_repayment or 0.0
+                if asset.max_cash is not None:
+                    self.max_cash[j, i] = asset.max_cash
+                self.pay_debt_asap[j, i] = bool(asset.pay_debt_asap)
+                self.is_stock[j, i] = kind == 'stocks'
+                self.is_cash[j, i] = kind == 'cash'
+                self.is_passive[j, i] = kind != 'job'
+        self._set_windows(
+            np.array(self.start, dtype='M8[D]'),
+            np.array([[asset.start_date for asset in portfolio.assets] +
+                      [None] * (width - len(portfolio.assets))
+                      for portfolio in portfolios], dtype='M8[D]').T,
+            np.array([[asset.end_date for asset in portfolio.assets] +
+                      [None] * (width - len(portfolio.assets))
+                      for portfolio in portfolios], dtype='M8[D]').T)
+        self._index_assets()
+        self.buy_property_threshold = np.array(
+            [portfolio.buy_property_threshold for portfolio in portfolios],
+            dtype=float)
+        self.stock_growth = np.array(
+            [portfolio.stock_growth for portfolio in portfolios], dtype=float)
+        self.monthly_income = self._state(portfolios, 'monthly_income')
+        self.monthly_expenses = self._state(portfolios, 'monthly_expenses')
+        self.net_investments = self._state(portfolios, 'net_investments')
+        self.debt = self._state(portfolios, 'debt')
+        self.cash = self._state(portfolios, 'cash')
+        self.networth = self._state(portfolios, 'networth')
+        self.passive_income = self._state(portfolios, 'passive_income')
+        self.fi = np.array([portfolio.fi for portfolio in portfolios])
+
+    def _allocate(self, prd, start, width):
+        """Empty asset and property arrays for len(start) scenarios of up
+        to width assets each.
+        """
+        self.prd = prd
+        self.n = len(start)
+        self.start = list(start)
+        self.month = 0
+        shape = (width, self.n)
+        self.asset_value = np.zeros(shape)
+        self.asset_debt = np.zeros(shape)
+        self.asset_income = np.zeros(shape)
+        self.max_cash = np.full(shape, np.nan)
+        self.pay_debt_asap = np.zeros(shape, dtype=bool)
+        self.is_stock = np.zeros(shape, dtype=bool)
+        self.is_cash = np.zeros(shape, dtype=bool)
+        self.is_passive = np.zeros(shape, dtype=bool)
+        self.asset_expenses = np.zeros(shape)
+        self.asset_repayment = np.zeros(shape)
+        # bought properties, one row per purchase in the order they happen
+        self.prop_value = np.zeros((8, self.n))
+        self.prop_debt = np.zeros((8, self.n))
+        self.prop_repayment = np.zeros((8, self.n))
+        self.n_properties = np.zeros(self.n, dtype=int)
+        self.prop_head = np.zeros(self.n, dtype=int)
+        self._live = (np.zeros((0, self.n)), np.zeros((0, self.n)))
+        self.insolvent = np.full(self.n, -1)
+        self._active = None
+        self._kinds = None
+        self._schedule = None
+
+    def _set_windows(self, start, starts, ends):
+        """Precompute, from the start_date and end_date (NaT for none) of
+        every asset, the months each one is active in: from first_active up
+        to, but not including, stop_active. The masks then only change in
+        the months of self._switches.
+
+        :param start: datetime64[D] array of the start of each scenario
+        :param starts, ends: datetime64[D] arrays of shape (assets,
+                             scenarios)
+        """
+        self.first_active = np.zeros(starts.shape, dtype=int)
+        self.stop_active = np.full(ends.shape, np.iinfo(int).max)
+        for day in np.unique(start):
+            cols = start == day
+            days = month_timeline(day.item(), self.prd).days
+            for dates, out in ((starts, self.first_active),
+                               (ends, self.stop_active)):
+                dates = dates[:, cols]
+                given = ~np.isnat(dates)
+                out[:, cols] = np.where(
+                    given, np.searchsorted(days, dates), out[:, cols])
+        # the first month always looks at the masks, as the scalar one does
+        switches = np.unique(np.concatenate([self.first_active.ravel(),
+                                             self.stop_active.ravel()]))
+        self._switches = frozenset(switches[switches > 1].tolist() + [1])
+
+    def _switch_windows(self):
+        """Mask the kinds and totals to the assets active this month"""
+        month = self.month
+        active = (self.first_active <= month) & (month < self.stop_active)
+        if active.all():
+            active = None
+        if active is None and self._active is None:
+            return
+        if self._kinds is None:
+            self._kinds = (self.is_stock, self.is_cash, self.is_passive)
+        self._active = active
+        if active is None:
+            self.is_stock, self.is_cash, self.is_passive = self._kinds
+        else:
+            self.is_stock, self.is_cash, self.is_passive = (
+                kind & active for kind in self._kinds)
+        self._index_assets()
+
+    def _masked(self, values):
+        """values with the rows of inactive assets zeroed"""
+        if self._active is None:
+            return values
+        return np.where(self._active, values, 0.0)
+
+    def _index_assets(self):
+        """Rows the monthly phases visit, and the income and expense
+        totals, once the asset arrays are filled in.
+        """
+        self._stock_rows = tuple(np.flatnonzero(self.is_stock.any(axis=1)))
+        self._cash_rows = tuple(np.flatnonzero(self.is_cash.any(axis=1)))
+        owing = np.flatnonzero((self.asset_debt != 0).any(axis=1) |
+                               (self.asset_repayment != 0).any(axis=1))
+        if len(owing):
+            self._debt_rows = slice(owing[0], owing[-1] + 1)
+        else:
+            self._debt_rows = slice(0, 0)
+        self._schedule = None
+        income = self._masked(self.asset_income)
+        self._income_total = np.add.reduce(income, axis=0)
+        self._passive_total = np.add.reduce(
+            np.where(self.is_passive, income, 0.0), axis=0)
+        self._expense_total = np.add.reduce(
+            self._masked(self.asset_expenses), axis=0)
+        # bought properties are always active
+        for k in range(self.n_properties.max()):
+            bought = np.where(k < self.n_properties,
+                              NEW_PROPERTY['monthly_income'], 0.0)
+            self._income_total += bought
+            self._passive_total += bought
+
+    @classmethod
+    def from_table(cls, table, scenario, prd=60, buy_property_threshold=80,
+                   stock_growth=1.00333, rules=DEFAULT_RULES):
+        """Scenarios straight from the columns of an AssetTable, without
+        building an Asset or Portfolio object per row. Each scenario starts
+        as a new Portfolio of its assets would, in the order of the table.
+
+        :param table: AssetTable object holding the assets of every scenario
+        :param scenario: integer array, the scenario (0 to n - 1) of each
+                         row of table
+        :param prd: integer number of months to run
+        :param buy_property_threshold: float, or array with one value per
+                                       scenario
+        :param stock_growth: float, or array with one value per scenario
+        :param rules: tuple of the Rule objects of every scenario
+        :returns: A BatchPortfolio instance
+        """
+        scenario = np.asarray(scenario, dtype=int)
+        if len(scenario) != len(table):
+            raise ValueError("scenario needs one entry per row of the table")
+        n = scenario.max() + 1 if len(scenario) else 0
+        if n == 0:
+            raise ValueError("BatchPortfolio needs at least one Portfolio")
+        counts = np.bincount(scenario, minlength=n)
+        if not counts.all():
+            raise ValueError("Scenario {0} has no assets".format(
+                np.flatnonzero(counts == 0)[0]))
+        # position of each row among the assets of its scenario
+        order = np.argsort(scenario, kind='stable')
+        position = np.empty(len(scenario), dtype=int)
+        position[order] = (np.arange(len(scenario)) -
+                           np.repeat(np.cumsum(counts) - counts, counts))
+        first = np.full(n, np.datetime64('NaT', 'D'))
+        np.fmin.at(first, scenario, table.start_date)
+        first[np.isnat(first)] = np.datetime64(dt.date.today(), 'D')
+        batch = cls.__new__(cls)
+        batch._allocate(prd, first.tolist(), counts.max())
+        batch.rules = tuple(rules)
+        at = (position, scenario)
+        for name, column in (('asset_value', table.value),
+                             ('asset_debt', table.debt),
+                             ('asset_income', table.monthly_income),
+                             ('asset_expenses', table.monthly_expenses),
+                             ('asset_repayment', table.monthly_repayment)):
+            getattr(batch, name)[at] = np.nan_to_num(column)
+        batch.max_cash[at] = table.max_cash
+        batch.pay_debt_asap[at] = table.pay_debt_asap
+        kinds = np.array(ASSET_KINDS)[table.kind]
+        batch.is_stock[at] = kinds == 'stocks'
+        batch.is_cash[at] = kinds == 'cash'
+        batch.is_passive[at] = kinds != 'job'
+        windows = []
+        for column in (table.start_date, table.end_date):
+            dates = np.full((counts.max(), n), np.datetime64('NaT', 'D'))
+            dates[at] = column
+            windows.append(dates)
+        batch._set_windows(first, *windows)
+        batch._index_assets()
+        batch.buy_property_threshold = np.broadcast_to(
+            np.asarray(buy_property_threshold, dtype=float), n).copy()
+        batch.stock_growth = np.broadcast_to(
+            np.asarray(stock_growth, dtype=float), n).copy()
+        for name in ('monthly_income', 'monthly_expenses', 'net_investments',
+                     'debt', 'cash', 'networth', 'passive_income'):
+            setattr(batch, name, np.zeros(n))
+        batch.fi = np.zeros(n, dtype=bool)
+        return batch
+
+    @classmethod
+    def repeat(cls, portfolio, n, prd=None):
+        """n identical scenarios of one Portfolio, packed once and tiled
+        rather than built from n Portfolio objects.
+
+        :param portfolio: Portfolio object to copy
+        :param n: integer number of scenarios
+        :param prd: integer number of months to run, defaults to
+                    portfolio.prd
+        :returns: A BatchPortfolio instance
+        """
+        batch = cls(portfolio, prd=prd)
+        for name, value in list(vars(batch).items()):
+            if isinstance(value, np.ndarray) and value.shape[-1] == 1:
+                setattr(batch, name, np.repeat(value, n, axis=-1))
+        batch._live = (np.zeros((0, n)), np.zeros((0, n)))
+        batch.start = batch.start * n
+        batch.n = n
+        return batch
+
+    def set_field(self, index, name, values):
+        """Change an Asset field in every scenario before the run, e.g. to
+        try a different value in each.
+
+        :param index: integer index of the asset
+        :param name: Asset field name, one of field_columns
+        :param values: value for all scenarios, or one per scenario
+        """
+        if name not in self.field_columns:
+            raise ValueError("name should be one of {0}, not {1}".format(
+                sorted(self.field_columns), name))
+        getattr(self, self.field_columns[name])[index] = values
+        self._index_assets()
+
+    @staticmethod
+    def _state(portfolios, name):
+        return np.array([getattr(portfolio, name) for portfolio in portfolios],
+                        dtype=float)
+
+    def _fail(self, mask):
+        """Record the month in which a scenario would have raised one of the
+        AssertionErrors of the scalar Portfolio.
+        """
+        self.insolvent[mask & (self.insolvent < 0)] = self.month - 1
+
+    def _grow(self, rows):
+        size = len(self.prop_value)
+        while size < rows:
+            size *= 2
+        for name in ('prop_value', 'prop_debt', 'prop_repayment'):
+            old = getattr(self, name)
+            new = np.zeros((size, self.n))
+            new[:len(old)] = old
+            setattr(self, name, new)
+
+    def buy_property(self, mask, pro_rata=False):
+        """Buy a NEW_PROPERTY in every scenario selected by mask."""
+        self.sell_shares(mask, amount=NEW_PROPERTY['value'] -
+                         NEW_PROPERTY['debt'], pro_rata=pro_rata)
+        cols = np.flatnonzero(mask)
+        rows = self.n_properties[cols]
+        if rows.max() + 2 > len(self.prop_value):
+            self._grow(rows.max() + 2)
+        self.prop_value[rows, cols] = NEW_PROPERTY['value']
+        self.prop_debt[rows, cols] = NEW_PROPERTY['debt']
+        self.prop_repayment[rows, cols] = NEW_PROPERTY['monthly_repayment']
+        self.n_properties[cols] += 1
+        self._income_total[cols] += NEW_PROPERTY['monthly_income']
+        self._passive_total[cols] += NEW_PROPERTY['monthly_income']
+
+    def sell_shares(self, mask, amount, pro_rata=False):
+        """Take amount (one value, or one per scenario) out of the stock
+        assets of the scenarios in mask, following Portfolio.sell_shares.
+        """
+        amount = np.broadcast_to(np.asarray(amount, dtype=float),
+                                 self.n).copy()
+        if pro_rata:
+            value = self.asset_value
+            held = self.is_stock & mask
+            total = np.add.reduce(np.where(self.is_stock, value, 0.0),
+                                  axis=0)
+            covers = total > amount
+            with np.errstate(divide='ignore', invalid='ignore'):
+                np.subtract(value, amount * value / total, out=value,
+                            where=held & covers)
+            value[held & ~covers] = 0.0
+            return
+        for j in self._stock_rows:
+            value = self.asset_value[j]
+            held = self.is_stock[j] & mask
+            covers = held & (value > amount)
+            short = held & ~covers
+            remaining = np.where(short, amount - value, amount)
+            np.subtract(value, amount, out=value, where=covers)
+            value[short] = 0.0
+            amount = remaining
+
+    def monthly_ingres(self):
+        self.monthly_income = self._income_total.copy()
+
+    def monthly_egres(self):
+        self.monthly_expenses = self._expense_total
+        self._fail(~(self._expense_total < self.monthly_income))
+        self.monthly_income -= self._expense_total
+
+    def _debt_schedule(self):
+        """amortize_many() schedules of the asset debts, from the month the
+        assets were last indexed in. Until they are indexed again the same
+        assets are active every month, and debts not paid off asap only
+        ever get the minimum repayment, so each month of them is a row of
+        the schedules. When an asap debt is due too the block is worked out
+        month by month instead, which gives the same numbers.
+
+        :returns: None, or (the rows of the schedules of each asset debt,
+                  their balances and payments month by month, the month
+                  each debt is paid off in, and the first month)
+        """
+        schedule = self._schedule
+        if schedule is None or (schedule and
+                                self.month - schedule[4] >= self.prd):
+            rows = self._debt_rows
+            debt = self.asset_debt[rows]
+            repayment = self.asset_repayment[rows]
+            owing = (debt != 0) & (repayment != 0)
+            if self._active is not None:
+                owing &= self._active[rows]
+            if not owing.any() or (owing & self.pay_debt_asap[rows]).any():
+                self._schedule = False
+                return None
+            # rows that are not due look up a debt of 0
+            keys = np.zeros(debt.shape, dtype=int)
+            keys[owing] = np.arange(1, owing.sum() + 1)
+            plan = amortize_many(np.append(0.0, debt[owing]),
+                                 np.append(0.0, repayment[owing]),
+                                 months=self.prd)
+            self._schedule = schedule = (
+                keys, np.ascontiguousarray(plan.balance.T),
+                np.ascontiguousarray(plan.payment.T), plan.payoff.take(keys),
+                self.month)
+        return schedule or None
+
+    def _repay(self, debt, repayment, active=None, schedule=None):
+        """Minimum repayments over a block of asset rows, in row order,
+        skipping rows that are not active. With a schedule (see
+        _debt_schedule()) the debts and payments are looked up in it
+        rather than worked out; the check that the income covers each
+        repayment is made month by month either way.
+        """
+        if not len(debt):
+            return
+        if schedule is None:
+            due = (debt != 0) & (repayment != 0)
+            if active is not None:
+                due &= active
+            remaining = debt - repayment
+            last = due & (remaining <= 0)
+            paid = np.where(last, debt, np.where(due, repayment, 0.0))
+        else:
+            keys, balance, payment, payoff, first = schedule
+            month = self.month - first
+            remaining = balance[month].take(keys)
+            paid = payment[month].take(keys)
+            last = payoff == month
+            due = paid != 0
+        income = self.monthly_income
+        short = np.zeros(self.n, dtype=bool)
+        for k in range(len(debt)):
+            short |= due[k] & ~(income > repayment[k])
+            income = income - paid[k]
+        self._fail(short)
+        self.monthly_income = income
+        debt[...] = np.where(last, 0.0, np.where(due, remaining, debt))
+        repayment[last] = 0.0
+
+    def _pay_asap(self, debt, asap):
+        """Put the spare income of each scenario on its first debt flagged
+        pay_debt_asap.
+        """
+        if not len(debt):
+            return
+        owing = debt != 0
+        if asap is not None:
+            owing &= asap
+        cols = np.flatnonzero(owing.any(axis=0) & (self.monthly_income > 0))
+        if len(cols):
+            rows = owing[:, cols].argmax(axis=0)
+            debt[rows, cols] -= self.monthly_income[cols]
+            self.monthly_income[cols] = 0.0
+
+    def _gather_live(self):
+        """Flat index, debt and repayment of each scenario's unpaid
+        properties as (rows, scenarios) blocks, oldest first. Slots past a
+        scenario's last purchase point at the spare zero row at the end of
+        the property arrays.
+        """
+        width = (self.n_properties - self.prop_head).max()
+        rows = self.prop_head + np.arange(width)[:, None]
+        np.minimum(rows, len(self.prop_debt) - 1, out=rows)
+        index = rows * self.n + np.arange(self.n)
+        return (index, self.prop_debt.take(index),
+                self.prop_repayment.take(index))
+
+    def monthly_repay(self):
+        rows = self._debt_rows
+        index, debt, repayment = self._gather_live()
+        asap = self.pay_debt_asap[rows]
+        active = None
+        if self._active is not None:
+            active = self._active[rows]
+            asap = asap & active
+        self._repay(self.asset_debt[rows], self.asset_repayment[rows], active,
+                    self._debt_schedule())
+        self._repay(debt, repayment)
+        self._pay_asap(self.asset_debt[rows], asap)
+        if NEW_PROPERTY['pay_debt_asap']:
+            self._pay_asap(debt, None)
+        self.prop_debt.put(index, debt)
+        self.prop_repayment.put(index, repayment)
+        # properties are paid off oldest first, so move each head past them
+        cleared = np.logical_and.accumulate((debt == 0) & (repayment == 0),
+                                            axis=0).sum(axis=0)
+        self.prop_head += np.minimum(cleared,
+                                     self.n_properties - self.prop_head)
+        self._live = (debt, repayment)
+
+    def monthly_debt(self):
+        total = np.add.reduce(self._masked(self.asset_debt), axis=0)
+        for row in self._live[0]:
+            total += row
+        self.debt = total
+
+    def count_cash(self):
+        for j in self._cash_rows:
+            value = self.asset_value[j]
+            held = self.is_cash[j]
+            self.cash = np.where(held, value, self.cash)
+            top_up = held & (self.cash < self.max_cash[j]) & \
+                (self.monthly_income > 0)
+            np.add(value, self.monthly_income, out=value, where=top_up)
+            self.monthly_income[top_up] = 0.0
+            self.cash = np.where(top_up, value, self.cash)
+
+    def investment_portfolio(self):
+        total = np.zeros(self.n)
+        for j in self._stock_rows:
+            value = self.asset_value[j]
+            held = self.is_stock[j]
+            total = np.where(held, total + value, total)
+            np.multiply(value, self.stock_growth, out=value, where=held)
+            top_up = held & (self.monthly_income > 0)
+            np.add(value, self.monthly_income, out=value, where=top_up)
+            self.monthly_income[top_up] = 0.0
+        self.net_investments = total
+
+    def calc_net_worth(self):
+        total = np.add.reduce(self._masked(self.asset_value), axis=0)
+        for row in self.prop_value[:self.n_properties.max()]:
+            total += row
+        self.networth = total - self.debt
+
+    def check_fi(self):
+        repayments = np.add.reduce(self._masked(self.asset_repayment),
+                                   axis=0)
+        for row in self._live[1]:
+            repayments += row
+        negative = self._expense_total + repayments
+        self.passive_income = self._passive_total.copy()
+        self.fi = self.passive_income > negative
+
+    def update_monthly(self):
+        """Advance every scenario by one month, mirroring
+        Portfolio.update_monthly.
+        """
+        self.month += 1
+        if self.month in self._switches:
+            self._switch_windows()
+        for rule in self.rules:
+            rule.apply_batch(self)
+        self.monthly_ingres()
+        self.monthly_egres()
+        self.monthly_repay()
+        self.monthly_debt()
+        self.count_cash()
+        self.investment_portfolio()
+        self.calc_net_worth()
+        self.check_fi()
+
+    def iter_run(self, chunk=12):
+        """Generator version of run(), advancing all scenarios chunk months
+        at a time, e.g. to stream their quads into a Bokeh ColumnDataSource.
+
+        :param chunk: integer number of months per chunk
+        :returns: generator of BatchResult objects, one per chunk, each
+                  holding every month run so far
+        """
+        assert chunk > 0, "Error: chunk must be at least one month"
+        series = dict((name, np.empty((self.prd, self.n)))
+                      for name in STATE_FIELDS)
+        series['fi'] = np.empty((self.prd, self.n), dtype=bool)
+        first = self.month
+        for start in range(0, max(self.prd, 1), chunk):
+            stop = min(start + chunk, self.prd)
+            for t in range(start, stop):
+                self.update_monthly()
+                for name in STATE_FIELDS:
+                    series[name][t] = getattr(self, name)
+            yield BatchResult(dict((name, column[:stop])
+                                   for name, column in series.items()),
+                              self.start, first, self.insolvent - first)
+
+    def run(self):
+        """Advance all scenarios prd months, recording the Portfolio state
+        after every month.
+
+        :param self: BatchPortfolio object
+        :returns: a BatchResult object
+        """
+        for result in self.iter_run(chunk=max(self.prd, 1)):
+            pass
+        return result
+
+
+class BatchResult(object):
+    """Monthly state series of a BatchPortfolio run. Each of the STATE_FIELDS
+    is an array of shape (scenarios, months). Scenarios that would have
+    raised an AssertionError in the scalar Portfolio have the month it
+    happened in insolvent (-1 otherwise), and NaN state from then on.
+    """
+
+    def __init__(self, series, start, first, insolvent):
+        self.start = start
+        self.first = first
+        self.insolvent = np.where(insolvent < 0, -1, insolvent)
+        for name in STATE_FIELDS:
+            setattr(self, name, series[name].T)
+        for i in np.flatnonzero(self.insolvent >= 0):
+            for name in STATE_FIELDS[:-1]:
+                getattr(self, name)[i, self.insolvent[i]:] = np.nan
+            self.fi[i, self.insolvent[i]:] = False
+
+    def __len__(self):
+        return len(self.start)
+
+    def months(self, i):
+        """Number of valid months of scenario i"""
+        if self.insolvent[i] >= 0:
+            return self.insolvent[i]
+        return self.fi.shape[1]
+
+    def _timeline(self, i):
+        return month_timeline(self.start[i], self.first + self.fi.shape[1])
+
+    def dates(self, i):
+        """left and right dates of every month of scenario i"""
+        n = self.months(i)
+        dates = self._timeline(i).dates
+        return (list(dates[self.first + 1:self.first + n + 1]),
+                list(dates[self.first + 2:self.first + n + 2]))
+
+    def quads(self, i, output='frame', start=0):
+        """Quad plot data of scenario i, identical to what
+        Portfolio.gen_quads returns for it.
+
+        :param i: integer index of the scenario
+        :param output: 'frame', 'dict' or 'records', see quad_output()
+        :param start: integer month to start from, e.g. the first month of
+                      the latest chunk of BatchPortfolio.iter_run()
+        :returns: a pd.DataFrame object (or dict, or np.recarray)
+        """
+        n = self.months(i)
+        start = min(start, n)
+        days = self._timeline(i).days[self.first + start + 1:
+                                      self.first + n + 2]
+        quads = state_quads(days, self.debt[i, start:n], self.cash[i, start:n],
+                            self.net_investments[i, start:n],
+                            self.networth[i, start:n], self.fi[i, start:n])
+        return quad_output(quads, output)
+
+    def states(self, i):
+        """Monthly Portfolio state of scenario i as a pd.DataFrame indexed
+        by date.
+        """
+        n = self.months(i)
+        return pd.DataFrame(dict((name, getattr(self, name)[i, :n])
+                                 for name in STATE_FIELDS),
+                            index=self.dates(i)[0],
+                            columns=STATE_FIELDS)
+
+    def summary(self):
+        """One row per scenario: the first month FI is reached and the first
+        month without debt (-1 if never), the insolvent month, and the
+        final debt, cash, investments and net worth.
+
+        :returns: a pd.DataFrame object
+        """
+        summary = pd.DataFrame({
+            'fi_month': _first_month(self.fi),
+            'debt_free_month': _first_month(self.debt == 0),
+            'insolvent': self.insolvent})
+        for name in ('debt', 'cash', 'net_investments', 'networth'):
+            summary[name] = getattr(self, name)[:, -1]
+        return summary
@@ -0,0 +1,252 @@
+"""Benchmarks of the Portfolio simulation core.
+
+Run the fixtures and save a JSON baseline, then compare a later run
+against it::
+
+    python -m fispy.bench run -o baseline.json
+    python -m fispy.bench run -o current.json
+    python -m fispy.bench compare baseline.json current.json --threshold 0.1
+
+Every fixture records the seconds spent in each of the MONTHLY_PHASES of
+update_monthly(), in quad_positions() and in building the quad DataFrame,
+the whole of gen_quads(), and the peak memory traced during gen_quads().
+"""
+import sys
+import json
+import time
+import argparse
+import platform
+import tracemalloc
+import datetime as dt
+from functools import partial
+import numpy as np
+import pandas as pd
+from fispy.fispy import (Asset, Portfolio, MONTHLY_PHASES, QUAD_DTYPE,
+                         quad_output)
+from fispy.tests.assets import app_assets
+
+
+def synthetic_assets(n, seed=0):
+    """n random assets: one cash pile, a mix of jobs, mortgaged real
+    estate and stocks, and a last job with enough income to meet every
+    repayment.
+
+    :param n: integer number of assets, at least 2
+    :param seed: integer seed of the random generator
+    :returns: list of Asset objects
+    """
+    rng = np.random.RandomState(seed)
+    start = dt.date(2016, 6, 1)
+    assets = [Asset(kind='cash', value=15, max_cash=30, start_date=start)]
+    kinds = rng.choice(['job', 'real estate', 'stocks'], n - 2,
+                       p=[0.1, 0.5, 0.4])
+    for kind in kinds:
+        if kind == 'job':
+            assets.append(Asset(kind=kind,
+                                monthly_income=rng.uniform(1, 3),
+                                monthly_expenses=rng.uniform(0, 0.5),
+                                start_date=start))
+        elif kind == 'real estate':
+            assets.append(Asset(kind=kind, value=rng.uniform(50, 200),
+                                debt=rng.uniform(0, 100),
+                                monthly_repayment=rng.uniform(0.01, 0.1),
+                                monthly_income=rng.uniform(0, 0.3),
+                                pay_debt_asap=bool(rng.rand() < 0.2),
+                                start_date=start))
+        else:
+            assets.append(Asset(kind=kind, value=rng.uniform(0, 20),
+                                start_date=start))
+    # one more job so the income always covers the repayments
+    assets.append(Asset(kind='job', monthly_income=0.2 * n,
+                        start_date=start))
+    return assets
+
+
+# name: (function returning fresh assets, months to run)
+FIXTURES = {'app': (app_assets, 200),
+            'app_1200': (app_assets, 1200),
+            'synthetic_100': (partial(synthetic_assets, 100), 600),
+            'synthetic_1k': (partial(synthetic_assets, 1000), 1200)}
+
+
+def _time_phases(portfolio):
+    """Seconds spent in each MONTHLY_PHASES method and in quad_positions
+    over a run of portfolio.prd months.
+    """
+    timings = dict((name, 0.0) for name in MONTHLY_PHASES)
+    timings['quad_positions'] = 0.0
+    phases = [(name, getattr(portfolio, name)) for name in MONTHLY_PHASES]
+    left, right, bottom, top, color = [], [], [], [], []
+    clock = time.perf_counter
+    for i in range(portfolio.prd):
+        for name, phase in phases:
+            start = clock()
+            phase()
+            timings[name] += clock() - start
+        start = clock()
+        portfolio.quad_positions(left, right, bottom, top, color)
+        timings['quad_positions'] += clock() - start
+    return timings
+
+
+def bench_fixture(make_assets, prd, repeat=3):
+    """Benchmark one portfolio. Timings are the best of repeat runs, each
+    on freshly made assets.
+
+    :param make_assets: function returning a list of new Asset objects
+    :param prd: integer number of months to run
+    :param repeat: integer number of runs to time
+    :returns: dict of metric name to seconds ('peak_memory' is in bytes)
+    """
+    results = {}
+    clock = time.perf_counter
+    for i in range(repeat):
+        timings = _time_phases(Portfolio(*make_assets(), prd=prd))
+        for name, seconds in timings.items():
+            key = 'phase.' + name if name in MONTHLY_PHASES else name
+            results[key] = min(results.get(key, np.inf), seconds)
+        portfolio = Portfolio(*make_assets(), prd=prd)
+        start = clock()
+        records = portfolio.gen_quads(output='records')
+        seconds = clock() - start
+        results['gen_quads'] = min(results.get('gen_quads', np.inf),
+                                   seconds)
+        quads = np.asarray(records).view(QUAD_DTYPE)
+        start = clock()
+        quad_output(quads, 'frame')
+        seconds = clock() - start
+        results['dataframe'] = min(results.get('dataframe', np.inf),
+                                   seconds)
+    portfolio = Portfolio(*make_assets(), prd=prd)
+    tracemalloc.start()
+    try:
+        portfolio.gen_quads()
+        results['peak_memory'] = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    return results
+
+
+def run(fixtures=None, repeat=3):
+    """Benchmark the named FIXTURES (all of them by default).
+
+    :param fixtures: list of fixture names, or dict of name to (function,
+                     prd) to benchmark instead of FIXTURES
+    :param repeat: integer number of runs to time, see bench_fixture()
+    :returns: dict with the 'meta' data of the machine and the 'results'
+              of each fixture
+    """
+    if fixtures is None:
+        fixtures = FIXTURES
+    elif not isinstance(fixtures, dict):
+        unknown = set(fixtures) - set(FIXTURES)
+        if unknown:
+            raise ValueError("Unknown fixtures: {0}".format(
+                ', '.join(sorted(unknown))))
+        fixtures = dict((name, FIXTURES[name]) for name in fixtures)
+    meta = {'date': dt.datetime.now().isoformat(),
+            'python': platform.python_version(),
+            'numpy': np.__version__,
+            'pandas': pd.__version__,
+            'machine': platform.platform(),
+            'repeat': repeat}
+    results = {}
+    for name in sorted(fixtures):
+        make_assets, prd = fixtures[name]
+        results[name] = bench_fixture(make_assets, prd, repeat=repeat)
+    return {'meta': meta, 'results': results}
+
+
+def save(benchmark, path):
+    """Write a run() result to a JSON file"""
+    with open(path, 'w') as f:
+        json.dump(benchmark, f, indent=2, sort_keys=True)
+
+
+def load(path):
+    """Read a run() result from a JSON file"""
+    with open(path) as f:
+        return json.load(f)
+
+
+def compare(baseline, current, threshold=0.1, min_seconds=1e-3):
+    """Compare two run() results metric by metric.
+
+    :param baseline: run() result to compare against
+    :param current: run() result to check
+    :param threshold: fraction a metric may grow by before it is flagged
+    :param min_seconds: timings below this in both runs are too noisy to
+                        flag
+    :returns: pd.DataFrame of baseline, current, ratio and regression flag,
+              indexed by (fixture, metric), for the metrics in both runs
+    """
+    rows = []
+    for fixture in sorted(set(baseline['results']) & set(current['results'])):
+        old = baseline['results'][fixture]
+        new = current['results'][fixture]
+        for metric in sorted(set(old) & set(new)):
+            ratio = new[metric] / old[metric] if old[metric] else np.inf
+            noisy = (metric != 'peak_memory' and
+                     max(old[metric], new[metric]) < min_seconds)
+            rows.append((fixture, metric, old[metric], new[metric], ratio,
+                         not noisy and ratio > 1 + threshold))
+    table = pd.DataFrame(rows, columns=['fixture', 'metric', 'baseline',
+                                        'current', 'ratio', 'regression'])
+    return table.set_index(['fixture', 'metric'])
+
+
+def _table(results):
+    """One line per fixture and metric, for printing"""
+    lines = []
+    for fixture in sorted(results):
+        for metric, value in sorted(results[fixture].items()):
+            if metric == 'peak_memory':
+                text = '{0:12.1f} kB'.format(value / 1024.)
+            else:
+                text = '{0:12.3f} ms'.format(value * 1e3)
+            lines.append('{0:15s} {1:28s} {2}'.format(fixture, metric, text))
+    return '\n'.join(lines)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m fispy.bench',
+                                     description=__doc__.splitlines()[0])
+    commands = parser.add_subparsers(dest='command')
+    run_parser = commands.add_parser('run', help='run the benchmarks')
+    run_parser.add_argument('-o', '--output', help='JSON file to write')
+    run_parser.add_argument('-f', '--fixture', action='append',
+                            choices=sorted(FIXTURES),
+                            help='fixture to run, may be repeated '
+                                 '(default: all)')
+    run_parser.add_argument('-r', '--repeat', type=int, default=3)
+    compare_parser = commands.add_parser(
+        'compare', help='flag regressions against a baseline')
+    compare_parser.add_argument('baseline')
+    compare_parser.add_argument('current')
+    compare_parser.add_argument('-t', '--threshold', type=float, default=0.1,
+                                help='allowed fractional slowdown')
+    args = parser.parse_args(argv)
+    if args.command == 'run':
+        benchmark = run(args.fixture, repeat=args.repeat)
+        print(_table(benchmark['results']))
+        if args.output:
+            save(benchmark, args.output)
+        return 0
+    elif args.command == 'compare':
+        table = compare(load(args.baseline), load(args.current),
+                        threshold=args.threshold)
+        with pd.option_context('display.max_rows', None,
+                               'display.width', 120):
+            print(table)
+        regressions = table[table['regression']]
+        if len(regressions):
+            print('\n{0} regression(s) beyond {1:.0%}'.format(
+                len(regressions), args.threshold))
+            return 1
+        return 0
+    parser.print_help()
+    return 2
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,318 @@
+import os
+import hashlib
+import tempfile
+import threading
+import datetime as dt
+from collections import OrderedDict
+import numpy as np
+from numpy.lib import recfunctions as rfn
+from fispy.fispy import (QUAD_DTYPE, Asset, Portfolio, first_date,
+                         quad_output)
+from fispy.batch import BatchPortfolio
+from fispy.recompute import iter_process
+
+
+def portfolio_key(assets, prd, **settings):
+    """Canonical hash of a projection: the fields of every asset (in the
+    sorted order Asset.__iter__ gives them), the start date, prd and any
+    Portfolio settings. The order of the assets is kept, as it changes the
+    order the sums are taken in.
+
+    :param assets: list of Asset objects or Asset kwargs dictionaries
+    :param prd: integer number of months
+    :param settings: Portfolio attributes to set, e.g. stock_growth
+    :returns: string hex digest
+    """
+    values = []
+    assets = [asset if isinstance(asset, Asset) else Asset(**asset)
+              for asset in assets]
+    for asset in assets:
+        for field, value in asset:
+            if isinstance(value, dt.date):
+                value = value.isoformat()
+            values.append(value)
+    start = first_date(assets).isoformat() if assets else None
+    text = repr((values, start, prd, sorted(settings.items())))
+    return hashlib.sha1(text.encode()).hexdigest()
+
+
+class ResultCache(object):
+    """Memoizes gen_quads() results by portfolio_key(). Results are held
+    as read only QUAD_DTYPE record arrays in a least recently used store
+    bounded by their total bytes, and optionally also saved as .npy files
+    in a directory, which are memory mapped back in when they are not held
+    in memory.
+
+    'records' and 'dict' hits are views of the cached array, and cost
+    little more than hashing the key. A 'frame' is built once per entry and
+    handed out as a shallow copy. The cache can be shared between threads;
+    the projections themselves run outside of its lock.
+
+    :param max_bytes: integer bytes the results held in memory may take
+    :param directory: path of the on-disk tier, None for memory only
+    :returns: A ResultCache instance
+    """
+
+    def __init__(self, max_bytes=64 * 2 ** 20, directory=None):
+        self.max_bytes = max_bytes
+        self.directory = directory
+        if directory is not None and not os.path.isdir(directory):
+            os.makedirs(directory)
+        self._entries = OrderedDict()
+        self._lock = threading.RLock()
+        self.nbytes = 0
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        return key in self._entries or os.path.exists(self._path(key))
+
+    @property
+    def stats(self):
+        return {'hits': self.hits, 'disk_hits': self.disk_hits,
+                'misses': self.misses, 'evictions': self.evictions,
+                'entries': len(self._entries), 'nbytes': self.nbytes}
+
+    def _path(self, key):
+        if self.directory is None:
+            return ''
+        return os.path.join(self.directory, key + '.npy')
+
+    def _evict(self):
+        """Drop the least recently used results until the rest fit into
+        max_bytes.
+        """
+        while self.nbytes > self.max_bytes and self._entries:
+            key, entry = self._entries.popitem(last=False)
+            self.nbytes -= entry['nbytes']
+            self.evictions += 1
+
+    def _store(self, key, quads):
+        entry = {'quads': quads, 'frame': None, 'nbytes': quads.nbytes}
+        self._entries[key] = entry
+        self.nbytes += entry['nbytes']
+        self._evict()
+        return entry
+
+    def _save(self, key, quads):
+        """Write quads to the disk tier, atomically"""
+        handle, path = tempfile.mkstemp(dir=self.directory, suffix='.npy')
+        with os.fdopen(handle, 'wb') as f:
+            np.save(f, quads)
+        os.replace(path, self._path(key))
+
+    def _output(self, key, entry, output):
+        """entry presented as output. The bytes of a frame are only counted
+        while the entry is still held, as one that has been evicted
+        already is never subtracted again.
+        """
+        if output != 'frame':
+            return quad_output(entry['quads'], output)
+        if entry['frame'] is None:
+            entry['frame'] = quad_output(entry['quads'], 'frame')
+            if self._entries.get(key) is entry:
+                extra = int(entry['frame'].memory_usage(deep=True).sum())
+                entry['nbytes'] += extra
+                self.nbytes += extra
+                self._evict()
+        return entry['frame'].copy(deep=False)
+
+    def _lookup(self, key):
+        """Cached quads of key, from memory or the disk tier, or None"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry
+        path = self._path(key)
+        if path and os.path.exists(path):
+            quads = np.load(path, mmap_mode='r')
+            with self._lock:
+                self.disk_hits += 1
+                return self._store(key, quads)
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def _add(self, key, quads):
+        """Cache the quads of a projection that has just been run"""
+        quads = np.asarray(quads)
+        quads.flags.writeable = False
+        if self.directory is not None:
+            self._save(key, quads)
+        with self._lock:
+            return self._store(key, quads)
+
+    @staticmethod
+    def _portfolio(assets, prd, settings):
+        portfolio = Portfolio(*[Asset(**dict(asset)) for asset in assets],
+                              prd=prd)
+        for name, value in settings.items():
+            setattr(portfolio, name, value)
+        return portfolio
+
+    def quads(self, assets, prd=60, output='frame', **settings):
+        """gen_quads() of a Portfolio of assets, from the cache when the
+        same projection has been run before. The assets are copied, so the
+        ones passed in are never changed.
+
+        :param assets: list of Asset objects or Asset kwargs dictionaries
+        :param prd: integer number of months to run
+        :param output: 'frame', 'dict' or 'records', see quad_output()
+        :param settings: Portfolio attributes to set before running, e.g.
+                         buy_property_threshold=100
+        :returns: a pd.DataFrame object (or dict, or np.recarray)
+        """
+        key = portfolio_key(assets, prd, **settings)
+        entry = self._lookup(key)
+        if entry is None:
+            portfolio = self._portfolio(assets, prd, settings)
+            entry = self._add(key, portfolio.gen_quads(output='records'))
+        with self._lock:
+            return self._output(key, entry, output)
+
+    def iter_quads(self, assets, prd=60, chunk=12, output='dict',
+                   **settings):
+        """Streaming quads(): a cached projection is yielded whole, others
+        chunk by chunk as Portfolio.iter_quads() runs them, and are cached
+        once the last chunk is done.
+
+        :param chunk: integer number of months per chunk
+        :returns: generator of pd.DataFrame objects (or dicts, or
+                  np.recarrays)
+        """
+        key = portfolio_key(assets, prd, **settings)
+        entry = self._lookup(key)
+        if entry is None:
+            portfolio = self._portfolio(assets, prd, settings)
+            for part in portfolio.iter_quads(chunk=chunk, output=output):
+                yield part
+            self._add(key, portfolio._run[0])
+        else:
+            with self._lock:
+                whole = self._output(key, entry, output)
+            yield whole
+
+    def scenario_quads(self, scenarios, prd=60, output='dict', **settings):
+        """The quads of several scenarios in one result, with a scenario
+        column giving the index of the scenario each quad belongs to, e.g.
+        to plot them all from one ColumnDataSource. Scenarios missing from
+        the cache are run together as one BatchPortfolio. A scenario that
+        cannot pay its way is cut short at that month, and not cached.
+
+        :param scenarios: list of lists of Asset objects or Asset kwargs
+                          dictionaries
+        :param prd: integer number of months to run
+        :param output: 'frame', 'dict' or 'records', see quad_output()
+        :param settings: Portfolio attributes to set before running
+        :returns: a pd.DataFrame object (or dict, or np.recarray) with an
+                  extra integer 'scenario' column
+        """
+        keys = [portfolio_key(assets, prd, **settings)
+                for assets in scenarios]
+        found = [self._lookup(key) for key in keys]
+        quads = [None if entry is None else entry['quads']
+                 for entry in found]
+        missing = [i for i, entry in enumerate(found) if entry is None]
+        if missing:
+            result = BatchPortfolio(*[
+                self._portfolio(scenarios[i], prd, settings)
+                for i in missing]).run()
+            for j, i in enumerate(missing):
+                quads[i] = result.quads(j, output='records')
+                if result.insolvent[j] < 0:
+                    self._add(keys[i], quads[i])
+        return self._joined(quads, output)
+
+    def iter_scenario_quads(self, scenarios, prd=60, chunk=12,
+                            output='dict', process=False, **settings):
+        """Streaming scenario_quads(): the first chunk holds the cached
+        scenarios whole, and every chunk the next chunk months of the
+        others, run together as one BatchPortfolio. They are cached once
+        the last chunk is done.
+
+        :param chunk: integer number of months per chunk
+        :param process: run the BatchPortfolio in a worker process, see
+                        fispy.recompute.iter_process(), so that the GIL of
+                        this one stays free, e.g. for the Bokeh server
+        :returns: generator of pd.DataFrame objects (or dicts, or
+                  np.recarrays) with an extra integer 'scenario' column
+        """
+        keys = [portfolio_key(assets, prd, **settings)
+                for assets in scenarios]
+        found = [self._lookup(key) for key in keys]
+        missing = [i for i, entry in enumerate(found) if entry is None]
+        quads = [None if entry is None else entry['quads']
+                 for entry in found]
+        if not missing:
+            yield self._joined(quads, output)
+            return
+        run = ([[dict(asset) for asset in scenarios[i]] for i in missing],
+               prd, chunk, settings)
+        if process:
+            chunks = iter_process(_batch_chunks, *run)
+        else:
+            chunks = _batch_chunks(*run)
+        parts = [[] for i in missing]
+        for chunk_quads, insolvent in chunks:
+            for j, i in enumerate(missing):
+                quads[i] = chunk_quads[j]
+                parts[j].append(chunk_quads[j])
+            yield self._joined(quads, output)
+            quads = [q[:0] for q in quads]
+        for j, i in enumerate(missing):
+            if insolvent[j] < 0:
+                self._add(keys[i], np.concatenate(parts[j]))
+
+    @staticmethod
+    def _joined(quads, output):
+        """One list of quads per scenario joined, with a scenario column"""
+        scenario = np.repeat(np.arange(len(quads)), [len(q) for q in quads])
+        joined = quad_output(np.concatenate(quads).view(QUAD_DTYPE),
+                             output)
+        if output == 'records':
+            return rfn.append_fields(joined, 'scenario', scenario,
+                                     usemask=False, asrecarray=True)
+        joined['scenario'] = scenario
+        return joined
+
+    def clear(self, disk=False):
+        """Drop the results held in memory, and those on disk too if disk"""
+        with self._lock:
+            self._entries.clear()
+            self.nbytes = 0
+        if disk and self.directory is not None:
+            for name in os.listdir(self.directory):
+                if name.endswith('.npy'):
+                    os.remove(os.path.join(self.directory, name))
+
+
+def _batch_chunks(scenarios, prd, chunk, settings):
+    """Run scenarios together as one BatchPortfolio, yielding the records
+    of each scenario for every chunk months, and whether they are
+    insolvent so far. A module level function, so that iter_process() can
+    run it in a worker process.
+    """
+    batch = BatchPortfolio(*[ResultCache._portfolio(assets, prd, settings)
+                             for assets in scenarios])
+    start = 0
+    for result in batch.iter_run(chunk=chunk):
+        yield ([result.quads(j, output='records', start=start)
+                for j in range(len(scenarios))], result.insolvent)
+        start += chunk
+
+
+_default_cache = ResultCache()
+
+
+def default_cache():
+    """The ResultCache shared by everything in this process, e.g. by every
+    session of the Bokeh app.
+    """
+    return _default_cache
@@ -1,34 +1,667 @@
+import ast
+import copy
 import numpy as np
 import pandas as pd
 import datetime as dt
-from dateutil.relativedelta import relativedelta
+from functools import lru_cache, partial
+from fispy.amortization import amortize
+
+# Property bought whenever net investments pass the buy threshold
+NEW_PROPERTY = {'kind': 'real estate',
+                'debt': 70,
+                'value': 150,
+                'monthly_repayment': 0.5,
+                'monthly_income': 0.8,
+                'pay_debt_asap': True}
+
+# (not FI, FI) colours of the debt, cash, stock and net worth quads
+QUAD_COLORS = (('#ff944d', '#e65c00'),
+               ('#00e600', '#008000'),
+               ('#e600e6', '#800080'),
+               ('#b3cccc', '#75a3a3'))
+
+# Colours of the quads by code, the code of quad k is 2 * k + fi
+QUAD_PALETTE = tuple(color for pair in QUAD_COLORS for color in pair)
+
+# Columns of the quad plot data, one row per quad
+QUAD_DTYPE = np.dtype([('left', 'M8[D]'), ('right', 'M8[D]'),
+                       ('top', 'f8'), ('bottom', 'f8'), ('color', 'i1')])
+
+QUAD_OUTPUTS = ('frame', 'dict', 'records')
+
+
+ASSET_KINDS = ('real estate', 'stocks', 'job', 'cash')
+
+# Portfolio methods run, in order, by Portfolio.update_monthly()
+MONTHLY_PHASES = ('next_month', 'monthly_buy', 'monthly_ingres',
+                  'monthly_egres', 'monthly_repay', 'monthly_debt',
+                  'count_cash', 'investment_portfolio', 'calc_net_worth',
+                  'check_fi')
+
+# Portfolio attributes recorded every month by Portfolio.run_until() and
+# BatchPortfolio.run()
+STATE_FIELDS = ('monthly_income', 'monthly_expenses', 'debt', 'cash',
+                'net_investments', 'networth', 'passive_income', 'fi')
+
+
+class MonthTimeline(object):
+    """The dates a projection steps through, one month apart, starting
+    at start. Index k is the date after k monthly steps, so a projection of
+    prd months needs prd + 2 entries (the last one is the right edge of the
+    final month). As with repeatedly adding relativedelta(months=1), the
+    day of the month is clipped to the end of short months and stays
+    clipped.
+
+    Timelines are shared between portfolios, so the arrays are read only.
+
+    :param start: dt.date of the first entry
+    :param prd: integer number of monthly steps
+    :returns: A MonthTimeline instance with the months as datetime64[M],
+              the days as datetime64[D] and the dates as a tuple of
+              dt.date (or dt.datetime, like start) objects
+    """
+
+    def __init__(self, start, prd):
+        self.start = start
+        self.months = np.datetime64(start, 'M') + np.arange(prd + 2)
+        first = self.months.astype('datetime64[D]')
+        month_days = (self.months + 1).astype('datetime64[D]') - first
+        day = np.minimum.accumulate(
+            np.minimum(month_days.astype(int), start.day))
+        self.days = first + (day - 1)
+        self.months.flags.writeable = False
+        self.days.flags.writeable = False
+        dates = self.days.tolist()
+        if isinstance(start, dt.datetime):
+            dates = [dt.datetime.combine(date, start.timetz())
+                     for date in dates]
+        self.dates = tuple(dates)
+
+    def __len__(self):
+        return len(self.dates)
+
+
+def quad_color_codes(fi):
+    """Codes into QUAD_PALETTE of the debt, cash, stock and net worth
+    quads of each month.
+
+    :param fi: np.array of bool, whether FI was reached each month
+    :returns: np.array of int8, four codes per month
+    """
+    return (2 * np.arange(4, dtype='i1') + fi[:, None]).ravel()
+
+
+def state_quads(days, debt, cash, net_investments, networth, fi):
+    """Quads of a run from its monthly state, as quad_positions() would
+    place them.
+
+    :param days: np.array of M8[D], the first day of every month run and of
+                 the month after, one more than there are months
+    :param debt, cash, net_investments, networth: np.array of each month's
+                                                   value
+    :param fi: np.array of bool, whether FI was reached each month
+    :returns: np.array of QUAD_DTYPE
+    """
+    n = len(fi)
+    quads = np.empty(4 * n, QUAD_DTYPE)
+    stocks = cash + net_investments
+    quads['bottom'].reshape(n, 4)[:] = np.column_stack(
+        [debt * -1, np.zeros(n), cash, stocks])
+    quads['top'].reshape(n, 4)[:] = np.column_stack(
+        [np.zeros(n), cash, stocks, networth])
+    quads['left'] = np.repeat(days[:n], 4)
+    quads['right'] = np.repeat(days[1:n + 1], 4)
+    quads['color'] = quad_color_codes(fi)
+    return quads
+
+
+def quad_output(quads, output='frame'):
+    """Present a QUAD_DTYPE record array of quads for plotting.
+
+    :param quads: np.array of QUAD_DTYPE
+    :param output: 'frame' for a pd.DataFrame with a categorical color
+                   column, 'dict' for a dictionary of arrays for a Bokeh
+                   ColumnDataSource (with color strings), or 'records' for
+                   the record array itself, color codes and all
+    :returns: pd.DataFrame, dict or np.recarray
+    """
+    if output == 'records':
+        return quads.view(np.recarray)
+    color = quads['color']
+    if output == 'dict':
+        columns = dict((name, quads[name])
+                       for name in ('left', 'right', 'top', 'bottom'))
+        columns['color'] = np.array(QUAD_PALETTE)[color]
+        return columns
+    elif output == 'frame':
+        return pd.DataFrame({'left': quads['left'], 'right': quads['right'],
+                             'top': quads['top'], 'bottom': quads['bottom'],
+                             'color': pd.Categorical.from_codes(
+                                 color, QUAD_PALETTE)})
+    raise ValueError("output should be one of {0}, not {1}".format(
+        QUAD_OUTPUTS, output))
+
+
+@lru_cache(maxsize=256)
+def month_timeline(start, prd):
+    """Cached MonthTimeline of prd monthly steps from start, shared by
+    every portfolio with the same (start, prd).
+    """
+    return MonthTimeline(start, prd)
+
+
+def first_date(assets):
+    """Date a Portfolio of assets starts on: the earliest start_date, or
+    today when none of them has one.
+    """
+    starts = [asset.start_date for asset in assets
+              if asset.start_date is not None]
+    if not starts:
+        return dt.date.today()
+    return min(starts)
+
+
+def fi_reached(portfolio):
+    """Stop condition: FI has been reached"""
+    return portfolio.fi
+
+
+def debt_cleared(portfolio):
+    """Stop condition: no debt is left"""
+    return portfolio.debt <= 0
+
+
+def networth_above(threshold):
+    """Stop condition: net worth is above threshold"""
+    def condition(portfolio):
+        return portfolio.networth > threshold
+    return condition
+
+
+def cash_below(amount):
+    """Stop condition: cash has fallen below amount"""
+    def condition(portfolio):
+        return portfolio.cash < amount
+    return condition
+
+
+# Stop conditions of Portfolio.run_until() that can be given by name
+STOP_CONDITIONS = {'fi': fi_reached, 'debt_free': debt_cleared}
+
+
+class RunResult(object):
+    """Outcome of Portfolio.run_until().
+
+    :param states: pd.DataFrame of the STATE_FIELDS of every month run,
+                   indexed by date
+    :param month: integer month the condition held in, or the month the
+                  Portfolio could not pay its way in, None otherwise
+    :param date: dt.date of that month, or None
+    :param error: the message of the failed check when insolvent, or None
+    """
+
+    def __init__(self, states, month, date, error=None):
+        self.states = states
+        self.month = month
+        self.date = date
+        self.error = error
+
+    @property
+    def insolvent(self):
+        return self.error is not None
+
+    @property
+    def reached(self):
+        """Whether the stop condition held"""
+        return self.month is not None and self.error is None
+
+
+class Trace(object):
+    """Full monthly record of a Portfolio.trace() run: the Portfolio state
+    and the value and debt of every asset, kept as (month, asset) arrays.
+    Assets bought during the run have NaN before the month they are bought
+    in, as do fields an asset does not have.
+
+    :param states: pd.DataFrame of the STATE_FIELDS of every month run,
+                   indexed by date
+    :param value: np.array of shape (months, assets)
+    :param debt: np.array of shape (months, assets)
+    :param kinds: tuple of the kind of each asset
+    :param days: np.array of M8[D], the first day of every month run and of
+                 the month after
+    """
+
+    def __init__(self, states, value, debt, kinds, days):
+        self.states = states
+        self.value = value
+        self.debt = debt
+        self.kinds = kinds
+        self.days = days
+
+    def __len__(self):
+        return len(self.states)
+
+    def quads(self, output='frame'):
+        """The gen_quads() result of the run, without running it again.
+
+        :param output: 'frame', 'dict' or 'records', see quad_output()
+        :returns: a pd.DataFrame object (or dict, or np.recarray)
+        """
+        states = self.states
+        quads = state_quads(self.days, states['debt'].to_numpy(),
+                            states['cash'].to_numpy(),
+                            states['net_investments'].to_numpy(),
+                            states['networth'].to_numpy(),
+                            states['fi'].to_numpy())
+        return quad_output(quads, output)
+
+    def to_frame(self):
+        """The whole trace in long format, one row per month, asset and
+        field. The Portfolio STATE_FIELDS have asset -1 and kind
+        'portfolio'; fi is given as 0 or 1.
+
+        :returns: a pd.DataFrame of date, asset, kind, field and value
+        """
+        months, width = self.value.shape
+        dates = self.days[:months]
+        n_fields = len(STATE_FIELDS)
+        frames = [pd.DataFrame({
+            'date': np.repeat(dates, n_fields),
+            'asset': -1,
+            'kind': 'portfolio',
+            'field': np.tile(STATE_FIELDS, months),
+            'value': self.states.to_numpy(dtype=float).ravel()})]
+        for field in ('value', 'debt'):
+            values = getattr(self, field)
+            frames.append(pd.DataFrame({
+                'date': np.repeat(dates, width),
+                'asset': np.tile(np.arange(width), months),
+                'kind': np.tile(np.array(self.kinds, dtype=object), months),
+                'field': field,
+                'value': values.ravel()}))
+        frame = pd.concat(frames, ignore_index=True)
+        frame['kind'] = frame['kind'].astype('category')
+        frame['field'] = frame['field'].astype('category')
+        return frame.sort_values(['date', 'asset'], kind='stable',
+                                 ignore_index=True)
+
+
+class Rule(object):
+    """Base of the monthly buy and sell rules of a Portfolio. Each rule
+    runs in the monthly_buy phase, through apply() on a Portfolio and
+    through apply_batch() on a BatchPortfolio, where it acts on every
+    scenario at once with masks over the asset arrays. Rules are compared
+    and hashed by their parameters.
+    """
+
+    def _params(self):
+        return tuple(sorted(vars(self).items()))
+
+    def __repr__(self):
+        return '{0}({1})'.format(type(self).__name__, ', '.join(
+            '{0}={1!r}'.format(name, value)
+            for name, value in self._params()))
+
+    def __eq__(self, other):
+        return (type(self) is type(other) and
+                self._params() == other._params())
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __hash__(self):
+        return hash((type(self).__name__, self._params()))
+
+    def apply(self, portfolio):
+        raise NotImplementedError
+
+    def apply_batch(self, batch):
+        raise NotImplementedError
+
+
+class BuyProperty(Rule):
+    """Buy a NEW_PROPERTY in the months net investments are above a
+    threshold, selling shares to pay the deposit.
+
+    :param threshold: float, or None for the buy_property_threshold of the
+                      Portfolio
+    :param pro_rata: bool, sell from every stock asset in proportion to its
+                     value, rather than from each in turn
+    """
+
+    def __init__(self, threshold=None, pro_rata=False):
+        self.threshold = threshold
+        self.pro_rata = pro_rata
+
+    def apply(self, portfolio):
+        threshold = self.threshold
+        if threshold is None:
+            threshold = portfolio.buy_property_threshold
+        if portfolio.net_investments > threshold:
+            portfolio.buy_property(Asset(start_date=portfolio.date,
+                                         **NEW_PROPERTY),
+                                   pro_rata=self.pro_rata)
+
+    def apply_batch(self, batch):
+        threshold = self.threshold
+        if threshold is None:
+            threshold = batch.buy_property_threshold
+        buy = batch.net_investments > threshold
+        if buy.any():
+            batch.buy_property(buy, pro_rata=self.pro_rata)
+
+
+class Rebalance(Rule):
+    """Every few months, move money between the (first) cash asset and the
+    stock assets so stocks hold a target fraction of the two together.
+    Stocks are bought and sold in proportion to their values.
+
+    :param stocks: fraction of the cash and stocks to hold in stocks
+    :param every: integer number of months between rebalances
+    """
+
+    def __init__(self, stocks=0.6, every=12):
+        assert 0 <= stocks <= 1, "Error: stocks must be a fraction"
+        assert every > 0, "Error: every must be at least one month"
+        self.stocks = stocks
+        self.every = every
+
+    def apply(self, portfolio):
+        if portfolio._step % self.every:
+            return
+        cash = portfolio._by_kind['cash']
+        stocks = portfolio._by_kind['stocks']
+        if not cash or not stocks:
+            return
+        held = 0.0
+        for asset in stocks:
+            held += asset.value
+        move = self.stocks * (cash[0].value + held) - held
+        if move > 0:
+            cash[0].value -= move
+            if held > 0:
+                for asset in stocks:
+                    asset.value += move * asset.value / held
+            else:
+                stocks[0].value += move
+        elif move < 0:
+            portfolio.sell_shares(-move, pro_rata=True)
+            cash[0].value += -move
+
+    def apply_batch(self, batch):
+        if batch.month % self.every:
+            return
+        value = batch.asset_value
+        held = np.add.reduce(np.where(batch.is_stock, value, 0.0), axis=0)
+        scenarios = np.arange(batch.n)
+        cash_row = batch.is_cash.argmax(axis=0)
+        able = batch.is_cash.any(axis=0) & batch.is_stock.any(axis=0)
+        cash = value[cash_row, scenarios]
+        move = np.where(able, self.stocks * (cash + held) - held, 0.0)
+        buy = move > 0
+        if buy.any():
+            value[cash_row[buy], scenarios[buy]] -= move[buy]
+            spread = batch.is_stock & (buy & (held > 0))
+            with np.errstate(divide='ignore', invalid='ignore'):
+                np.add(value, move * value / held, out=value, where=spread)
+            empty = buy & ~(held > 0)
+            stock_row = batch.is_stock.argmax(axis=0)
+            value[stock_row[empty], scenarios[empty]] += move[empty]
+        sell = move < 0
+        if sell.any():
+            batch.sell_shares(sell, -move, pro_rata=True)
+            value[cash_row[sell], scenarios[sell]] += -move[sell]
+
+
+# rules of a new Portfolio: buy a property whenever the threshold is passed
+DEFAULT_RULES = (BuyProperty(),)
+
+
+def parse_rules(text):
+    """Rules back from the repr() of a tuple of them, e.g. as saved by
+    PortfolioStore. Nothing is evaluated: only calls of Rule subclasses
+    with literal keyword arguments are accepted.
+
+    :param text: string such as "(BuyProperty(pro_rata=False,
+                 threshold=None),)"
+    :returns: tuple of Rule objects
+    """
+    classes = dict((cls.__name__, cls) for cls in Rule.__subclasses__())
+    rules = []
+    try:
+        tree = ast.parse(text, mode='eval').body
+        calls = tree.elts if isinstance(tree, ast.Tuple) else [tree]
+        for call in calls:
+            if call.args:
+                raise ValueError("rule parameters must be keywords")
+            params = dict((keyword.arg, ast.literal_eval(keyword.value))
+                          for keyword in call.keywords)
+            rules.append(classes[call.func.id](**params))
+    except (SyntaxError, AttributeError, KeyError, ValueError) as error:
+        raise ValueError("Cannot read rules from {0!r}: {1}".format(
+            text, error))
+    return tuple(rules)
+
+
+# Events a Portfolio records in its EventLog, stored by their index here
+EVENT_KINDS = ('assets added', 'property bought', 'shares sold',
+               'debt cleared', 'fi reached', 'fi lost')
+
+EVENT_DTYPE = np.dtype([('step', 'i4'), ('event', 'i1'), ('asset', 'i4'),
+                        ('amount', 'f8')])
+
+
+def print_event(step, event, asset, amount):
+    """EventLog sink printing each event as it is recorded"""
+    line = "month {0}: {1}".format(step, event)
+    if asset >= 0:
+        line += " (asset {0})".format(asset)
+    if not np.isnan(amount):
+        line += " {0:3.2f}".format(amount)
+    print(line)
+
+
+class EventLog(object):
+    """Structured record of what happened during a simulation, kept in a
+    preallocated ring buffer of EVENT_DTYPE (the oldest events are
+    overwritten once it is full). Nothing is printed unless a sink such as
+    print_event is added to self.sinks.
+
+    :param capacity: integer number of events kept
+    :returns: An EventLog instance
+    """
+
+    def __init__(self, capacity=256):
+        self._events = np.zeros(capacity, EVENT_DTYPE)
+        self._total = 0
+        self._first = 0
+        self.sinks = []
+
+    def record(self, step, event, asset=-1, amount=np.nan):
+        """Add an event.
+
+        :param step: integer month of the simulation
+        :param event: one of EVENT_KINDS
+        :param asset: integer index of the asset involved, -1 for none
+        :param amount: float amount involved, NaN for none
+        """
+        capacity = len(self._events)
+        self._events[self._total % capacity] = (
+            step, EVENT_KINDS.index(event), asset, amount)
+        self._total += 1
+        if self._total - self._first > capacity:
+            self._first = self._total - capacity
+        for sink in self.sinks:
+            sink(step, event, asset, amount)
+
+    def __len__(self):
+        return self._total - self._first
+
+    @property
+    def dropped(self):
+        """Number of events overwritten in the full ring buffer"""
+        return self._first
+
+    def truncate(self, total):
+        """Forget the events recorded after the first total ones, when a
+        simulation is rewound.
+        """
+        self._total = total
+        self._first = min(self._first, total)
+
+    def to_array(self):
+        """:returns: np.array of EVENT_DTYPE, oldest event first"""
+        index = np.arange(self._first, self._total) % len(self._events)
+        return self._events[index]
+
+    def query(self, event):
+        """:returns: np.array of EVENT_DTYPE of one kind of event"""
+        events = self.to_array()
+        return events[events['event'] == EVENT_KINDS.index(event)]
+
+    def to_frame(self, dates=None):
+        """The events as a pd.DataFrame.
+
+        :param dates: sequence of the date of each step, to add a date
+                      column
+        :returns: a pd.DataFrame object
+        """
+        events = self.to_array()
+        frame = pd.DataFrame({
+            'step': events['step'],
+            'event': pd.Categorical.from_codes(events['event'], EVENT_KINDS),
+            'asset': events['asset'],
+            'amount': events['amount']})
+        if dates is not None:
+            frame.insert(0, 'date', [dates[step] for step in events['step']])
+        return frame
 
 
 class Asset(object):
     """Asset items are essentially dictionaries, and should be of
     a kind = 'real_estate', 'stocks', 'job', or 'cash'. There can be
     infite assets in a Portfolio, but there should be only one cash
-    Asset, which should specify a maximum amount of cash to hold. """
-    def __init__(self, **kwargs):
-        self.kind = kwargs.get('kind')
-        assert self.kind.lower() in [None, 'real estate', 'stocks',
-                                     'job', 'cash']
-        self.monthly_income = kwargs.get('monthly_income')
-        self.monthly_expenses = kwargs.get('monthly_expenses')
-        self.start_date = kwargs.get('start_date', dt.datetime.now().date())
-        self.end_date = kwargs.get('end_date')
-        self.debt = kwargs.get('debt')
-        self.value = kwargs.get('value')
-        self.max_cash = kwargs.get('max_cash')
-        self.monthly_repayment = kwargs.get('monthly_repayment')
-        self.pay_debt_asap = kwargs.get('pay_debt_asap')
+    Asset, which should specify a maximum amount of cash to hold.
+
+    An asset only takes part in the months from its start_date (or from
+    the first month, without one) up to, but not including, its end_date.
+    Other keyword arguments are ignored. """
+    __slots__ = ('kind', 'monthly_income', 'monthly_expenses', 'start_date',
+                 'end_date', 'debt', 'value', 'max_cash',
+                 'monthly_repayment', 'pay_debt_asap')
+    _fields = tuple(sorted(__slots__))
+
+    def __init__(self, kind=None, monthly_income=None, monthly_expenses=None,
+                 start_date=None, end_date=None, debt=None, value=None,
+                 max_cash=None, monthly_repayment=None, pay_debt_asap=None,
+                 **kwargs):
+        self.kind = kind.lower()
+        assert self.kind in ASSET_KINDS, "Unknown asset kind: {0}".format(
+            self.kind)
+        self.monthly_income = monthly_income
+        self.monthly_expenses = monthly_expenses
+        self.start_date = start_date
+        self.end_date = end_date
+        self.debt = debt
+        self.value = value
+        self.max_cash = max_cash
+        self.monthly_repayment = monthly_repayment
+        self.pay_debt_asap = pay_debt_asap
 
     def __str__(self):
         return str("Asset = {0}".format(self.kind))
 
     def __iter__(self):
-        for key, value in sorted(self.__dict__.items()):
-            yield key, value
+        for key in self._fields:
+            yield key, getattr(self, key)
+
+
+class AssetTable(object):
+    """Struct-of-arrays store for many Assets: one NumPy column per Asset
+    field instead of one Python object per asset. kind is held as int8
+    codes into ASSET_KINDS, missing numbers as NaN and missing dates as NaT.
+    Indexing or iterating over the table gives ordinary Asset objects, so
+    rows can be passed straight to a Portfolio.
+
+    :param columns: dict of Asset field name to a column of values
+    :returns: An AssetTable instance
+    """
+    _numbers = ('monthly_income', 'monthly_expenses', 'debt', 'value',
+                'max_cash', 'monthly_repayment')
+    _dates = ('start_date', 'end_date')
+
+    def __init__(self, **columns):
+        kind = pd.Series(columns['kind'], dtype=object).str.lower()
+        codes = pd.Index(ASSET_KINDS).get_indexer(kind)
+        assert (codes >= 0).all(), "Unknown asset kind: {0}".format(
+            kind[codes < 0].iloc[0])
+        self.kind = codes.astype(np.int8)
+        n = len(codes)
+        for name in self._numbers:
+            values = columns.get(name, np.full(n, np.nan))
+            setattr(self, name, np.asarray(pd.Series(values, dtype=float)))
+        for name in self._dates:
+            values = columns.get(name, [None] * n)
+            setattr(self, name, pd.to_datetime(pd.Series(
+                values, dtype=object)).to_numpy('datetime64[D]'))
+        values = pd.Series(columns.get('pay_debt_asap', np.zeros(n)),
+                           dtype=object)
+        self.pay_debt_asap = np.asarray(values.notna() & values.astype(bool))
+
+    @classmethod
+    def from_frame(cls, frame):
+        """Build a table from a pd.DataFrame with one column per field"""
+        return cls(**dict((name, frame[name]) for name in Asset._fields
+                          if name in frame))
+
+    @classmethod
+    def from_records(cls, records):
+        """Build a table from a list of Asset kwargs dictionaries"""
+        return cls.from_frame(pd.DataFrame.from_records(records))
+
+    @classmethod
+    def from_assets(cls, assets):
+        """Build a table from a list of Asset objects"""
+        return cls.from_records([dict(asset) for asset in assets])
+
+    def __len__(self):
+        return len(self.kind)
+
+    @property
+    def nbytes(self):
+        """Memory held by the columns"""
+        return sum(getattr(self, name).nbytes for name in Asset._fields)
+
+    def _row(self, i):
+        kwargs = {'kind': ASSET_KINDS[self.kind[i]],
+                  'pay_debt_asap': bool(self.pay_debt_asap[i])}
+        for name in self._numbers:
+            value = getattr(self, name)[i]
+            if not np.isnan(value):
+                kwargs[name] = value.item()
+        for name in self._dates:
+            value = getattr(self, name)[i]
+            if not np.isnat(value):
+                kwargs[name] = value.item()
+        return kwargs
+
+    def __getitem__(self, key):
+        """Asset at row key, or the column of values for a field name"""
+        if isinstance(key, str):
+            return getattr(self, key)
+        return Asset(**self._row(key))
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    def to_frame(self):
+        """Columns as a pd.DataFrame, with kind names rather than codes"""
+        frame = pd.DataFrame(dict((name, self[name])
+                                  for name in Asset._fields),
+                             columns=Asset._fields)
+        frame['kind'] = np.array(ASSET_KINDS)[self.kind]
+        return frame
 
 
 class Portfolio(object):
@@ -36,18 +669,44 @@ class Portfolio(object):
     with addNewAsset() function, or can initilize object with a
     list of asset objects.
 
+    Assets are indexed by kind as they are added, and the incomes and
+    expenses are summed once, so the monthly steps only visit the assets
+    they act on. Assets should be added with add_new_asset() rather than
+    appended to self.assets, to keep the index up to date, and fields of
+    an Asset changed in place only count once reindex() is called (edit()
+    does this itself).
+
+    What is bought and sold each month is decided by self.rules, a tuple of
+    Rule objects, DEFAULT_RULES unless it is changed.
+
+    Only the assets active in a month, those between their start_date and
+    end_date, are indexed. The dates are held as arrays, and which assets
+    are active is only worked out again in the months one of those dates
+    is passed. The Portfolio starts on the earliest start_date, or today
+    if no asset has one.
+
+    Once keep_checkpoints is set, which the first edit() does, gen_quads()
+    saves the full state every checkpoint_every months, so edit() can
+    change an asset from a later month on and rerun only the months after
+    the nearest checkpoint. Until then only the start of a run is saved,
+    and runs that are never edited do not pay for the copies.
+
     :param Asset: n number of Asset objects
     :param prd: integer indicating number of months to run
+    :param verbose: bool, print the events of self.events as they happen
     :returns: A Portfolio instance
     """
 
-    def __init__(self, *assets, prd=60):
-        self.assets = []
-        print("{0} items passed".format(len(assets)))
+    def __init__(self, *assets, prd=60, verbose=False):
+        self.assets = list(assets)
+        self._clear_index()
+        self._index_assets(self.assets)
+        self._events = None
+        self._added = len(assets)
+        if verbose:
+            self._new_events(print_event)
         if assets:
-            for asset in assets:
-                self.assets.append(asset)
-            self.date = min([asset.start_date for asset in self.assets])
+            self.date = first_date(assets)
         self.monthly_income = 0
         self.monthly_expenses = 0
         self.net_investments = 0
@@ -58,48 +717,82 @@ class Portfolio(object):
         self.networth = 0
         self.fi = False
         self.buy_property_threshold = 80
+        self.stock_growth = 1.00333
+        self.rules = DEFAULT_RULES
         self.passive_income = 0
+        self._step = 0
+        self._timeline = None
+        self.checkpoint_every = 12
+        self.keep_checkpoints = False
+        self._hooks = None
+        self.edits = {}
+        self._checkpoints = {}
+        self._run = None
+        self._active = None
+        self._windows = None
+        self._next_switch = 0
+
+    @property
+    def events(self):
+        """EventLog of the Portfolio, made when it is first needed"""
+        if self._events is None:
+            self._new_events()
+        return self._events
 
-    def buy_property(self, asset):
+    def _new_events(self, *sinks):
+        self._events = EventLog()
+        self._events.sinks.extend(sinks)
+        self._events.record(0, 'assets added', amount=self._added)
+
+    def buy_property(self, asset, pro_rata=False):
         """Subtract value of asset from investments"""
-        print('placeholder function Portfolio.buy_property()')
-        self.sell_shares(amount=asset.value - asset.debt)
+        self.sell_shares(amount=asset.value - asset.debt, pro_rata=pro_rata)
         self.add_new_asset(new_asset=asset)
+        self.events.record(self._step, 'property bought',
+                           len(self.assets) - 1, asset.value)
 
-    def sell_shares(self, amount):
-        """Need a method to handel liquidating a share portfolio"""
+    def sell_shares(self, amount, pro_rata=False):
+        """Need a method to handel liquidating a share portfolio. With
+        pro_rata every stock asset gives up the same fraction of its value.
+        """
         # gather up all stock assets
         # rmv required value from stocks and place in self._temporary_capitol
-        print("placeholder function in Portfolio.sell_shares()")
+        self.events.record(self._step, 'shares sold', amount=amount)
         self._temporary_capitol = amount
-        for asset in self.assets:
-            if asset.kind.lower() == 'stocks':
-                if asset.value > amount:
-                    asset.value -= amount
-                    self._temporary_capitol = amount
+        if pro_rata:
+            total = 0.0
+            for asset in self._by_kind['stocks']:
+                total += asset.value
+            for asset in self._by_kind['stocks']:
+                if total > amount:
+                    asset.value -= amount * asset.value / total
                 else:
-                    # if one asset cant meet all requirements look for more
-                    amount -= asset.value
                     asset.value = 0
+            return
+        for asset in self._by_kind['stocks']:
+            if asset.value > amount:
+                asset.value -= amount
+                self._temporary_capitol = amount
+            else:
+                # if one asset cant meet all requirements look for more
+                amount -= asset.value
+                asset.value = 0
 
     def check_fi(self):
         """Check if FI has been reached. Point at which monthly incoming
         is greater than monthly outgoings before counting wages from jobs.
         """
-        negative = 0
-        positive = 0
-        for asset in self.assets:
-            if asset.monthly_expenses:
-                negative += asset.monthly_expenses
-            if asset.monthly_repayment:
-                negative += asset.monthly_repayment
-            if asset.kind != 'job' and asset.monthly_income:
-                positive += asset.monthly_income
+        negative = self._expense_total + self._repayment_total
+        positive = self._passive_total
         self.passive_income = positive
+        was_fi = self.fi
         if positive > negative:
             self.fi = True
         else:
             self.fi = False
+        if self.fi != was_fi:
+            self.events.record(self._step,
+                               'fi reached' if self.fi else 'fi lost')
 
     def summary(self):
         """Print a summary of the Portfolio instance values of Income, Cash
@@ -115,6 +808,13 @@ class Portfolio(object):
         print("Net worth: {0:3.2f}".format(self.networth))
         print("Passive income: {0:3.2f}".format(self.passive_income))
 
+    def event_frame(self):
+        """The events recorded so far as a pd.DataFrame, with the date of
+        the month each one happened in.
+        """
+        dates = month_timeline(self._calendar().start, self._step).dates
+        return self.events.to_frame(dates=dates)
+
     def add_new_asset(self, new_asset):
         """Add a new Asset() obect to an existing Portfolio instance.
         This will be useful for modifying established portfolios once this is
@@ -124,6 +824,152 @@ class Portfolio(object):
         :returns: Updates Portfolio object
         """
         self.assets.append(new_asset)
+        self._index_assets([new_asset])
+        self._add_window(new_asset)
+
+    def _clear_index(self):
+        self._by_kind = {kind: [] for kind in ASSET_KINDS}
+        self._valued = []
+        self._debtors = []
+        self._income_total = 0
+        self._passive_total = 0
+        self._expense_total = 0
+        self._repayment_total = 0
+
+    def reindex(self):
+        """Pick up Asset fields changed in place, e.g.
+        p.assets[0].monthly_income = 3.0. The kind index, the income,
+        expense and repayment totals and the activation windows are only
+        worked out as assets are added, so until this is called such
+        changes are ignored.
+        """
+        self._reindex()
+        self._windows = None
+        self._next_switch = 0
+
+    def _reindex(self):
+        """Rebuild the kind index and the totals, after asset fields are
+        changed in place. Only the assets active this month (see
+        _switch_windows()) are indexed, so the monthly phases leave the
+        others alone; assets added since the mask was made count as active.
+        """
+        self._clear_index()
+        active = self._active
+        if active is None:
+            self._index_assets(self.assets)
+            return
+        self._index_assets([asset for i, asset in enumerate(self.assets)
+                            if i >= len(active) or active[i]])
+
+    def _window_arrays(self):
+        """start_date and end_date of every asset as datetime64[D] arrays,
+        NaT for none, and the sorted dates any asset starts or ends on.
+        """
+        starts = np.array([asset.start_date for asset in self.assets],
+                          dtype='datetime64[D]')
+        ends = np.array([asset.end_date for asset in self.assets],
+                        dtype='datetime64[D]')
+        changes = np.unique(np.concatenate([starts, ends]))
+        return starts, ends, changes[~np.isnat(changes)]
+
+    def _add_window(self, asset):
+        """Add the window of an asset just added to the window arrays. The
+        windows are only looked at again if it is not active this month,
+        or it ends later on; e.g. a property bought this month needs
+        neither.
+        """
+        if self._windows is None:
+            if self._next_switch == 0:
+                # every window is looked at next month anyway
+                return
+            self._windows = self._window_arrays()
+            starts, ends, changes = self._windows
+            start, end = starts[-1], ends[-1]
+        else:
+            starts, ends, changes = self._windows
+            start = np.datetime64(asset.start_date, 'D')
+            end = np.datetime64(asset.end_date, 'D')
+            starts = np.append(starts, start)
+            ends = np.append(ends, end)
+        days = self._calendar().days
+        day = days[self._step]
+        # NaT compares False, so a missing date never makes a change
+        later = [date for date in (start, end) if date > day]
+        if later:
+            changes = np.union1d(changes, later)
+            self._next_switch = min(self._next_switch,
+                                    int(np.searchsorted(days, min(later))))
+        if start > day or end <= day:
+            self._next_switch = 0
+        self._windows = (starts, ends, changes)
+
+    def _switch_windows(self):
+        """Work out which assets are active in the current month, in one
+        pass over the window arrays, and reindex if that has changed. It is
+        called again only once the step reaches the next start or end date.
+        """
+        if self._windows is None:
+            self._windows = self._window_arrays()
+        starts, ends, changes = self._windows
+        days = self._calendar().days
+        day = days[self._step]
+        # NaT compares False, so a missing date never makes an asset inactive
+        active = ~(starts > day) & ~(ends <= day)
+        later = changes[changes > day]
+        # step of the next change, or of the end of the calendar so far
+        self._next_switch = (int(np.searchsorted(days, later[0]))
+                             if len(later) else float('inf'))
+        if active.all():
+            active = None
+        if active is None and self._active is None:
+            return
+        if (active is not None and self._active is not None and
+                np.array_equal(active, self._active)):
+            return
+        self._active = active
+        self._reindex()
+
+    def _index_assets(self, assets):
+        """Add assets to the kind index and the totals, in one pass with
+        the lists and sums held in locals. The totals are added up in the
+        same order as one asset at a time.
+        """
+        by_kind = self._by_kind
+        valued = self._valued.append
+        debtors = self._debtors.append
+        income = self._income_total
+        passive = self._passive_total
+        expenses = self._expense_total
+        repayment = self._repayment_total
+        for asset in assets:
+            kind = asset.kind
+            by_kind[kind].append(asset)
+            if asset.value is not None or kind in ('stocks', 'cash'):
+                valued(asset)
+            if asset.debt or asset.monthly_repayment:
+                debtors(asset)
+                if asset.monthly_repayment:
+                    repayment += asset.monthly_repayment
+            if asset.monthly_income:
+                income += asset.monthly_income
+                if kind != 'job':
+                    passive += asset.monthly_income
+            if asset.monthly_expenses:
+                expenses += asset.monthly_expenses
+        self._income_total = income
+        self._passive_total = passive
+        self._expense_total = expenses
+        self._repayment_total = repayment
+
+    def _sum_repayments(self):
+        """Re-total the monthly repayments, after debts are added or
+        cleared.
+        """
+        total = 0
+        for asset in self._debtors:
+            if asset.monthly_repayment:
+                total += asset.monthly_repayment
+        self._repayment_total = total
 
     def monthly_ingres(self):
         """Calculate avaiable monthly cash based on monthly_income from all
@@ -132,11 +978,7 @@ class Portfolio(object):
         :param self.assets: Sums asset.monthly_income across asset objects
         :returns self.monthly_income: float
         """
-        tmp_income = 0
-        for asset in self.assets:
-            if asset.monthly_income:
-                tmp_income += asset.monthly_income
-        self.monthly_income = tmp_income
+        self.monthly_income = self._income_total
 
     def monthly_egres(self):
         """Calculate and update the monthly outgoing money by summing
@@ -145,10 +987,7 @@ class Portfolio(object):
         :param self.assets.monthly_expenses: Sums list of asset.monthly_expense
         :returns self.monthly_expenses: float
         """
-        tmp_expenses = 0
-        for asset in self.assets:
-            if asset.monthly_expenses:
-                tmp_expenses += asset.monthly_expenses
+        tmp_expenses = self._expense_total
         self.monthly_expenses = tmp_expenses
         assert tmp_expenses < self.monthly_income, "Error: spending too much"
         self.monthly_income -= tmp_expenses
@@ -156,13 +995,12 @@ class Portfolio(object):
     def investment_portfolio(self):
         """Start of portflio methods."""
         tmp_net = 0
-        for asset in self.assets:
-            if asset.kind.lower() == 'stocks':
-                tmp_net += asset.value
-                asset.value *= 1.00333
-                if self.monthly_income > 0:
-                    asset.value += self.monthly_income
-                    self.monthly_income = 0
+        for asset in self._by_kind['stocks']:
+            tmp_net += asset.value
+            asset.value *= self.stock_growth
+            if self.monthly_income > 0:
+                asset.value += self.monthly_income
+                self.monthly_income = 0
         self.net_investments = tmp_net
 
     def count_cash(self):
@@ -173,14 +1011,13 @@ class Portfolio(object):
         :results self.cash: float
         """
         max_cash = 0
-        for asset in self.assets:
-            if asset.kind.lower() == 'cash':
+        for asset in self._by_kind['cash']:
+            self.cash = asset.value
+            max_cash = asset.max_cash
+            if self.cash < max_cash and self.monthly_income > 0:
+                asset.value += self.monthly_income
+                self.monthly_income = 0.0
                 self.cash = asset.value
-                max_cash = asset.max_cash
-                if self.cash < max_cash and self.monthly_income > 0:
-                    asset.value += self.monthly_income
-                    self.monthly_income = 0.0
-                    self.cash = asset.value
 
     def monthly_repay(self):
         """Examines a flag (asset.pay_debt_asap) from asset objects with debt.
@@ -193,23 +1030,37 @@ class Portfolio(object):
         :returns self.asset.debt: float
         """
         error1 = "Error: cant meet monthly repayment :("
-        for asset in self.assets:
+        cleared = False
+        for asset in self._debtors:
             if asset.debt and asset.monthly_repayment:
                 assert self.monthly_income > asset.monthly_repayment, error1
                 # Pay all minimum debts for the month
                 if (asset.debt - asset.monthly_repayment) <= 0.0:
                     # if this is the last payment, remove the debt
                     self.monthly_income -= asset.debt
+                    if asset.debt > 0:
+                        # an overpaid debt was logged when it was overpaid
+                        self.events.record(self._step, 'debt cleared',
+                                           self.assets.index(asset),
+                                           asset.debt)
                     asset.debt = None
                     asset.monthly_repayment = None
+                    cleared = True
                 else:
                     # otherwise, just take the minimum and dont worry
                     asset.debt -= asset.monthly_repayment
                     self.monthly_income -= asset.monthly_repayment
-        for asset in self.assets:
+        for asset in self._debtors:
             if asset.debt and asset.pay_debt_asap and self.monthly_income > 0:
+                if 0 < asset.debt <= self.monthly_income:
+                    self.events.record(self._step, 'debt cleared',
+                                       self.assets.index(asset), asset.debt)
                 asset.debt -= self.monthly_income
                 self.monthly_income = 0.0
+        if cleared:
+            self._debtors = [asset for asset in self._debtors
+                             if asset.debt or asset.monthly_repayment]
+            self._sum_repayments()
 
     def monthly_debt(self):
         """Calculate debt each month. Examines the Assets held in the Portfolio
@@ -219,7 +1070,7 @@ class Portfolio(object):
         :returns self.debt: float
         """
         tmp_debt = 0
-        for asset in self.assets:
+        for asset in self._debtors:
             if asset.debt:
                 tmp_debt += asset.debt
         self.debt = tmp_debt
@@ -231,23 +1082,80 @@ class Portfolio(object):
         :returns: self.networth in Portfolio object
         """
         net_value = 0
-        for asset in self.assets:
+        for asset in self._valued:
             if asset.value:
                 net_value += asset.value
         self.networth = net_value - self.debt
 
+    def _calendar(self):
+        """Month timeline covering the current step and the month after
+        it. It starts from the date of the first step, and is replaced by a
+        longer one if the projection runs past prd months.
+        """
+        if self._timeline is None:
+            self._timeline = month_timeline(self.date, self.prd)
+        if len(self._timeline) < self._step + 2:
+            self._timeline = month_timeline(self._timeline.start,
+                                            self._step + self.prd)
+        return self._timeline
+
+    def next_month(self):
+        """Move the date on to the next month of the timeline"""
+        self._step += 1
+        self.date = self._calendar().dates[self._step]
+        if self._step >= self._next_switch:
+            self._switch_windows()
+
+    def monthly_buy(self):
+        """Apply each of self.rules, by default buying a NEW_PROPERTY when
+        net investments pass the buy threshold.
+        """
+        for rule in self.rules:
+            rule.apply(self)
+
+    def add_hook(self, before=None, after=None):
+        """Register functions called as hook(portfolio, phase) before and
+        after each of the MONTHLY_PHASES, and around the quad calculation
+        of quad_positions() and gen_quads() (as phase 'quad_positions').
+        Without hooks the phases run with no extra cost.
+
+        :param before: function called before each phase, or None
+        :param after: function called after each phase, or None
+        """
+        befores, afters = self._hooks or ((), ())
+        if before is not None:
+            befores += (before,)
+        if after is not None:
+            afters += (after,)
+        self._hooks = (befores, afters)
+
+    def remove_hook(self, before=None, after=None):
+        """Unregister functions added with add_hook()"""
+        befores, afters = self._hooks or ((), ())
+        befores = tuple(hook for hook in befores if hook != before)
+        afters = tuple(hook for hook in afters if hook != after)
+        self._hooks = (befores, afters) if befores or afters else None
+
+    def _call_hooked(self, phase, method):
+        """Call method between the before and after hooks of phase"""
+        befores, afters = self._hooks
+        for hook in befores:
+            hook(self, phase)
+        result = method()
+        for hook in afters:
+            hook(self, phase)
+        return result
+
     def update_monthly(self):
-        self.date = self.date + relativedelta(months=1)
-        if self.net_investments > self.buy_property_threshold:
-            print('triggered buy property')
-            # temp hack - keep buying same kind of place
-            self.buy_property(asset=Asset(**{'kind': 'real estate',
-                                             'debt': 70,
-                                             'value': 150,
-                                             'monthly_repayment': 0.5,
-                                             'monthly_income': 0.8,
-                                             'start_date': self.date,
-                                             'pay_debt_asap': True}))
+        """Step the Portfolio on by one month, running each of the
+        MONTHLY_PHASES in turn.
+        """
+        if self._hooks is not None:
+            for name in MONTHLY_PHASES:
+                self._call_hooked(name, getattr(self, name))
+            return
+        self.next_month()
+        self.monthly_buy()
         self.monthly_ingres()
         self.monthly_egres()
         self.monthly_repay()
@@ -265,59 +1173,560 @@ class Portfolio(object):
         :param self, left, right, bottom, top, color:
         :returns: Assigns values to the list items.
         """
-        # Add debt marker
-        left.append(self.date)
-        right.append(self.date + relativedelta(months=1))
-        top.append(0.0)
-        bottom.append(self.debt * -1)
-        if self.fi:
-            color.append('#e65c00')
-        else:
-            color.append('#ff944d')
-        # Add cash marker
-        left.append(self.date)
-        right.append(self.date + relativedelta(months=1))
-        bottom.append(0.0)
-        top.append(self.cash)
-        if self.fi:
-            color.append('#008000')
+        if self._hooks is not None:
+            bottoms, tops = self._call_hooked('quad_positions',
+                                              self._quad_row)
         else:
-            color.append('#00e600')
-        # Add stock marker
-        left.append(self.date)
-        right.append(self.date + relativedelta(months=1))
-        bottom.append(self.cash)
-        top.append(self.cash + self.net_investments)
-        if self.fi:
-            color.append('#800080')
-        else:
-            color.append('#e600e6')
-        # Add net worth marker (including  primary property)
-        left.append(self.date)
-        right.append(self.date + relativedelta(months=1))
-        bottom.append(self.cash + self.net_investments)
-        top.append(self.networth)
-        if self.fi:
-            color.append('#75a3a3')
-        else:
-            color.append('#b3cccc')
+            bottoms, tops = self._quad_row()
+        next_date = self._calendar().dates[self._step + 1]
+        for k in range(4):
+            left.append(self.date)
+            right.append(next_date)
+            bottom.append(bottoms[k])
+            top.append(tops[k])
+            color.append(QUAD_COLORS[k][self.fi])
         return
 
-    def gen_quads(self):
+    def _quad_row(self):
+        """Bottom and top of the debt, cash, stock and net worth (including
+        primary property) quads of the current month.
+        """
+        stocks = self.cash + self.net_investments
+        return ((self.debt * -1, 0.0, self.cash, stocks),
+                (0.0, self.cash, stocks, self.networth))
+
+    # Portfolio attributes saved, along with the assets, by a checkpoint
+    _checkpoint_fields = ('date', 'monthly_income', 'monthly_expenses',
+                          'net_investments', 'debt', 'cash',
+                          '_temporary_capitol', 'networth', 'fi',
+                          'passive_income', 'buy_property_threshold',
+                          'stock_growth', '_income_total', '_passive_total',
+                          '_expense_total', '_repayment_total', '_step',
+                          '_active', '_next_switch')
+
+    def _checkpoint(self):
+        """Copy of the full state: the assets (and their fields), the kind
+        index and the Portfolio attributes.
+        """
+        return (list(self.assets),
+                [tuple(getattr(asset, field) for field in Asset._fields)
+                 for asset in self.assets],
+                dict((kind, list(assets))
+                     for kind, assets in self._by_kind.items()),
+                list(self._valued), list(self._debtors),
+                [getattr(self, name) for name in self._checkpoint_fields],
+                self.events._total)
+
+    def _restore(self, checkpoint):
+        """Return to the state saved by _checkpoint()"""
+        assets, fields, by_kind, valued, debtors, values, events = checkpoint
+        for asset, asset_fields in zip(assets, fields):
+            for field, value in zip(Asset._fields, asset_fields):
+                setattr(asset, field, value)
+        self.assets = list(assets)
+        self._by_kind = dict((kind, list(assets))
+                             for kind, assets in by_kind.items())
+        self._valued = list(valued)
+        self._debtors = list(debtors)
+        for name, value in zip(self._checkpoint_fields, values):
+            setattr(self, name, value)
+        self._windows = None
+        self.events.truncate(events)
+
+    def _apply_edits(self, month):
+        """Apply the asset changes scheduled for a month of the run"""
+        for changes in self.edits.get(month, ()):
+            for (index, field), value in changes.items():
+                setattr(self.assets[index], field, value)
+            self.reindex()
+
+    def _project(self, quads, fi, months):
+        """Run the given months of the current run, saving checkpoints and
+        writing the bottoms, tops and FI flags of each month into quads and
+        fi.
+        """
+        bottom = quads['bottom'].reshape(-1, 4)
+        top = quads['top'].reshape(-1, 4)
+        quad_row = self._quad_row
+        if self._hooks is not None:
+            quad_row = partial(self._call_hooked, 'quad_positions', quad_row)
+        for i in months:
+            if i == 0 or (self.keep_checkpoints and self.checkpoint_every
+                          and i % self.checkpoint_every == 0):
+                self._checkpoints[i] = self._checkpoint()
+            self._apply_edits(i)
+            self.update_monthly()
+            bottom[i], top[i] = quad_row()
+            fi[i] = self.fi
+        if len(months):
+            start, stop = months[0], months[-1] + 1
+            quads['color'][4 * start:4 * stop] = quad_color_codes(
+                fi[start:stop])
+
+    def _start_run(self):
+        """Allocate the quads of a run of prd months from the current one,
+        with their left and right dates already filled in.
+        """
+        quads = np.empty(4 * self.prd, QUAD_DTYPE)
+        fi = np.empty(self.prd, bool)
+        first = self._step
+        days = month_timeline(self._calendar().start, first + self.prd).days
+        quads['left'] = np.repeat(days[first + 1:first + self.prd + 1], 4)
+        quads['right'] = np.repeat(days[first + 2:first + self.prd + 2], 4)
+        self._checkpoints = {}
+        self._run = (quads, fi)
+        return quads, fi
+
+    def iter_quads(self, chunk=12, output='dict'):
+        """Generator version of gen_quads(), yielding the quads of each
+        chunk of months as soon as it has been run, e.g. to stream them into
+        a Bokeh ColumnDataSource. Joined together the chunks are the
+        gen_quads() result.
+
+        :param chunk: integer number of months per chunk
+        :param output: 'frame', 'dict' or 'records', see quad_output()
+        :returns: generator of pd.DataFrame objects (or dicts, or
+                  np.recarrays)
+        """
+        assert chunk > 0, "Error: chunk must be at least one month"
+        quads, fi = self._start_run()
+        for start in range(0, self.prd, chunk):
+            stop = min(start + chunk, self.prd)
+            self._project(quads, fi, range(start, stop))
+            yield quad_output(quads[4 * start:4 * stop], output)
+
+    def gen_quads(self, output='frame'):
         """For the current state of Portfolio properties generate quad plot
         dataframe object to be consumed by Bokeh plots.
 
+        The quads are written month by month into one preallocated record
+        array (see QUAD_DTYPE), with the left and right dates taken straight
+        from the month timeline and the colors stored as codes. Changes in
+        self.edits, a dict of month to a list of edit() changes, are applied
+        at the start of their month.
+
         :param self: Examines attributes of Portfolio object
-        :returns: a pd.DataFrame object
+        :param output: 'frame', 'dict' or 'records', see quad_output()
+        :returns: a pd.DataFrame object (or dict, or np.recarray)
+        """
+        quads, fi = self._start_run()
+        self._project(quads, fi, range(self.prd))
+        return quad_output(quads, output)
+
+    def trace(self):
+        """Run prd months like gen_quads(), recording the Portfolio state
+        and the value and debt of every asset after each month instead of
+        the quads. Trace.quads() gives the quads of the same run.
+
+        :returns: a Trace object
         """
-        left = []
-        right = []
-        top = []
-        bottom = []
-        color = []
+        first = self._step
+        timeline = month_timeline(self._calendar().start, first + self.prd)
+        states = np.empty((self.prd, len(STATE_FIELDS)))
+        width = len(self.assets)
+        value = np.full((self.prd, width), np.nan)
+        debt = np.full((self.prd, width), np.nan)
         for i in range(self.prd):
+            self._apply_edits(i)
             self.update_monthly()
-            self.quad_positions(left=left, top=top, bottom=bottom,
-                                right=right, color=color)
-        return pd.DataFrame({'left': left, 'right': right, 'top': top,
-                            'bottom': bottom, 'color': color})
+            states[i] = [getattr(self, name) for name in STATE_FIELDS]
+            assets = self.assets
+            if len(assets) > width:
+                # properties were bought, widen the asset columns
+                extra = np.full((self.prd, 2 * len(assets) - width), np.nan)
+                value = np.hstack([value, extra])
+                debt = np.hstack([debt, extra])
+                width = value.shape[1]
+            # None becomes NaN
+            value[i, :len(assets)] = [asset.value for asset in assets]
+            debt[i, :len(assets)] = [asset.debt for asset in assets]
+        n = len(self.assets)
+        states = pd.DataFrame(states, columns=STATE_FIELDS, index=list(
+            timeline.dates[first + 1:first + self.prd + 1]))
+        states['fi'] = states['fi'].astype(bool)
+        return Trace(states, value[:, :n].copy(), debt[:, :n].copy(),
+                     tuple(asset.kind for asset in self.assets),
+                     timeline.days[first + 1:first + self.prd + 2])
+
+    def edit(self, changes, month=0, output='frame'):
+        """Change asset fields from a month of the last gen_quads() run on,
+        and recompute the quads of the months after it. The run resumes
+        from the nearest checkpoint at or before month, so the result is
+        the same as rerunning gen_quads() on a fresh Portfolio with the same
+        edits. Without a previous run, all the months are run. The 'dict'
+        and 'records' outputs of the last run are updated in place.
+        keep_checkpoints is turned on, so the months rerun save
+        checkpoints for the edits after this one.
+
+        :param changes: dict of (asset index, field) to the new value, e.g.
+                        {(2, 'monthly_repayment'): 1.0}
+        :param month: integer month of the run the change takes effect in
+        :param output: 'frame', 'dict' or 'records', see quad_output()
+        :returns: (quads, range of the recomputed months)
+        """
+        assert 0 <= month < self.prd, "Error: month outside of the run"
+        self.edits.setdefault(month, []).append(changes)
+        self.keep_checkpoints = True
+        if self._run is None:
+            return self.gen_quads(output), range(self.prd)
+        start = max(i for i in self._checkpoints if i <= month)
+        quads, fi = self._run
+        self._restore(self._checkpoints[start])
+        self._project(quads, fi, range(start, self.prd))
+        return quad_output(quads, output), range(start, self.prd)
+
+    def _solvable(self):
+        """Whether the debts can be stepped without the rest of the
+        Portfolio: True when no property can be bought in the next prd
+        months. The stocks are bounded by investing twice the spare monthly
+        income (to allow for refunds of overpaid debts) every month.
+        """
+        if self.rules != DEFAULT_RULES or not self._windows_open():
+            return False
+        threshold = self.buy_property_threshold
+        if self.net_investments > threshold:
+            return False
+        stocks = self._by_kind['stocks']
+        if not stocks or self.prd < 2:
+            return True
+        growth = self.stock_growth
+        if growth <= 0:
+            return False
+        spare = 2 * max(self._income_total - self._expense_total, 0)
+        value = sum(asset.value or 0 for asset in stocks)
+        n = self.prd - 1
+        if growth == 1:
+            bound = value + spare * n
+        else:
+            bound = value * growth ** n + spare * (growth ** n - 1) / (
+                growth - 1)
+        # the bound moves monotonically, so only the ends need checking
+        return max(value, bound) * (1 + 1e-9) <= threshold
+
+    def _windows_open(self):
+        """Whether every asset is active in each of the next prd months, so
+        the kind index stays as it is.
+        """
+        if self._active is not None:
+            return False
+        if self.prd < 1:
+            return True
+        if self._windows is None:
+            self._windows = self._window_arrays()
+        starts, ends, changes = self._windows
+        days = month_timeline(self._calendar().start,
+                              self._step + self.prd).days
+        first, last = days[self._step + 1], days[self._step + self.prd]
+        return not ((starts > first).any() or (ends <= last).any())
+
+    def _solve_debts(self, fi=True, payoffs=True):
+        """Months of the next prd in which FI is reached and in which each
+        debt is paid off, stepping only the debts. Debts not paid off asap
+        only ever get their minimum repayment, so their balances and payoff
+        months are looked up in their (cached) amortize() schedules.
+        Between two months in which a debt is cleared the asap debts fall
+        by the same amounts each month, so each stretch of them is computed
+        at once with np.subtract.accumulate, which rounds exactly like the
+        monthly subtractions of monthly_repay().
+
+        :param fi: bool, whether the FI month is needed
+        :param payoffs: bool, whether the payoff months are needed
+        :returns: (FI month or None, dict of asset index to month or None)
+        """
+        error1 = "Error: cant meet monthly repayment :("
+        position = dict((id(asset), i) for i, asset in enumerate(self.assets))
+        index = [position[id(asset)] for asset in self._debtors]
+        debt = [asset.debt for asset in self._debtors]
+        repay = [asset.monthly_repayment for asset in self._debtors]
+        asap = [asset.pay_debt_asap for asset in self._debtors]
+        plan = [None if asap[k] or not (debt[k] and repay[k]) else
+                amortize(debt[k], repay[k], months=self.prd)
+                for k in range(len(debt))]
+        repayments = self._repayment_total
+        paid = dict((i, None) for i, d in zip(index, debt) if d)
+        for k, schedule in enumerate(plan):
+            if schedule is not None and schedule.payoff >= 0:
+                paid[index[k]] = schedule.payoff
+        fi_month = None
+        if self.prd:
+            assert self._expense_total < self._income_total, \
+                "Error: spending too much"
+        income0 = self._income_total - self._expense_total
+        t = 0
+        while t < self.prd:
+            if ((not fi or fi_month is not None) and
+                    (not payoffs or None not in paid.values())):
+                break
+            # a stretch of months in which no debt is cleared
+            n = self.prd - t
+            spare = income0
+            for k in range(len(debt)):
+                if debt[k] and repay[k]:
+                    assert spare > repay[k], error1
+                    spare -= repay[k]
+            target = None
+            for k in range(len(debt)):
+                if debt[k] and asap[k]:
+                    target = k
+                    break
+            paths = {}
+            end = n
+            for k in range(len(debt)):
+                if not (debt[k] and repay[k]) and k != target:
+                    continue
+                if plan[k] is not None:
+                    if plan[k].payoff >= 0:
+                        end = min(end, plan[k].payoff - t)
+                    continue
+                steps = [repay[k]] if repay[k] else []
+                if k == target:
+                    steps.append(spare)
+                ops = np.empty(1 + len(steps) * (n - 1))
+                ops[0] = debt[k]
+                ops[1:] = np.tile(steps, n - 1)
+                path = np.subtract.accumulate(ops)[::len(steps)]
+                event = path == 0
+                if repay[k]:
+                    event |= path <= repay[k]
+                hits = np.flatnonzero(event)
+                if len(hits):
+                    end = min(end, hits[0])
+                paths[k] = path
+            if end:
+                if (fi and fi_month is None and
+                        self._passive_total > self._expense_total +
+                        repayments):
+                    fi_month = t
+                if end == n:
+                    break
+                for k, path in paths.items():
+                    debt[k] = path[end]
+                    if not debt[k]:
+                        paid[index[k]] = t + end - 1
+                t += end
+                for k in range(len(debt)):
+                    if plan[k] is not None and debt[k] and repay[k]:
+                        debt[k] = plan[k].balance[t - 1]
+            # step the month a debt is cleared in, as monthly_repay() does
+            income = income0
+            cleared = False
+            was_owed = [bool(d) for d in debt]
+            for k in range(len(debt)):
+                if debt[k] and repay[k]:
+                    assert income > repay[k], error1
+                    if debt[k] <= repay[k]:
+                        income -= debt[k]
+                        debt[k] = None
+                        repay[k] = None
+                        cleared = True
+                    else:
+                        income -= repay[k]
+                        if plan[k] is None:
+                            debt[k] -= repay[k]
+                        else:
+                            debt[k] = plan[k].balance[t]
+            for k in range(len(debt)):
+                if debt[k] and asap[k] and income > 0:
+                    debt[k] -= income
+                    income = 0.0
+            for k in range(len(debt)):
+                if was_owed[k] and not debt[k]:
+                    paid[index[k]] = t
+            if cleared:
+                keep = [k for k in range(len(debt)) if debt[k] or repay[k]]
+                index, debt, repay, asap, plan = [
+                    [values[k] for k in keep]
+                    for values in (index, debt, repay, asap, plan)]
+                repayments = 0
+                for r in repay:
+                    if r:
+                        repayments += r
+            if (fi and fi_month is None and
+                    self._passive_total > self._expense_total + repayments):
+                fi_month = t
+            t += 1
+        return fi_month, paid
+
+    def _simulate_debts(self, fi=True, payoffs=True):
+        """_solve_debts() by running update_monthly(), stopping as soon as
+        the months are known. The Portfolio is put back as it was.
+        """
+        checkpoint = self._checkpoint()
+        owed = [(i, asset) for i, asset in enumerate(self.assets)
+                if asset.debt]
+        paid = dict((i, None) for i, asset in owed)
+        fi_month = None
+        try:
+            for month in range(self.prd):
+                if ((not fi or fi_month is not None) and
+                        (not payoffs or None not in paid.values())):
+                    break
+                self.update_monthly()
+                if fi_month is None and self.fi:
+                    fi_month = month
+                for i, asset in owed:
+                    if paid[i] is None and not asset.debt:
+                        paid[i] = month
+        finally:
+            self._restore(checkpoint)
+        return fi_month, paid
+
+    def _month_date(self, month):
+        """Date reached by the update of a month counted from now"""
+        if month is None:
+            return None
+        timeline = month_timeline(self._calendar().start,
+                                  self._step + self.prd)
+        return timeline.dates[self._step + month + 1]
+
+    def solve_fi_date(self):
+        """Date FI is first reached in the next prd months, the same month
+        gen_quads() would first flag it, or None. When no property can be
+        bought in that time FI only depends on the debts, which are solved
+        directly; otherwise the Portfolio is simulated (and put back) only
+        up to the FI month.
+
+        :returns: dt.date or None
+        """
+        if self._solvable():
+            month, paid = self._solve_debts(payoffs=False)
+        else:
+            month, paid = self._simulate_debts(payoffs=False)
+        return self._month_date(month)
+
+    def solve_payoff_dates(self):
+        """Dates the debts of the Portfolio are paid off (left at zero or
+        cleared) in the next prd months, solved like solve_fi_date().
+
+        :returns: dict of asset index to dt.date, or None when a debt is
+                  not paid off within prd months
+        """
+        if self._solvable():
+            fi_month, paid = self._solve_debts(fi=False)
+        else:
+            fi_month, paid = self._simulate_debts(fi=False)
+        return dict((i, self._month_date(month))
+                    for i, month in paid.items())
+
+    def solve_for(self, field, target_fi_date, bounds, tol=1e-3, width=8):
+        """Value of one Asset field, within bounds, at which FI is first
+        reached by target_fi_date, e.g. the smallest repayment or the
+        largest monthly expenses that still get there in time. FI is taken
+        to move monotonically with the field. Each round runs width values
+        spread over the remaining interval side by side, as one
+        BatchPortfolio packed once from the current state, and keeps the
+        part where the target starts (or stops) being met, so the interval
+        shrinks (width + 1) fold a round. Edits and hooks are ignored, and a
+        value that cannot pay its way counts as not meeting the target.
+
+        :param field: (asset index, field name), e.g. (2, 'monthly_repayment')
+        :param target_fi_date: dt.date FI should be reached by
+        :param bounds: (low, high) values of the field to search
+        :param tol: float width of interval to stop at
+        :param width: integer number of values run in each round
+        :returns: float value meeting the target that is nearest to values
+                  that do not, or None when no value in bounds meets it
+        """
+        # imported here as fispy.batch imports this module
+        from fispy.batch import BatchPortfolio
+        index, name = field
+        if name not in BatchPortfolio.field_columns:
+            raise ValueError("field should be one of {0}, not {1}".format(
+                sorted(BatchPortfolio.field_columns), name))
+        low, high = bounds
+        assert low < high, "Error: bounds must be (low, high)"
+        assert width > 0, "Error: width must be at least one"
+        timeline = month_timeline(self._calendar().start,
+                                  self._step + self.prd)
+        dates = timeline.dates[self._step + 1:self._step + self.prd + 1]
+        # FI has to be reached in one of the first months of the run
+        months = sum(1 for date in dates if date <= target_fi_date)
+        if months == 0:
+            return None
+        packed = BatchPortfolio.repeat(self, width + 2, prd=months)
+
+        def meets(values):
+            """Whether each value reaches FI in time"""
+            batch = copy.deepcopy(packed)
+            batch.set_field(index, name, values)
+            return batch.run().fi.any(axis=1)
+
+        points = np.linspace(low, high, width + 2)
+        met = meets(points)
+        if not met.any():
+            return None
+        if met.all():
+            # the switch lies outside of bounds, so compare how soon the
+            # ends reach FI to give the end nearest to it
+            return self._solve_end(packed, index, name, low, high)
+        while True:
+            # keep the first interval where meeting the target flips
+            k = np.flatnonzero(met[1:] != met[:-1])[0]
+            a, b = points[k], points[k + 1]
+            if b - a <= tol:
+                return float(a if met[k] else b)
+            points = np.linspace(a, b, width + 2)
+            met = meets(points)
+
+    def _solve_end(self, packed, index, name, low, high):
+        """The end of bounds that reaches FI later, when both are in time"""
+        batch = copy.deepcopy(packed)
+        values = np.full(batch.n, float(high))
+        values[0] = low
+        batch.set_field(index, name, values)
+        fi = batch.run().fi
+        return float(low if fi[0].argmax() >= fi[-1].argmax() else high)
+
+    def run_until(self, condition, max_months=None):
+        """Step the Portfolio month by month until condition holds, instead
+        of always running prd months. Scheduled edits are applied as in
+        gen_quads(). A month in which the income cannot cover the spending
+        or a repayment ends the run too: the Portfolio is left at the start
+        of that month and the failed check is returned, not raised.
+
+        :param condition: callable taking the Portfolio and returning True
+                          to stop, e.g. networth_above(500), or the name of
+                          one of STOP_CONDITIONS ('fi' or 'debt_free')
+        :param max_months: integer months to run at most, defaults to prd
+        :returns: a RunResult object
+        """
+        if not callable(condition):
+            if condition not in STOP_CONDITIONS:
+                raise ValueError("condition should be callable or one of "
+                                 "{0}, not {1}".format(
+                                     sorted(STOP_CONDITIONS), condition))
+            condition = STOP_CONDITIONS[condition]
+        if max_months is None:
+            max_months = self.prd
+        first = self._step
+        dates = month_timeline(self._calendar().start,
+                               first + max_months).dates
+        series = np.empty((max_months, len(STATE_FIELDS)))
+        checkpoint = (0, None)
+        month = error = None
+        for i in range(max_months):
+            if i == 0 or (self.keep_checkpoints and self.checkpoint_every
+                          and i % self.checkpoint_every == 0):
+                checkpoint = (i, self._checkpoint())
+            self._apply_edits(i)
+            try:
+                self.update_monthly()
+            except AssertionError as err:
+                # replay from the last checkpoint to the start of the month
+                start, state = checkpoint
+                self._restore(state)
+                for j in range(start, i):
+                    self._apply_edits(j)
+                    self.update_monthly()
+                month, error = i, str(err)
+                break
+            series[i] = [getattr(self, name) for name in STATE_FIELDS]
+            if condition(self):
+                month = i
+                break
+        run = max_months if month is None else month + (error is None)
+        states = pd.DataFrame(series[:run], columns=STATE_FIELDS,
+                              index=list(dates[first + 1:first + run + 1]))
+        states['fi'] = states['fi'].astype(bool)
+        date = None if month is None else dates[first + month + 1]
+        return RunResult(states, month, date, error)
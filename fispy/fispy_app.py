@@ -1,16 +1,17 @@
 import sys
 import os
 import datetime as dt
-from dateutil.relativedelta import relativedelta
-from bokeh.models import Button, HBox, VBoxForm
-from bokeh.models.widgets import Slider, Select, TextInput, RadioGroup
-from bokeh.models.widgets import PreText, Button
-from bokeh.charts.attributes import cat, color
-from bokeh.plotting import Figure, curdoc, vplot
-from bokeh.layouts import row, column, widgetbox
-from bokeh.models import ColumnDataSource
-from bokeh.io import vform
-from fispy import Asset, Portfolio
+from functools import partial
+import numpy as np
+from bokeh.models import (Button, CDSView, ColumnDataSource, GroupFilter,
+                          PreText, RadioGroup, Slider)
+from bokeh.plotting import curdoc, figure
+from bokeh.layouts import row, column
+# serve the fispy package, rather than the fispy.py module next to this file
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(
+    __file__))))
+from fispy.cache import default_cache
+from fispy.recompute import LatestRequest
 
 
 # Initilise with list of assets...
@@ -38,36 +39,98 @@ d5 = {'kind': 'cash',
       'value': 15,
       'max_cash': 30}
 
-projection = Portfolio(Asset(**d1),
-                       Asset(**d2),
-                       Asset(**d3),
-                       Asset(**d4),
-                       Asset(**d5), prd=200)
-source = ColumnDataSource(projection.gen_quads())
+# The repayment strategies of the RadioGroup. They are projected together,
+# into one source, so switching between them only changes which is shown.
+STRATEGIES = [("base repayments only", False), ("repay ASAP", True)]
 
-TOOLS = "crosshair, pan, reset, resize, wheel_zoom"
-plot = Figure(tools=TOOLS, x_axis_type='datetime', plot_height=600,
-              plot_width=600, title="FI calculator")
-p = plot.quad(left='left', right='right', bottom='bottom', top='top',
-              color='color', source=source)
+
+def strategy_scenarios():
+    """Copies of the asset dictionaries, one list per strategy"""
+    return [[dict(d1), dict(d2), dict(d3, pay_debt_asap=asap), dict(d4),
+             dict(d5)] for label, asap in STRATEGIES]
+
+
+def label_strategies(bdf_quad):
+    """Label quads with the strategy they are for, instead of its index"""
+    labels = np.array([label for label, asap in STRATEGIES])
+    bdf_quad['strategy'] = labels[bdf_quad.pop('scenario')]
+    return bdf_quad
+
+
+# projections already run, by any session, are served from the cache
+cache = default_cache()
+source = ColumnDataSource(label_strategies(
+    cache.scenario_quads(strategy_scenarios(), prd=200, output='dict')))
+
+TOOLS = "crosshair, pan, reset, wheel_zoom"
+plot = figure(tools=TOOLS, x_axis_type='datetime', height=600, width=600,
+              title="FI calculator")
+renderers = []
+for label, asap in STRATEGIES:
+    view = CDSView(filter=GroupFilter(column_name='strategy', group=label))
+    renderers.append(plot.quad(left='left', right='right', bottom='bottom',
+                               top='top', color='color', source=source,
+                               view=view))
+
+
+doc = curdoc()
+
+
+# id of the newest projection; chunks of older ones are dropped
+latest = [0]
+
+
+def push_chunk(request_id, index, bdf_quad):
+    """Show one chunk of the strategies on the server thread: the first
+    replaces the plot data, later ones are streamed onto it.
+    """
+    if request_id != latest[0]:
+        return
+    if index == 0:
+        source.data = bdf_quad
+    else:
+        source.stream(bdf_quad)
+
+
+def stream_quads(request_id, scenarios):
+    """Run every strategy together as one batch in a worker process,
+    handing each chunk of months to the server thread as soon as it is
+    done. Stops early once a newer projection is asked for.
+    """
+    chunks = cache.iter_scenario_quads(scenarios, prd=200, chunk=24,
+                                       output='dict', process=True)
+    for index, bdf_quad in enumerate(chunks):
+        if request_id != latest[0]:
+            return request_id
+        doc.add_next_tick_callback(
+            partial(push_chunk, request_id, index,
+                    label_strategies(bdf_quad)))
+    return request_id
+
+
+def stream_done(request_id):
+    if request_id == latest[0]:
+        update_text("Placeholder text...")
+
+
+# Projections are waited on from a thread pool, and run in worker processes,
+# so the server keeps serving other sessions; requests made while one runs
+# are coalesced into the latest.
+recompute = LatestRequest(
+    stream_quads,
+    deliver=lambda request_id: doc.add_next_tick_callback(
+        partial(stream_done, request_id)),
+    on_error=lambda error: doc.add_next_tick_callback(
+        partial(update_text, "Error: {0}".format(error))))
 
 
 def update_graphic():
-    """Update the data of the Asset dictionaries and recreate the
-    projection.
+    """Update the data of the Asset dictionaries and stream the new
+    projections of every strategy into the plot, without blocking the
+    server.
     """
-    projection = Portfolio(Asset(**d1),
-                           Asset(**d2),
-                           Asset(**d3),
-                           Asset(**d4),
-                           Asset(**d5), prd=200)
-    bdf_quad = projection.gen_quads()
-    # print(bdf_quad.head())
-    source.data['bottom'] = bdf_quad['bottom']
-    source.data['top'] = bdf_quad['top']
-    source.data['left'] = bdf_quad['left']
-    source.data['right'] = bdf_quad['right']
-    source.trigger('data', source.data, source.data)
+    latest[0] += 1
+    recompute.submit(latest[0], strategy_scenarios())
 
 
 # Set up widgets
@@ -82,7 +145,7 @@ s2_input = Slider(title="s2", value=d2['monthly_income'], start=0.0, end=10.0)
 cash_start = Slider(title="Initial cash", value=d5['value'],
                     start=0.0, end=100)
 cash_max = Slider(title="max_cash", value=d5['max_cash'], start=0.0, end=200)
-select = RadioGroup(labels=["base repayments only", "repay ASAP"], active=0)
+select = RadioGroup(labels=[label for label, asap in STRATEGIES], active=0)
 button = Button(label="Calculate", button_type="success")
 
 stats = PreText(text='', width=800)
@@ -104,23 +167,45 @@ def update():
     d1['monthly_income'] = s1_input.value
     d2['monthly_income'] = s2_input.value
     d1['monthly_expenses'] = expense_input.value
-    if select.labels[select.active] == "base repayments only":
-        d3['pay_debt_asap'] = False
-    elif select.labels[select.active] == "repay ASAP":
-        d3['pay_debt_asap'] = True
-    else:
-        raise ValueError("select variable gave unexpected value: {0}".format(
-            select.labels[select.active]))
-    update_text("Placeholder text...")
+    update_text("Calculating...")
     update_graphic()
 
 
-widget_list = widgetbox(select, debt_input, debt_repay, expense_input,
-                        cash_start, cash_max, s1_input, s2_input,
-                        button, width=300)
+widget_list = column(select, debt_input, debt_repay, expense_input,
+                     cash_start, cash_max, s1_input, s2_input, button,
+                     width=300)
 
 button.on_click(update)
 
+
+def show_strategy(attr, old, new):
+    """Show only the quads of the selected strategy, no recalculation"""
+    for i, renderer in enumerate(renderers):
+        renderer.visible = i == select.active
+
+
+select.on_change('active', show_strategy)
+show_strategy('active', None, select.active)
+
+# slider moves recalculate too, once the slider has been still for a moment
+pending_update = [None]
+
+
+def schedule_update(attr, old, new):
+    if pending_update[0] is not None:
+        doc.remove_timeout_callback(pending_update[0])
+    pending_update[0] = doc.add_timeout_callback(run_update, 75)
+
+
+def run_update():
+    pending_update[0] = None
+    update()
+
+
+for slider in (debt_input, debt_repay, expense_input, cash_start, cash_max,
+               s1_input, s2_input):
+    slider.on_change('value', schedule_update)
+
 # Set up layouts and add to document
 bottomrow = row(stats)
 toprow = row(widget_list, plot)
@@ -0,0 +1,111 @@
+import numpy as np
+import pandas as pd
+from fispy.fispy import month_timeline
+from fispy.batch import BatchPortfolio
+
+DISTRIBUTIONS = ('normal', 'lognormal', 'bootstrap')
+
+
+def monthly_growth(distribution, size, rng, mean=0.00333, std=0.04,
+                   history=None):
+    """Draw monthly stock growth multipliers (1 + monthly return).
+
+    'normal' and 'lognormal' draws share the same mean and standard
+    deviation of the monthly return, so only the shape of the distribution
+    changes. 'bootstrap' resamples a supplied array of historical monthly
+    returns with replacement.
+
+    :param distribution: one of 'normal', 'lognormal' or 'bootstrap'
+    :param size: shape of the array to draw, e.g. (months, paths)
+    :param rng: np.random.RandomState (or Generator) to draw from
+    :param mean: float mean monthly return
+    :param std: float standard deviation of the monthly return
+    :param history: array of historical monthly returns, for 'bootstrap'
+    :returns: np.array of growth multipliers
+    """
+    if distribution == 'normal':
+        return 1 + rng.normal(mean, std, size)
+    elif distribution == 'lognormal':
+        sigma2 = np.log(1 + (std / (1 + mean)) ** 2)
+        return rng.lognormal(np.log(1 + mean) - sigma2 / 2,
+                             np.sqrt(sigma2), size)
+    elif distribution == 'bootstrap':
+        if history is None or not len(history):
+            raise ValueError("bootstrap needs an array of historical returns")
+        return 1 + rng.choice(np.asarray(history, dtype=float), size)
+    raise ValueError("distribution should be one of {0}, not {1}".format(
+        DISTRIBUTIONS, distribution))
+
+
+def _rank(values, q):
+    """Nearest rank percentiles of values, which may hold np.inf"""
+    ordered = np.sort(values)
+    index = np.round(np.asarray(q) / 100. * (len(ordered) - 1)).astype(int)
+    return ordered[index]
+
+
+class MonteCarloResult(object):
+    """Percentile bands of a Monte Carlo projection.
+
+    :param bands: pd.DataFrame indexed by month, with a networth_pXX and
+                  debt_pXX column per percentile
+    :param fi_date: dict of percentile to the date FI is reached, or None
+                    when it is not reached within the projection
+    :param fi_reached: fraction of paths reaching FI
+    """
+
+    def __init__(self, bands, fi_date, fi_reached, paths):
+        self.bands = bands
+        self.fi_date = fi_date
+        self.fi_reached = fi_reached
+        self.paths = paths
+
+
+def monte_carlo(portfolio, paths=1000, distribution='normal', seed=None,
+                mean=0.00333, std=0.04, history=None,
+                percentiles=(5, 50, 95)):
+    """Project a Portfolio along many paths of random monthly stock returns,
+    replacing the fixed Portfolio.stock_growth. All paths run together in a
+    BatchPortfolio and share one seeded random generator; only the
+    percentiles are kept, so memory does not grow with the horizon.
+
+    :param portfolio: Portfolio object to project, it is left unchanged
+    :param paths: integer number of return paths
+    :param distribution: 'normal', 'lognormal' or 'bootstrap'
+    :param seed: integer seed, or a np.random.RandomState to draw from
+    :param mean, std, history: distribution parameters, see monthly_growth
+    :param percentiles: percentiles to report
+    :returns: a MonteCarloResult object
+    """
+    if hasattr(seed, 'normal'):
+        rng = seed
+    else:
+        rng = np.random.RandomState(seed)
+    batch = BatchPortfolio.repeat(portfolio, paths)
+    prd = batch.prd
+    networth = np.empty((prd, len(percentiles)))
+    debt = np.empty((prd, len(percentiles)))
+    first_fi = np.full(paths, np.inf)
+    for t in range(prd):
+        batch.stock_growth = monthly_growth(distribution, paths, rng,
+                                            mean=mean, std=std,
+                                            history=history)
+        batch.update_monthly()
+        reached = batch.fi & np.isinf(first_fi) & (batch.insolvent < 0)
+        first_fi[reached] = t
+        alive = batch.insolvent < 0
+        if alive.any():
+            networth[t] = np.percentile(batch.networth[alive], percentiles)
+            debt[t] = np.percentile(batch.debt[alive], percentiles)
+        else:
+            networth[t] = debt[t] = np.nan
+    dates = month_timeline(portfolio.date, prd).dates[1:prd + 1]
+    bands = pd.DataFrame(np.hstack([networth, debt]), index=list(dates),
+                         columns=['{0}_p{1}'.format(name, q)
+                                  for name in ('networth', 'debt')
+                                  for q in percentiles])
+    fi_date = {}
+    for q, month in zip(percentiles, _rank(first_fi, percentiles)):
+        fi_date[q] = None if np.isinf(month) else dates[int(month)]
+    return MonteCarloResult(bands, fi_date,
+                            np.isfinite(first_fi).mean(), paths)
@@ -0,0 +1,71 @@
+import time
+from fispy.fispy import MONTHLY_PHASES
+
+
+class PhaseTimer(object):
+    """Collects call counts and cumulative nanosecond timings of each
+    Portfolio monthly phase through Portfolio.add_hook(). One timer can be
+    attached to many portfolios, to total a whole run of scenarios.
+
+    :returns: A PhaseTimer instance, use attach() to start collecting
+    """
+
+    def __init__(self):
+        self.calls = {}
+        self.nanoseconds = {}
+        self._started = {}
+
+    def before(self, portfolio, phase):
+        self._started[phase] = time.perf_counter_ns()
+
+    def after(self, portfolio, phase):
+        elapsed = time.perf_counter_ns() - self._started.pop(phase)
+        self.calls[phase] = self.calls.get(phase, 0) + 1
+        self.nanoseconds[phase] = self.nanoseconds.get(phase, 0) + elapsed
+
+    def attach(self, portfolio):
+        """Start timing the phases of portfolio"""
+        portfolio.add_hook(before=self.before, after=self.after)
+        return self
+
+    def detach(self, portfolio):
+        """Stop timing the phases of portfolio"""
+        portfolio.remove_hook(before=self.before, after=self.after)
+        return self
+
+    def reset(self):
+        self.calls = {}
+        self.nanoseconds = {}
+
+    def _phases(self):
+        """Phases seen so far, in the order they are run"""
+        order = MONTHLY_PHASES + ('quad_positions',)
+        return sorted(self.calls, key=lambda phase: (
+            order.index(phase) if phase in order else len(order), phase))
+
+    def to_dict(self):
+        """:returns: dict of phase to {'calls': int, 'nanoseconds': int}"""
+        return dict((phase, {'calls': self.calls[phase],
+                             'nanoseconds': self.nanoseconds[phase]})
+                    for phase in self._phases())
+
+    def to_prometheus(self, prefix='fispy_phase'):
+        """Export the counts and timings in the Prometheus text format, as
+        two counters labelled by phase (timings in seconds).
+
+        :param prefix: metric name prefix
+        :returns: string
+        """
+        lines = ['# HELP {0}_calls_total Calls of each Portfolio monthly '
+                 'phase.'.format(prefix),
+                 '# TYPE {0}_calls_total counter'.format(prefix)]
+        for phase in self._phases():
+            lines.append('{0}_calls_total{{phase="{1}"}} {2}'.format(
+                prefix, phase, self.calls[phase]))
+        lines += ['# HELP {0}_seconds_total Time spent in each Portfolio '
+                  'monthly phase.'.format(prefix),
+                  '# TYPE {0}_seconds_total counter'.format(prefix)]
+        for phase in self._phases():
+            lines.append('{0}_seconds_total{{phase="{1}"}} {2:.9f}'.format(
+                prefix, phase, self.nanoseconds[phase] / 1e9))
+        return '\n'.join(lines) + '\n'
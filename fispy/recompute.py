@@ -0,0 +1,150 @@
+import threading
+import multiprocessing
+from functools import partial
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+_default_executor = None
+_process_pool = None
+_context = multiprocessing.get_context('spawn')
+_executor_lock = threading.Lock()
+
+
+def default_executor():
+    """The thread pool shared by every LatestRequest made without one.
+    Simulations hold the GIL, so its threads should only wait on work done
+    elsewhere, e.g. by iter_process(), or they slow down the server thread
+    and each other.
+    """
+    global _default_executor
+    with _executor_lock:
+        if _default_executor is None:
+            _default_executor = ThreadPoolExecutor(max_workers=4)
+    return _default_executor
+
+
+def process_pool():
+    """The process pool iter_process() runs its generators on, one worker
+    per CPU. Workers are spawned rather than forked, as the Bokeh server
+    they are started from runs threads.
+    """
+    global _process_pool
+    with _executor_lock:
+        if _process_pool is None:
+            _process_pool = ProcessPoolExecutor(mp_context=_context)
+    return _process_pool
+
+
+def _feed(writer, fn, args, kwargs):
+    """Worker side of iter_process(): send every item of
+    fn(*args, **kwargs) as (True, item), then (False, None). Stops once the
+    reading end has been closed.
+    """
+    try:
+        for item in fn(*args, **kwargs):
+            writer.send((True, item))
+        writer.send((False, None))
+    except BrokenPipeError:
+        pass
+    finally:
+        writer.close()
+
+
+def iter_process(fn, *args, **kwargs):
+    """Iterate over fn(*args, **kwargs) in a worker process of
+    process_pool(), e.g. to stream the chunks of a projection without
+    holding the GIL of this process. Each item is handed over through a
+    pipe as soon as it is done. Closing the generator early stops the
+    worker at its next item. fn, its arguments and the items must all be
+    picklable, so fn has to be a module level function.
+
+    :param fn: generator function
+    :returns: generator of the items of fn(*args, **kwargs)
+    """
+    reader, writer = _context.Pipe(duplex=False)
+    future = process_pool().submit(_feed, writer, fn, args, kwargs)
+    # the worker is sent a copy of writer, once it has been picked up
+    future.add_done_callback(lambda future: writer.close())
+    try:
+        while True:
+            if not reader.poll(1):
+                # raises the error of a worker that died
+                if future.done():
+                    future.result()
+                continue
+            try:
+                more, item = reader.recv()
+            except EOFError:
+                # fn failed, raise its error
+                future.result()
+                raise
+            if not more:
+                break
+            yield item
+    finally:
+        reader.close()
+
+
+class LatestRequest(object):
+    """Runs a function off the calling thread, keeping only the latest
+    request. At most one call is in flight per instance: requests made while
+    one is running replace each other, so only the newest parameters are
+    computed next, and the result of any call that has been superseded is
+    dropped rather than delivered.
+
+    :param fn: function to run, e.g. ResultCache.quads
+    :param deliver: function called with the result of the latest request,
+                    from the executor thread (in the Bokeh app it hands the
+                    result to curdoc().add_next_tick_callback)
+    :param executor: concurrent.futures executor, default_executor() if None
+    :param on_error: function called with the exception of a failed latest
+                     request, the error is dropped if None
+    :returns: A LatestRequest instance
+    """
+
+    def __init__(self, fn, deliver, executor=None, on_error=None):
+        self.fn = fn
+        self.deliver = deliver
+        self.on_error = on_error
+        self._executor = executor or default_executor()
+        self._lock = threading.RLock()
+        self._generation = 0
+        self._pending = None
+        self._running = None
+        self.coalesced = 0
+        self.dropped = 0
+
+    @property
+    def busy(self):
+        return self._running is not None
+
+    def submit(self, *args, **kwargs):
+        """Request fn(*args, **kwargs). Returns straight away."""
+        with self._lock:
+            self._generation += 1
+            if self._pending is not None:
+                self.coalesced += 1
+            self._pending = (self._generation, args, kwargs)
+            if self._running is None:
+                self._start()
+
+    def _start(self):
+        """Run the pending request, with self._lock held"""
+        generation, args, kwargs = self._pending
+        self._pending = None
+        self._running = self._executor.submit(self.fn, *args, **kwargs)
+        self._running.add_done_callback(partial(self._done, generation))
+
+    def _done(self, generation, future):
+        with self._lock:
+            self._running = None
+            latest = generation == self._generation
+            if self._pending is not None:
+                self._start()
+        if not latest:
+            self.dropped += 1
+            return
+        error = future.exception()
+        if error is None:
+            self.deliver(future.result())
+        elif self.on_error is not None:
+            self.on_error(error)
@@ -0,0 +1,196 @@
+import os
+import json
+import numpy as np
+import pandas as pd
+from numpy.lib.format import open_memmap
+from fispy.fispy import month_timeline
+
+RESULT_FIELDS = ('debt', 'cash', 'net_investments', 'networth', 'fi')
+RESULT_DTYPE = np.dtype([('debt', 'f8'), ('cash', 'f8'),
+                         ('net_investments', 'f8'), ('networth', 'f8'),
+                         ('fi', '?')])
+INDEX_DTYPE = np.dtype([('id', 'i8'), ('start', 'M8[D]'), ('months', 'i4'),
+                        ('insolvent', 'i4'), ('done', '?')])
+
+
+class ResultFile(object):
+    """Monthly states of many projections, held on disk in a directory:
+    states.npy is a (portfolio, month) array of RESULT_DTYPE records,
+    index.npy holds the id, start date, valid months, insolvent month and
+    done flag of each portfolio, and meta.json the shape. Both arrays are
+    memory mapped, so reading one portfolio only touches its own row.
+
+    :param path: directory written by a ResultWriter
+    :returns: A ResultFile instance
+    """
+    _mode = 'r'
+
+    def __init__(self, path):
+        self.path = path
+        self._open()
+
+    def _open(self):
+        with open(os.path.join(self.path, 'meta.json')) as f:
+            self.meta = json.load(f)
+        self.prd = self.meta['prd']
+        self.data = np.load(os.path.join(self.path, 'states.npy'),
+                            mmap_mode=self._mode)
+        self.index = np.load(os.path.join(self.path, 'index.npy'),
+                             mmap_mode=self._mode)
+        self._rows = None
+
+    def __len__(self):
+        return len(self.index)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        self.data = self.index = None
+
+    @property
+    def ids(self):
+        return self.index['id']
+
+    def pending(self):
+        """Rows that have not been written yet"""
+        return np.flatnonzero(~self.index['done'])
+
+    def row(self, portfolio_id):
+        """Row of the portfolio with id portfolio_id"""
+        if self._rows is None:
+            self._rows = dict((i, row) for row, i in
+                              enumerate(self.index['id'].tolist()))
+        return self._rows[portfolio_id]
+
+    def states(self, row):
+        """The monthly states of one portfolio, read from disk.
+
+        :param row: integer row, see row() to look one up by id
+        :returns: a pd.DataFrame of the RESULT_FIELDS indexed by date, with
+                  a row for each month run before any insolvency
+        """
+        entry = self.index[row]
+        if not entry['done']:
+            raise KeyError("Row {0} has not been written".format(row))
+        months = int(entry['months'])
+        dates = month_timeline(entry['start'].item(), months).dates
+        records = np.array(self.data[row, :months])
+        return pd.DataFrame(dict((name, records[name])
+                                 for name in RESULT_FIELDS),
+                            index=list(dates[1:months + 1]),
+                            columns=RESULT_FIELDS)
+
+
+class ResultWriter(ResultFile):
+    """Preallocates a ResultFile for the projections of ids, and fills it in
+    as results arrive. Only the rows being written are held in memory, so
+    any number of portfolios can be written at a constant cost. With append
+    the rows written by an earlier, interrupted run are kept, and pending()
+    gives the ones still to do.
+
+    :param path: directory to write to
+    :param ids: list of integer portfolio ids, one per row
+    :param prd: integer number of months of each projection
+    :param append: bool, reopen the results already at path if there are
+                   any, rather than starting again
+    :returns: A ResultWriter instance
+    """
+    _mode = 'r+'
+
+    def __init__(self, path, ids, prd, append=False):
+        self.path = path
+        if append and os.path.exists(os.path.join(path, 'meta.json')):
+            self._open()
+            if self.prd != prd or not np.array_equal(self.ids, ids):
+                raise ValueError("Results at {0} are for other portfolios "
+                                 "or another prd".format(path))
+            return
+        if not os.path.isdir(path):
+            os.makedirs(path)
+        ids = np.asarray(ids, dtype='i8')
+        data = open_memmap(os.path.join(path, 'states.npy'), mode='w+',
+                           dtype=RESULT_DTYPE, shape=(len(ids), prd))
+        index = open_memmap(os.path.join(path, 'index.npy'), mode='w+',
+                            dtype=INDEX_DTYPE, shape=(len(ids),))
+        index['id'] = ids
+        index['insolvent'] = -1
+        data.flush()
+        index.flush()
+        del data, index
+        with open(os.path.join(path, 'meta.json'), 'w') as f:
+            json.dump({'prd': prd, 'n': len(ids),
+                       'fields': list(RESULT_FIELDS)}, f)
+        self._open()
+
+    def write(self, row, states, start, insolvent=-1):
+        """Write the projection of one portfolio, e.g. the states of a
+        Portfolio.run_until() RunResult.
+
+        :param row: integer row
+        :param states: pd.DataFrame or dict of at least the RESULT_FIELDS,
+                       one value per month
+        :param start: dt.date the portfolio starts on
+        :param insolvent: integer month the portfolio could not pay its way
+                          in, -1 if it never failed
+        """
+        months = len(states['fi'])
+        for name in RESULT_FIELDS:
+            self.data[name][row, :months] = states[name]
+        self.index[row] = (self.index['id'][row], start, months, insolvent,
+                           True)
+
+    def write_result(self, offset, result):
+        """Write every scenario of a BatchResult, as the rows from offset
+        on.
+
+        :param offset: integer row of the first scenario
+        :param result: BatchResult object of prd months
+        """
+        rows = slice(offset, offset + len(result))
+        for name in RESULT_FIELDS:
+            self.data[name][rows] = getattr(result, name)
+        index = self.index[rows]
+        index['start'] = result.start
+        index['months'] = [result.months(i) for i in range(len(result))]
+        index['insolvent'] = result.insolvent
+        index['done'] = True
+
+    def flush(self):
+        """Write the changes so far to disk"""
+        self.data.flush()
+        self.index.flush()
+
+    def close(self):
+        if self.data is not None:
+            self.flush()
+        super(ResultWriter, self).close()
+
+
+def project_store(store, path, prd, chunksize=500):
+    """Project every portfolio of a PortfolioStore prd months into a
+    ResultFile, chunksize portfolios at a time as one BatchPortfolio each,
+    so memory does not grow with the number of portfolios. Rerunning it on
+    the same path picks up where an interrupted run stopped.
+
+    :param store: PortfolioStore object
+    :param path: directory of the ResultFile
+    :param prd: integer number of months to run
+    :param chunksize: number of portfolios run together
+    :returns: a ResultFile object
+    """
+    with ResultWriter(path, store.ids(), prd, append=True) as writer:
+        pending = writer.pending()
+        # runs of consecutive pending rows, cut into chunks
+        breaks = np.flatnonzero(np.diff(pending) != 1) + 1
+        for block in np.split(pending, breaks):
+            for start in range(0, len(block), chunksize):
+                rows = block[start:start + chunksize]
+                batch, ids = store.load_batch(writer.ids[rows].tolist(),
+                                              prd=prd)
+                writer.write_result(int(rows[0]), batch.run())
+                writer.flush()
+    return ResultFile(path)
@@ -0,0 +1,90 @@
+import numpy as np
+import pandas as pd
+from fispy.batch import BatchPortfolio
+from fispy.sweep import param_name
+
+
+def input_fields(portfolio):
+    """The (asset index, field) inputs of a Portfolio that sensitivity()
+    perturbs by default: every field of BatchPortfolio.field_columns an
+    asset has a value other than 0 for. A 0, like the debt of a property
+    that is paid off, is left out, as it can only be moved one way.
+    """
+    keys = []
+    for i, asset in enumerate(portfolio.assets):
+        for name in sorted(BatchPortfolio.field_columns):
+            if getattr(asset, name):
+                keys.append((i, name))
+    return keys
+
+
+def _fi_month(fi):
+    """First FI month of each scenario, NaN if FI is never reached"""
+    return np.where(fi.any(axis=1), fi.argmax(axis=1), np.nan)
+
+
+def sensitivity(portfolio, fields=None, step=0.05):
+    """How much the final net worth and the FI month move when each input
+    is nudged down and up, one at a time. Every perturbation runs in the
+    same BatchPortfolio as the unchanged portfolio, so the whole table
+    costs one batched simulation of 2 * len(fields) + 1 scenarios.
+
+    :param portfolio: Portfolio object, used as it stands and not changed
+    :param fields: list of (asset index, field) to perturb, defaults to
+                   input_fields(portfolio); a field that is None raises a
+                   ValueError
+    :param step: float fraction of each value to move it by, and the
+                 absolute step of values that are 0
+    :returns: a tornado pd.DataFrame indexed by input name, with the base,
+              low and high values, the net worth and FI month of each,
+              their differences (change per unit of the input, central
+              unless low is clipped), and the swings (high minus low),
+              ranked by the size of the FI month swing and then the net
+              worth swing. None of the fields can be negative, so low is
+              clipped at 0, and the difference of a field at 0 is one
+              sided. Inputs that make the portfolio insolvent, or never
+              reach FI, give NaN.
+    """
+    if fields is None:
+        fields = input_fields(portfolio)
+    fields = list(fields)
+    base = []
+    for i, name in fields:
+        value = getattr(portfolio.assets[i], name)
+        if value is None:
+            raise ValueError("Asset {0} has no {1} to perturb".format(
+                i, name))
+        base.append(float(value))
+    base = np.array(base)
+    delta = np.where(base != 0, np.abs(base) * step, step)
+    low_values = np.maximum(base - delta, 0.0)
+    high_values = base + delta
+    batch = BatchPortfolio.repeat(portfolio, 2 * len(fields) + 1)
+    for k, (i, name) in enumerate(fields):
+        values = np.full(batch.n, base[k])
+        values[2 * k + 1] = low_values[k]
+        values[2 * k + 2] = high_values[k]
+        batch.set_field(i, name, values)
+    result = batch.run()
+    networth = result.networth[:, -1]
+    fi_month = _fi_month(result.fi)
+    low = slice(1, None, 2)
+    high = slice(2, None, 2)
+    table = pd.DataFrame({
+        'base': base,
+        'low': low_values,
+        'high': high_values,
+        'networth_low': networth[low],
+        'networth_high': networth[high],
+        'fi_month_low': fi_month[low],
+        'fi_month_high': fi_month[high]},
+        index=pd.Index([param_name(key) for key in fields], name='input'))
+    table['networth_swing'] = table['networth_high'] - table['networth_low']
+    table['fi_month_swing'] = table['fi_month_high'] - table['fi_month_low']
+    table['d_networth'] = table['networth_swing'] / (high_values - low_values)
+    table['d_fi_month'] = table['fi_month_swing'] / (high_values - low_values)
+    table.attrs['networth'] = networth[0]
+    table.attrs['fi_month'] = fi_month[0]
+    order = np.lexsort((-table['networth_swing'].abs().fillna(-1),
+                        -table['fi_month_swing'].abs().fillna(-1)))
+    return table.iloc[order]
@@ -0,0 +1,258 @@
+import sqlite3
+import numpy as np
+import pandas as pd
+from fispy.fispy import (ASSET_KINDS, DEFAULT_RULES, AssetTable, Portfolio,
+                         Rule, parse_rules)
+from fispy.batch import BatchPortfolio
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS portfolios (
+    id INTEGER PRIMARY KEY,
+    name TEXT,
+    prd INTEGER NOT NULL,
+    buy_property_threshold REAL NOT NULL,
+    stock_growth REAL NOT NULL,
+    rules TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS assets (
+    portfolio_id INTEGER NOT NULL REFERENCES portfolios (id)
+        ON DELETE CASCADE,
+    position INTEGER NOT NULL,
+    kind TEXT NOT NULL,
+    monthly_income REAL,
+    monthly_expenses REAL,
+    debt REAL,
+    value REAL,
+    max_cash REAL,
+    monthly_repayment REAL,
+    start_date TEXT,
+    end_date TEXT,
+    pay_debt_asap INTEGER NOT NULL,
+    PRIMARY KEY (portfolio_id, position)
+);
+"""
+
+# Asset fields in the column order of the assets table
+_ASSET_COLUMNS = ('kind', 'monthly_income', 'monthly_expenses', 'debt',
+                  'value', 'max_cash', 'monthly_repayment', 'start_date',
+                  'end_date', 'pay_debt_asap')
+_SETTINGS = ('prd', 'buy_property_threshold', 'stock_growth', 'rules')
+
+
+def _column_values(table, name):
+    """A column of an AssetTable as a list of SQLite values: None for NaN
+    and NaT, ISO date strings and plain ints and floats.
+    """
+    column = table[name]
+    if name == 'kind':
+        return np.array(ASSET_KINDS, dtype=object)[column].tolist()
+    if name in AssetTable._dates:
+        text = np.datetime_as_string(column, unit='D').astype(object)
+        text[np.isnat(column)] = None
+        return text.tolist()
+    if name == 'pay_debt_asap':
+        return column.astype(int).tolist()
+    values = column.astype(object)
+    values[np.isnan(column)] = None
+    return values.tolist()
+
+
+class PortfolioStore(object):
+    """Portfolios and their assets in a SQLite database, one row per
+    portfolio (its name, prd and settings) and one per asset. Saving and
+    loading go column by column through AssetTable, in one transaction,
+    so thousands of portfolios can be written or read back without making
+    an Asset object per row. load_batch() hands the stored portfolios to a
+    BatchPortfolio directly, e.g. to re-project all of them each night.
+
+    Only the assets and settings are stored, not the state of a portfolio
+    that has been run, so save portfolios before running them. The rules
+    of a portfolio are stored as their repr() and read back with
+    parse_rules().
+
+    :param path: path of the database file, ':memory:' for a private
+                 in-memory database
+    :returns: A PortfolioStore instance
+    """
+
+    def __init__(self, path=':memory:'):
+        self.path = path
+        self.connection = sqlite3.connect(path)
+        self.connection.execute('PRAGMA foreign_keys = ON')
+        self.connection.executescript(_SCHEMA)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def __len__(self):
+        return self.connection.execute(
+            'SELECT COUNT(*) FROM portfolios').fetchone()[0]
+
+    def close(self):
+        self.connection.close()
+
+    def ids(self):
+        """:returns: list of the ids of every stored portfolio, in order"""
+        return [row[0] for row in self.connection.execute(
+            'SELECT id FROM portfolios ORDER BY id')]
+
+    def save(self, portfolios, names=None):
+        """Store Portfolio objects, with their assets and settings.
+
+        :param portfolios: list of Portfolio objects
+        :param names: optional list of one name per portfolio
+        :returns: list of the new portfolio ids
+        """
+        scenario = np.repeat(np.arange(len(portfolios)),
+                             [len(portfolio.assets)
+                              for portfolio in portfolios])
+        table = AssetTable.from_assets([asset for portfolio in portfolios
+                                        for asset in portfolio.assets])
+        settings = dict((name, [getattr(portfolio, name)
+                                for portfolio in portfolios])
+                        for name in _SETTINGS)
+        return self.save_table(table, scenario, names=names, **settings)
+
+    def save_table(self, table, scenario, names=None, prd=60,
+                   buy_property_threshold=80, stock_growth=1.00333,
+                   rules=DEFAULT_RULES):
+        """Store the portfolios held in the columns of an AssetTable, in
+        one transaction.
+
+        :param table: AssetTable object holding the assets of every
+                      portfolio
+        :param scenario: integer array, the portfolio (0 to n - 1) of each
+                         row of table
+        :param names: optional list of one name per portfolio
+        :param prd: integer, or list with one value per portfolio
+        :param buy_property_threshold: float, or list with one value per
+                                       portfolio
+        :param stock_growth: float, or list with one value per portfolio
+        :param rules: tuple of Rule objects, or list with one tuple per
+                      portfolio
+        :returns: list of the new portfolio ids
+        """
+        scenario = np.asarray(scenario, dtype=int)
+        if len(scenario) != len(table):
+            raise ValueError("scenario needs one entry per row of the table")
+        n = scenario.max() + 1 if len(scenario) else 0
+        if names is None:
+            names = [None] * n
+        elif len(names) != n:
+            raise ValueError("names needs one entry per portfolio")
+        settings = [np.broadcast_to(np.asarray(value), n).tolist()
+                    for value in (prd, buy_property_threshold, stock_growth)]
+        if all(isinstance(rule, Rule) for rule in rules):
+            rules = [rules] * n
+        elif len(rules) != n:
+            raise ValueError("rules needs one tuple per portfolio")
+        settings.append([repr(tuple(value)) for value in rules])
+        position = pd.Series(scenario).groupby(scenario).cumcount()
+        columns = [_column_values(table, name) for name in _ASSET_COLUMNS]
+        with self.connection:
+            first, = self.connection.execute(
+                'SELECT COALESCE(MAX(id), 0) + 1 FROM portfolios').fetchone()
+            ids = list(range(first, first + n))
+            self.connection.executemany(
+                'INSERT INTO portfolios VALUES (?, ?, ?, ?, ?, ?)',
+                zip(ids, names, *settings))
+            self.connection.executemany(
+                'INSERT INTO assets VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, '
+                '?)', zip((scenario + first).tolist(), position.tolist(),
+                          *columns))
+        return ids
+
+    def _query(self, sql, ids):
+        """sql run over every portfolio, or only those in ids, as a
+        pd.DataFrame. sql selects from "{portfolios}", which is narrowed
+        down through a temporary table of ids when they are given.
+        """
+        if ids is None:
+            return pd.read_sql_query(sql.format(portfolios='portfolios'),
+                                     self.connection)
+        with self.connection:
+            self.connection.execute(
+                'CREATE TEMP TABLE IF NOT EXISTS wanted (id INTEGER PRIMARY '
+                'KEY)')
+            self.connection.execute('DELETE FROM wanted')
+            self.connection.executemany('INSERT OR IGNORE INTO wanted '
+                                        'VALUES (?)',
+                                        [(int(i),) for i in ids])
+        return pd.read_sql_query(sql.format(
+            portfolios='(SELECT portfolios.* FROM portfolios JOIN wanted '
+                       'USING (id)) AS portfolios'), self.connection)
+
+    def load_table(self, ids=None):
+        """Load the assets of the stored portfolios as columns.
+
+        :param ids: list of portfolio ids, None for all of them
+        :returns: (AssetTable, scenario, settings), where scenario is the
+                  index into settings of the portfolio of each row of the
+                  table, and settings is a pd.DataFrame of the name, prd,
+                  buy_property_threshold, stock_growth and rules (a tuple
+                  of Rule objects) of each portfolio, indexed by id
+        """
+        settings = self._query('SELECT id, name, prd, buy_property_threshold,'
+                               ' stock_growth, rules FROM {portfolios} '
+                               'ORDER BY id', ids).set_index('id')
+        settings['rules'] = settings['rules'].map(parse_rules)
+        if ids is not None and len(settings) < len(set(ids)):
+            raise KeyError("No portfolio with id {0}".format(
+                sorted(set(ids) - set(settings.index))[0]))
+        frame = self._query('SELECT assets.* FROM assets JOIN {portfolios} '
+                            'ON assets.portfolio_id = portfolios.id '
+                            'ORDER BY portfolio_id, position', ids)
+        scenario = np.searchsorted(settings.index.to_numpy(),
+                                   frame['portfolio_id'].to_numpy())
+        return AssetTable.from_frame(frame), scenario, settings
+
+    def load(self, portfolio_id):
+        """Load one stored portfolio.
+
+        :param portfolio_id: integer id
+        :returns: a Portfolio object
+        """
+        table, scenario, settings = self.load_table([portfolio_id])
+        row = settings.iloc[0]
+        portfolio = Portfolio(*table, prd=int(row['prd']))
+        portfolio.buy_property_threshold = row['buy_property_threshold']
+        portfolio.stock_growth = row['stock_growth']
+        portfolio.rules = row['rules']
+        return portfolio
+
+    def load_batch(self, ids=None, prd=None):
+        """Load stored portfolios straight into a BatchPortfolio, without
+        making Asset or Portfolio objects.
+
+        :param ids: list of portfolio ids, None for all of them
+        :param prd: integer number of months to run, defaults to the prd
+                    shared by all the portfolios
+        :returns: (BatchPortfolio, list of the portfolio id of each
+                  scenario)
+        """
+        table, scenario, settings = self.load_table(ids)
+        if prd is None:
+            prds = settings['prd'].unique()
+            if len(prds) != 1:
+                raise ValueError("Portfolios have different prd values, "
+                                 "pass prd explicitly")
+            prd = int(prds[0])
+        rules = set(settings['rules'])
+        if len(rules) > 1:
+            raise ValueError("Portfolios have different rules")
+        batch = BatchPortfolio.from_table(
+            table, scenario, prd=prd,
+            buy_property_threshold=settings['buy_property_threshold']
+            .to_numpy(),
+            stock_growth=settings['stock_growth'].to_numpy(),
+            rules=rules.pop() if rules else DEFAULT_RULES)
+        return batch, settings.index.tolist()
+
+    def delete(self, ids):
+        """Remove portfolios and their assets"""
+        with self.connection:
+            self.connection.executemany('DELETE FROM portfolios WHERE id = ?',
+                                        [(int(i),) for i in ids])
@@ -0,0 +1,96 @@
+import itertools
+import pandas as pd
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+from fispy.fispy import Asset, Portfolio
+from fispy.batch import BatchPortfolio
+
+
+def param_name(key):
+    """Column name of a (asset index, field) grid key, e.g. 'debt[2]'"""
+    return '{1}[{0}]'.format(*key)
+
+
+def _asset_specs(base_assets):
+    """Plain kwargs dictionaries for a list of Asset objects or dicts"""
+    return [dict(asset) for asset in base_assets]
+
+
+def _run_chunk(specs, keys, points, prd, offset):
+    """Worker: build the Portfolios of one chunk of grid points and run
+    them together as a BatchPortfolio.
+
+    :returns: (offset, pd.DataFrame) with one row per grid point
+    """
+    portfolios = []
+    for point in points:
+        kwargs = [dict(spec) for spec in specs]
+        for (index, field), value in zip(keys, point):
+            kwargs[index][field] = value
+        portfolios.append(Portfolio(*[Asset(**kw) for kw in kwargs], prd=prd))
+    summary = BatchPortfolio(*portfolios).run().summary()
+    for i, key in enumerate(keys):
+        summary.insert(i, param_name(key), [point[i] for point in points])
+    return offset, summary
+
+
+def iter_sweep(base_assets, param_grid, prd=60, workers=None,
+               chunksize=500):
+    """Run every combination of param_grid and yield the results chunk by
+    chunk, as soon as each one is done (not necessarily in grid order).
+
+    See sweep() for the arguments.
+
+    :returns: generator of (offset, pd.DataFrame), where offset is the
+              position of the first row of the chunk in the grid
+    """
+    specs = _asset_specs(base_assets)
+    keys = list(param_grid.keys())
+    grid = itertools.product(*[param_grid[key] for key in keys])
+    chunks = iter(lambda: list(itertools.islice(grid, chunksize)), [])
+    if not workers or workers == 1:
+        offset = 0
+        for points in chunks:
+            yield _run_chunk(specs, keys, points, prd, offset)
+            offset += len(points)
+        return
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        # keep only a couple of chunks per worker in flight, so huge grids
+        # are never materialised in the parent at once
+        pending = set()
+        offset = 0
+        for points in chunks:
+            pending.add(pool.submit(_run_chunk, specs, keys, points, prd,
+                                    offset))
+            offset += len(points)
+            if len(pending) >= 2 * workers:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    yield future.result()
+        for future in pending:
+            yield future.result()
+
+
+def sweep(base_assets, param_grid, prd=60, workers=None, chunksize=500):
+    """Project the Cartesian product of Asset parameter values, e.g. to find
+    the best repayment strategy. Chunks of grid points are shared out over a
+    process pool, and each chunk runs as one BatchPortfolio, so the result
+    does not depend on the number of workers.
+
+    :param base_assets: list of Asset objects or Asset kwargs dictionaries
+    :param param_grid: dict of (asset index, field) to a list of values,
+                       e.g. {(2, 'debt'): [50, 70], (2, 'pay_debt_asap'):
+                       [False, True]}
+    :param prd: integer number of months to run
+    :param workers: number of worker processes, None or 1 runs everything
+                    in this process
+    :param chunksize: number of grid points sent to a worker at once
+    :returns: a pd.DataFrame indexed by the parameter values, with the
+              BatchResult.summary() columns
+    """
+    chunks = sorted(iter_sweep(base_assets, param_grid, prd=prd,
+                               workers=workers, chunksize=chunksize),
+                    key=lambda chunk: chunk[0])
+    names = [param_name(key) for key in param_grid]
+    results = pd.concat([frame for offset, frame in chunks],
+                        ignore_index=True)
+    return results.set_index(names)
@@ -0,0 +1,28 @@
+"""Assets shared by the tests and the benchmarks"""
+import datetime as dt
+from fispy.fispy import Asset
+
+
+def app_assets(income=1.5, expenses=0.7, debt=70, repayment=0.5,
+               asap=True, cash=15, max_cash=30, second_income=1.5):
+    """The five assets the Bokeh app starts with, with the values of its
+    sliders (and repayment strategy) as arguments
+    """
+    return [Asset(**{'kind': 'job',
+                     'monthly_income': income,
+                     'monthly_expenses': expenses,
+                     'start_date': dt.date(2016, 6, 1)}),
+            Asset(**{'kind': 'job',
+                     'monthly_income': second_income,
+                     'start_date': dt.date(2016, 12, 1)}),
+            Asset(**{'kind': 'real estate',
+                     'debt': debt,
+                     'value': 150,
+                     'monthly_repayment': repayment,
+                     'start_date': dt.date(2016, 6, 1),
+                     'pay_debt_asap': asap}),
+            Asset(**{'kind': 'stocks',
+                     'value': 15}),
+            Asset(**{'kind': 'cash',
+                     'value': cash,
+                     'max_cash': max_cash})]
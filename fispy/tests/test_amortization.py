@@ -0,0 +1,75 @@
+import unittest
+import numpy as np
+from fispy.fispy import Asset, Portfolio
+from fispy.amortization import (amortize, amortize_many, portfolio_schedules,
+                                _schedule_rows)
+
+
+class TestAmortization(unittest.TestCase):
+    """Check the repayment schedules against the simulation"""
+
+    def test_matches_simulation(self):
+        pfolio = Portfolio(Asset(kind='job', monthly_income=5),
+                           Asset(kind='real estate', value=100, debt=70.3,
+                                 monthly_repayment=0.7),
+                           Asset(kind='cash', value=1, max_cash=2), prd=120)
+        index, schedule = portfolio_schedules(pfolio)
+        self.assertEqual(index, [1])
+        balance = []
+        for i in range(pfolio.prd):
+            pfolio.update_monthly()
+            balance.append(pfolio.assets[1].debt or 0.0)
+        np.testing.assert_array_equal(schedule.balance[0], balance)
+        self.assertEqual(schedule.payoff[0], 100)
+        self.assertAlmostEqual(schedule.payment[0].sum(), 70.3)
+
+    def test_interest(self):
+        schedule = amortize(100, 1, rate=0.005)
+        self.assertEqual(schedule.payoff, 138)
+        self.assertAlmostEqual(schedule.payment.sum(),
+                               100 + schedule.interest.sum())
+        # repayments below the interest never clear the debt
+        self.assertEqual(amortize(100, 0.4, rate=0.005).payoff, -1)
+        self.assertIs(amortize(100, 1, rate=0.005), schedule)
+        with self.assertRaises(ValueError):
+            schedule.balance[0] = 0
+
+    def test_many(self):
+        debt = [100, 150, np.nan, 100, 40]
+        repayment = [0.5, 1, np.nan, 0.5, 0]
+        schedule = amortize_many(debt, repayment, months=240)
+        self.assertEqual(schedule.balance.shape, (5, 240))
+        self.assertEqual(list(schedule.payoff), [199, 149, -1, 199, -1])
+        np.testing.assert_array_equal(schedule.balance[0],
+                                      amortize(100, 0.5, months=240).balance)
+        self.assertTrue((schedule.balance[4] == 40).all())
+
+    def test_reused_rows(self):
+        """Rows kept from earlier calls give the same schedules"""
+        _schedule_rows.clear()
+        debt = [100.1, 150.1, 20.1, 100.1]
+        repayment = [0.5, 1, 0.3, 0.5]
+        amortize_many(debt[:2], repayment[:2], rate=0.001, months=240)
+        self.assertEqual(len(_schedule_rows), 2)
+        schedule = amortize_many(debt, repayment, rate=0.001, months=240)
+        self.assertEqual(_schedule_rows.hits, 2)
+        _schedule_rows.clear()
+        fresh = amortize_many(debt, repayment, rate=0.001, months=240)
+        for name in ('balance', 'payment', 'interest', 'payoff'):
+            np.testing.assert_array_equal(getattr(schedule, name),
+                                          getattr(fresh, name))
+
+    def test_monthly_arithmetic(self):
+        """Schedules without interest round like monthly subtractions"""
+        debt = [70.3, 0.3, -1.0, 5.0, 0.0]
+        repayment = [0.1, 0.1, 0.5, 0.0, 0.5]
+        schedule = amortize_many(debt, repayment, months=800)
+        for k in range(len(debt)):
+            left, balance = debt[k], []
+            for month in range(800):
+                if left and repayment[k]:
+                    left = 0.0 if left - repayment[k] <= 0 else \
+                        left - repayment[k]
+                balance.append(left)
+            np.testing.assert_array_equal(schedule.balance[k], balance)
+        self.assertEqual(list(schedule.payoff), [702, 2, 0, -1, -1])
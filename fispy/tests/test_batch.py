@@ -0,0 +1,154 @@
+import unittest
+import datetime as dt
+import numpy as np
+import pandas as pd
+from fispy.fispy import Asset, AssetTable, BuyProperty, Portfolio, Rebalance
+from fispy.batch import BatchPortfolio
+from fispy.amortization import _schedule_rows
+from fispy.tests.assets import app_assets
+
+
+SCENARIOS = [{},
+             {'asap': False},
+             {'income': 2.9, 'debt': 133.3, 'repayment': 0.7},
+             {'expenses': 0.9, 'cash': 0, 'max_cash': 80},
+             {'debt': 0, 'repayment': 0}]
+
+
+class TestBatchMethods(unittest.TestCase):
+    """Check BatchPortfolio against the scalar Portfolio"""
+
+    def test_quads_match_scalar(self):
+        batch = BatchPortfolio(*[Portfolio(*app_assets(**kw), prd=200)
+                                 for kw in SCENARIOS])
+        result = batch.run()
+        for i, kw in enumerate(SCENARIOS):
+            expected = Portfolio(*app_assets(**kw), prd=200).gen_quads()
+            pd.testing.assert_frame_equal(result.quads(i), expected,
+                                          check_exact=True)
+
+    def test_mixed_asset_layouts(self):
+        """Scenarios do not need the same assets in the same order"""
+        portfolios = [Portfolio(*app_assets(), prd=120),
+                      Portfolio(*app_assets()[::-1], prd=120),
+                      Portfolio(*app_assets()[:1] + app_assets()[2:],
+                                prd=120)]
+        result = BatchPortfolio(*portfolios).run()
+        for i, portfolio in enumerate(portfolios):
+            assets = [Asset(**dict(asset)) for asset in portfolio.assets]
+            expected = Portfolio(*assets, prd=120).gen_quads()
+            pd.testing.assert_frame_equal(result.quads(i), expected,
+                                          check_exact=True)
+
+    def test_insolvent_scenario(self):
+        """Spending too much is flagged instead of raising"""
+        result = BatchPortfolio(Portfolio(*app_assets(expenses=4)),
+                                Portfolio(*app_assets())).run()
+        self.assertEqual(list(result.insolvent), [0, -1])
+        self.assertEqual(len(result.quads(0)), 0)
+        self.assertTrue(np.isnan(result.networth[0]).all())
+
+    def test_prd_must_match(self):
+        with self.assertRaises(ValueError):
+            BatchPortfolio(Portfolio(*app_assets(), prd=10),
+                           Portfolio(*app_assets(), prd=20))
+
+    def test_from_table(self):
+        """Scenarios packed from AssetTable columns match those packed
+        from Portfolio objects.
+        """
+        groups = [app_assets(**kw) for kw in SCENARIOS]
+        table = AssetTable.from_assets(sum(groups, []))
+        scenario = np.repeat(np.arange(len(groups)), 5)
+        result = BatchPortfolio.from_table(table, scenario, prd=200).run()
+        for i, kw in enumerate(SCENARIOS):
+            expected = Portfolio(*app_assets(**kw), prd=200).gen_quads()
+            pd.testing.assert_frame_equal(result.quads(i), expected,
+                                          check_exact=True)
+        with self.assertRaises(ValueError):
+            BatchPortfolio.from_table(table, scenario[1:])
+
+    def test_windows_match_scalar(self):
+        """Assets starting and ending part way through the run"""
+        def assets(kw, end):
+            group = app_assets(**kw)
+            group[1].end_date = end
+            group[3].start_date = dt.date(2017, 3, 31)
+            group[4].end_date = end + dt.timedelta(days=400)
+            return group
+        ends = [dt.date(2018, 1, 31), dt.date(2019, 7, 1),
+                dt.date(2016, 11, 1), dt.date(2030, 1, 1),
+                dt.date(2021, 2, 28)]
+        groups = [assets(kw, end) for kw, end in zip(SCENARIOS, ends)]
+        table = AssetTable.from_assets(sum(groups, []))
+        scenario = np.repeat(np.arange(len(groups)), 5)
+        results = [BatchPortfolio(*[Portfolio(*group, prd=200)
+                                    for group in groups]).run(),
+                   BatchPortfolio.from_table(table, scenario, prd=200).run()]
+        for i, kw in enumerate(SCENARIOS):
+            expected = Portfolio(*assets(kw, ends[i]), prd=200).gen_quads()
+            for result in results:
+                self.assertEqual(result.insolvent[i], -1)
+                pd.testing.assert_frame_equal(result.quads(i), expected,
+                                              check_exact=True)
+
+    def test_scheduled_debts(self):
+        """Batches whose debts are not paid off asap look them up in their
+        schedules, one for each activation window.
+        """
+        def portfolio(kw):
+            assets = app_assets(asap=False, **kw)
+            assets[2].end_date = dt.date(2025, 2, 1)
+            return Portfolio(*assets, prd=200)
+        scenarios = [{}, {'debt': 133.3, 'repayment': 0.7},
+                     {'repayment': 0.3}]
+        batch = BatchPortfolio(*[portfolio(kw) for kw in scenarios])
+        looked_up = []
+        debt_schedule = batch._debt_schedule
+
+        def counted():
+            schedule = debt_schedule()
+            looked_up.append(schedule is not None)
+            return schedule
+        batch._debt_schedule = counted
+        result = batch.run()
+        # every month the property is active, up to its end_date
+        self.assertEqual(sum(looked_up), 103)
+        for i, kw in enumerate(scenarios):
+            pd.testing.assert_frame_equal(result.quads(i),
+                                          portfolio(kw).gen_quads(),
+                                          check_exact=True)
+
+    def test_schedules_reused(self):
+        """A second batch with the same debts reuses their schedules"""
+        _schedule_rows.clear()
+        scenarios = [{'debt': 81.7, 'repayment': 0.6}, {'repayment': 0.3}]
+        portfolios = [Portfolio(*app_assets(asap=False, **kw), prd=200)
+                      for kw in scenarios]
+        first = BatchPortfolio(*portfolios).run()
+        misses = _schedule_rows.misses
+        self.assertGreater(misses, 0)
+        second = BatchPortfolio(*portfolios).run()
+        self.assertEqual(_schedule_rows.misses, misses)
+        self.assertGreaterEqual(_schedule_rows.hits, misses)
+        for i in range(len(scenarios)):
+            pd.testing.assert_frame_equal(second.quads(i), first.quads(i),
+                                          check_exact=True)
+
+    def test_rules_match_scalar(self):
+        rules = (Rebalance(stocks=0.7, every=6), BuyProperty(pro_rata=True))
+
+        def portfolio(kw):
+            assets = app_assets(**kw) + [Asset(kind='stocks', value=40)]
+            pfolio = Portfolio(*assets, prd=200)
+            pfolio.rules = rules
+            return pfolio
+        result = BatchPortfolio(*[portfolio(kw) for kw in SCENARIOS]).run()
+        for i, kw in enumerate(SCENARIOS):
+            pd.testing.assert_frame_equal(result.quads(i),
+                                          portfolio(kw).gen_quads(),
+                                          check_exact=True)
+        other = Portfolio(*app_assets())
+        other.rules = rules[1:]
+        with self.assertRaises(ValueError):
+            BatchPortfolio(portfolio({}), other)
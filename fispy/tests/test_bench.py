@@ -0,0 +1,61 @@
+import os
+import copy
+import shutil
+import tempfile
+import unittest
+from functools import partial
+from fispy.fispy import MONTHLY_PHASES
+from fispy.bench import (app_assets, synthetic_assets, run, compare, save,
+                         load, main)
+
+FIXTURES = {'small': (partial(synthetic_assets, 20), 24),
+            'app': (app_assets, 12)}
+
+
+class TestBenchMethods(unittest.TestCase):
+    """Check the benchmark harness on tiny fixtures"""
+
+    @classmethod
+    def setUpClass(cls):
+        cls.benchmark = run(FIXTURES, repeat=1)
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def test_metrics(self):
+        results = self.benchmark['results']
+        self.assertEqual(sorted(results), ['app', 'small'])
+        for name in MONTHLY_PHASES:
+            self.assertGreater(results['small']['phase.' + name], 0)
+        for name in ('gen_quads', 'quad_positions', 'dataframe'):
+            self.assertGreater(results['app'][name], 0)
+        self.assertGreater(results['app']['peak_memory'], 0)
+
+    def test_synthetic_assets(self):
+        assets = synthetic_assets(50, seed=1)
+        self.assertEqual(len(assets), 50)
+        self.assertEqual(sum(asset.kind == 'cash' for asset in assets), 1)
+
+    def test_compare(self):
+        current = copy.deepcopy(self.benchmark)
+        current['results']['app']['gen_quads'] = 1.0
+        table = compare(self.benchmark, current, threshold=0.1)
+        flagged = table[table['regression']].index.tolist()
+        self.assertEqual(flagged, [('app', 'gen_quads')])
+
+    def test_command_line(self):
+        baseline = os.path.join(self.tmp, 'baseline.json')
+        current = os.path.join(self.tmp, 'current.json')
+        save(self.benchmark, baseline)
+        slower = load(baseline)
+        slower['results']['small']['peak_memory'] *= 2
+        save(slower, current)
+        self.assertEqual(main(['compare', baseline, baseline]), 0)
+        self.assertEqual(main(['compare', baseline, current]), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,166 @@
+import shutil
+import tempfile
+import unittest
+import numpy as np
+import pandas as pd
+from fispy.fispy import Portfolio
+from fispy.cache import ResultCache, portfolio_key
+from fispy.tests.test_batch import app_assets
+
+
+class TestResultCache(unittest.TestCase):
+    """Check the memoized gen_quads results"""
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def test_key(self):
+        specs = [dict(asset) for asset in app_assets()]
+        self.assertEqual(portfolio_key(specs, 60),
+                         portfolio_key(app_assets(), 60))
+        self.assertNotEqual(portfolio_key(specs, 60),
+                            portfolio_key(specs, 61))
+        self.assertNotEqual(portfolio_key(specs, 60),
+                            portfolio_key(app_assets(debt=71), 60))
+        self.assertNotEqual(portfolio_key(specs, 60),
+                            portfolio_key(specs, 60, stock_growth=1.01))
+
+    def test_hits(self):
+        cache = ResultCache()
+        assets = app_assets()
+        quads = cache.quads(assets, prd=120)
+        pd.testing.assert_frame_equal(
+            quads, Portfolio(*app_assets(), prd=120).gen_quads())
+        self.assertEqual(assets[2].debt, 70)
+        pd.testing.assert_frame_equal(cache.quads(assets, prd=120), quads)
+        columns = cache.quads(assets, prd=120, output='dict')
+        np.testing.assert_array_equal(columns['top'], quads['top'])
+        self.assertEqual(cache.stats['hits'], 2)
+        self.assertEqual(cache.stats['misses'], 1)
+
+    def test_iter_quads(self):
+        cache = ResultCache()
+        parts = list(cache.iter_quads(app_assets(), prd=120, chunk=24,
+                                      output='frame'))
+        self.assertEqual(len(parts), 5)
+        self.assertEqual(cache.stats['misses'], 1)
+        quads = cache.quads(app_assets(), prd=120)
+        self.assertEqual(cache.stats['hits'], 1)
+        np.testing.assert_array_equal(
+            pd.concat(parts, ignore_index=True)['top'], quads['top'])
+        parts = list(cache.iter_quads(app_assets(), prd=120, chunk=24))
+        self.assertEqual(len(parts), 1)
+        np.testing.assert_array_equal(parts[0]['top'], quads['top'])
+
+    def test_scenario_quads(self):
+        cache = ResultCache()
+        scenarios = [app_assets(asap=False), app_assets(),
+                     app_assets(expenses=4)]
+        quads = cache.scenario_quads(scenarios, prd=120, output='frame')
+        self.assertEqual(list(np.unique(quads['scenario'])), [0, 1])
+        for i, expected in enumerate([app_assets(asap=False), app_assets()]):
+            pd.testing.assert_frame_equal(
+                quads[quads['scenario'] == i].drop(columns='scenario')
+                .reset_index(drop=True),
+                Portfolio(*expected, prd=120).gen_quads())
+        # the insolvent scenario is run again, the others are cached
+        self.assertEqual(len(cache), 2)
+        columns = cache.scenario_quads(scenarios, prd=120)
+        self.assertEqual(cache.stats['hits'], 2)
+        np.testing.assert_array_equal(columns['scenario'], quads['scenario'])
+
+    def test_iter_scenario_quads(self):
+        """Chunks of the batch run hold the scenario_quads() of each
+        scenario, in order.
+        """
+        scenarios = [app_assets(asap=False), app_assets(),
+                     app_assets(expenses=4)]
+        expected = ResultCache().scenario_quads(scenarios, prd=120)
+        cache = ResultCache()
+        cache.quads(app_assets(), prd=120)
+        parts = list(cache.iter_scenario_quads(scenarios, prd=120,
+                                               chunk=24))
+        self.assertEqual(len(parts), 5)
+        # the cached scenario comes whole with the first chunk
+        self.assertEqual(list(np.unique(parts[0]['scenario'])), [0, 1])
+        self.assertEqual(list(np.unique(parts[1]['scenario'])), [0])
+        joined = dict((name, np.concatenate([part[name] for part in parts]))
+                      for name in expected)
+        for i in range(len(scenarios)):
+            for name, column in expected.items():
+                np.testing.assert_array_equal(
+                    joined[name][joined['scenario'] == i],
+                    column[expected['scenario'] == i])
+        # the solvent scenarios are cached once the run is done
+        self.assertEqual(len(cache), 2)
+        parts = list(cache.iter_scenario_quads(scenarios[:2], prd=120,
+                                               chunk=24))
+        self.assertEqual(len(parts), 1)
+        self.assertEqual(cache.stats['hits'], 3)
+
+    def test_iter_scenario_quads_process(self):
+        """Run in a worker process, the chunks and the cached results are
+        the same as run here.
+        """
+        scenarios = [app_assets(asap=False), app_assets(expenses=4)]
+        here, there = ResultCache(), ResultCache()
+        expected = list(here.iter_scenario_quads(scenarios, prd=120,
+                                                 chunk=24))
+        parts = list(there.iter_scenario_quads(scenarios, prd=120, chunk=24,
+                                               process=True))
+        self.assertEqual(len(parts), len(expected))
+        for part, expected_part in zip(parts, expected):
+            for name, column in expected_part.items():
+                np.testing.assert_array_equal(part[name], column)
+        self.assertEqual(len(there), 1)
+        np.testing.assert_array_equal(
+            there.quads(scenarios[0], prd=120, output='records'),
+            here.quads(scenarios[0], prd=120, output='records'))
+
+    def test_settings(self):
+        cache = ResultCache()
+        quads = cache.quads(app_assets(), prd=120, stock_growth=1.01)
+        pfolio = Portfolio(*app_assets(), prd=120)
+        pfolio.stock_growth = 1.01
+        pd.testing.assert_frame_equal(quads, pfolio.gen_quads())
+
+    def test_eviction(self):
+        records = ResultCache().quads(app_assets(), prd=60, output='records')
+        cache = ResultCache(max_bytes=2 * records.nbytes)
+        for debt in (10, 20, 30):
+            cache.quads(app_assets(debt=debt), prd=60, output='records')
+        self.assertEqual(len(cache), 2)
+        self.assertEqual(cache.evictions, 1)
+        self.assertLessEqual(cache.nbytes, cache.max_bytes)
+        cache.quads(app_assets(debt=10), prd=60, output='records')
+        self.assertEqual(cache.misses, 4)
+
+    def test_oversized_frame(self):
+        """A result too big to keep does not leave its frame counted"""
+        cache = ResultCache(max_bytes=10000)
+        cache.quads(app_assets(), prd=200)
+        self.assertEqual(cache.stats['entries'], 0)
+        self.assertEqual(cache.nbytes, 0)
+        cache.quads(app_assets(), prd=20)
+        cache.quads(app_assets(), prd=20)
+        self.assertEqual(cache.hits, 1)
+        self.assertLessEqual(cache.nbytes, cache.max_bytes)
+
+    def test_disk(self):
+        first = ResultCache(directory=self.tmp)
+        expected = first.quads(app_assets(), prd=60)
+        second = ResultCache(directory=self.tmp)
+        records = second.quads(app_assets(), prd=60, output='records')
+        self.assertEqual(second.disk_hits, 1)
+        self.assertIsInstance(records.base, np.memmap)
+        pd.testing.assert_frame_equal(second.quads(app_assets(), prd=60),
+                                      expected)
+        second.clear(disk=True)
+        self.assertNotIn(portfolio_key(app_assets(), 60), second)
+
+
+if __name__ == '__main__':
+    unittest.main()
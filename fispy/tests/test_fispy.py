@@ -1,6 +1,15 @@
+import io
 import unittest
+import contextlib
 import datetime as dt
-from fispy.fispy import Asset, Portfolio
+import numpy as np
+import pandas as pd
+from dateutil.relativedelta import relativedelta
+from fispy.fispy import (STATE_FIELDS, Asset, AssetTable, BuyProperty,
+                         EventLog, Portfolio, Rebalance, month_timeline,
+                         networth_above)
+from fispy.amortization import amortize
+from fispy.tests.test_batch import app_assets
 
 a_cashpile = Asset(**{'kind': 'cash',
                       'max_cash': 50.,
@@ -22,7 +31,7 @@ class TestFispyMethods(unittest.TestCase):
         for k, v in a_cashpile:
             if v:
                 n += 1
-        self.assertEqual(n, 4)
+        self.assertEqual(n, 3)
 
     def test_count_cash(self):
         pfolio = Portfolio(a_cashpile)
@@ -52,5 +61,594 @@ class TestFispyMethods(unittest.TestCase):
         pfolio.calc_net_worth()
         self.assertEqual(pfolio.networth, 165)
 
+    def test_kind_normalized(self):
+        asset = Asset(**{'kind': 'Stocks', 'value': 10})
+        self.assertEqual(asset.kind, 'stocks')
+
+    def test_kind_index(self):
+        """Assets added later are indexed and totalled like the first ones"""
+        pfolio = Portfolio(a_job, a_cashpile)
+        pfolio.add_new_asset(Asset(**{'kind': 'real estate', 'value': 150,
+                                      'debt': 70, 'monthly_income': 0.8,
+                                      'monthly_repayment': 0.5}))
+        self.assertEqual(pfolio._by_kind['cash'], [a_cashpile])
+        self.assertEqual(len(pfolio._by_kind['real estate']), 1)
+        self.assertEqual(pfolio._income_total, 1.5 + 0.8)
+        self.assertEqual(pfolio._passive_total, 0.8)
+        self.assertEqual(pfolio._repayment_total, 0.5)
+        pfolio.check_fi()
+        self.assertEqual(pfolio.passive_income, 0.8)
+        self.assertFalse(pfolio.fi)
+
+    def test_reindex(self):
+        """Fields changed in place count once the Portfolio is reindexed"""
+        pfolio = Portfolio(Asset(**dict(a_job)),
+                           Asset(**{'kind': 'real estate', 'value': 150,
+                                    'monthly_income': 0.8}))
+        pfolio.assets[0].monthly_income = 3.0
+        pfolio.assets[1].debt = 70
+        pfolio.assets[1].monthly_repayment = 0.5
+        pfolio.reindex()
+        pfolio.monthly_ingres()
+        self.assertEqual(pfolio.monthly_income, 3.0 + 0.8)
+        self.assertEqual(pfolio._debtors, [pfolio.assets[1]])
+        self.assertEqual(pfolio._repayment_total, 0.5)
+        pfolio.check_fi()
+        self.assertFalse(pfolio.fi)
+        pfolio.assets[1].monthly_repayment = 0.2
+        pfolio.reindex()
+        pfolio.check_fi()
+        self.assertTrue(pfolio.fi)
+
+    def test_asset_slots(self):
+        """Assets hold a fixed set of fields and no instance dictionary"""
+        self.assertFalse(hasattr(a_cashpile, '__dict__'))
+        with self.assertRaises(AttributeError):
+            a_cashpile.symbol = 'NYSE:BRK.B'
+
+
+class TestAssetTableMethods(unittest.TestCase):
+    """Tests for the struct-of-arrays AssetTable"""
+
+    records = [{'kind': 'job', 'monthly_income': 1.5,
+                'monthly_expenses': 0.5, 'start_date': dt.date(2016, 6, 1)},
+               {'kind': 'Real Estate', 'value': 150, 'debt': 70,
+                'pay_debt_asap': True, 'start_date': dt.date(2016, 6, 1)},
+               {'kind': 'cash', 'max_cash': 50., 'value': 15,
+                'start_date': dt.date(2016, 6, 1)}]
+
+    def test_columns(self):
+        table = AssetTable.from_records(self.records)
+        self.assertEqual(len(table), 3)
+        self.assertEqual(list(table.kind), [2, 0, 3])
+        np.testing.assert_array_equal(table['value'], [np.nan, 150, 15])
+        self.assertEqual(list(table.pay_debt_asap), [False, True, False])
+
+    def test_rows_are_assets(self):
+        table = AssetTable.from_records(self.records)
+        pfolio = Portfolio(*table)
+        pfolio.calc_net_worth()
+        self.assertEqual(pfolio.networth, 165)
+        self.assertEqual(dict(table[1])['kind'], 'real estate')
+        self.assertIsNone(table[0].debt)
+
+    def test_from_frame(self):
+        table = AssetTable.from_frame(pd.DataFrame(self.records))
+        self.assertEqual(table.to_frame()['kind'].tolist(),
+                         ['job', 'real estate', 'cash'])
+
+    def test_bad_kind(self):
+        with self.assertRaises(AssertionError):
+            AssetTable.from_records([{'kind': 'bonds'}])
+
+
+class TestQuadMethods(unittest.TestCase):
+    """Tests for the columnar gen_quads outputs"""
+
+    def portfolio(self):
+        return Portfolio(Asset(**dict(a_job)),
+                         Asset(**{'kind': 'stocks', 'value': 100}), prd=3)
+
+    def test_matches_quad_positions(self):
+        quads = self.portfolio().gen_quads()
+        pfolio = self.portfolio()
+        left, right, bottom, top, color = [], [], [], [], []
+        for i in range(pfolio.prd):
+            pfolio.update_monthly()
+            pfolio.quad_positions(left, right, bottom, top, color)
+        self.assertEqual(quads['top'].tolist(), top)
+        self.assertEqual(quads['bottom'].tolist(), bottom)
+        self.assertEqual(quads['color'].astype(str).tolist(), color)
+        self.assertEqual([day.date() for day in quads['left']], left)
+        self.assertEqual([day.date() for day in quads['right']], right)
+        self.assertEqual(quads['color'].dtype, 'category')
+
+    def test_outputs(self):
+        frame = self.portfolio().gen_quads()
+        columns = self.portfolio().gen_quads(output='dict')
+        records = self.portfolio().gen_quads(output='records')
+        self.assertEqual(columns['color'].tolist(),
+                         frame['color'].astype(str).tolist())
+        np.testing.assert_array_equal(records.top, frame['top'])
+        self.assertEqual(records.left.dtype, np.dtype('M8[D]'))
+        # the dictionary columns are views of one record array
+        self.assertIs(columns['top'].base, columns['bottom'].base)
+        with self.assertRaises(ValueError):
+            self.portfolio().gen_quads(output='json')
+
+    def test_iter_quads(self):
+        whole = Portfolio(*app_assets(), prd=50).gen_quads()
+        for chunk in (1, 7, 12, 50, 60):
+            parts = list(Portfolio(*app_assets(), prd=50).iter_quads(
+                chunk=chunk, output='frame'))
+            self.assertEqual(len(parts), -(-50 // chunk))
+            streamed = pd.concat(parts, ignore_index=True)
+            streamed['color'] = streamed['color'].astype(whole['color'].dtype)
+            pd.testing.assert_frame_equal(streamed, whole)
+        parts = list(Portfolio(*app_assets(), prd=50).iter_quads(chunk=7))
+        np.testing.assert_array_equal(
+            np.concatenate([part['top'] for part in parts]), whole['top'])
+        self.assertEqual(sum([part['color'].tolist() for part in parts], []),
+                         whole['color'].astype(str).tolist())
+
+
+class TestEditMethods(unittest.TestCase):
+    """Tests for checkpointed re-simulation"""
+
+    def portfolio(self):
+        return Portfolio(Asset(**dict(a_job)),
+                         Asset(**{'kind': 'real estate', 'value': 150,
+                                  'debt': 70, 'monthly_repayment': 0.5,
+                                  'pay_debt_asap': True}),
+                         Asset(**{'kind': 'stocks', 'value': 15}),
+                         Asset(**{'kind': 'cash', 'value': 15,
+                                  'max_cash': 30}), prd=120)
+
+    def test_matches_full_run(self):
+        pfolio = self.portfolio()
+        pfolio.keep_checkpoints = True
+        pfolio.gen_quads()
+        quads, months = pfolio.edit({(1, 'monthly_repayment'): 0.3},
+                                    month=100)
+        self.assertEqual(months, range(96, 120))
+        quads, months = pfolio.edit({(0, 'monthly_expenses'): 0.2},
+                                    month=30)
+        self.assertEqual(months, range(24, 120))
+        full = self.portfolio()
+        full.edits = {100: [{(1, 'monthly_repayment'): 0.3}],
+                      30: [{(0, 'monthly_expenses'): 0.2}]}
+        pd.testing.assert_frame_equal(quads, full.gen_quads())
+        self.assertEqual(len(pfolio.assets), len(full.assets))
+        self.assertEqual(pfolio.networth, full.networth)
+
+    def test_checkpoints_opt_in(self):
+        """Runs that are not edited only save their start, and the first
+        edit turns checkpoints on.
+        """
+        pfolio = self.portfolio()
+        pfolio.gen_quads()
+        self.assertEqual(list(pfolio._checkpoints), [0])
+        quads, months = pfolio.edit({(2, 'value'): 20}, month=50)
+        self.assertEqual(months, range(120))
+        self.assertEqual(len(pfolio._checkpoints), 10)
+        quads, months = pfolio.edit({(2, 'value'): 30}, month=50)
+        self.assertEqual(months, range(48, 120))
+
+    def test_without_run(self):
+        pfolio = self.portfolio()
+        pfolio.checkpoint_every = None
+        quads, months = pfolio.edit({(2, 'value'): 20})
+        self.assertEqual(months, range(120))
+        quads, months = pfolio.edit({(2, 'value'): 30}, month=60)
+        self.assertEqual(months, range(120))
+
+
+class TestSolveMethods(unittest.TestCase):
+    """Tests for solving FI and payoff dates without a full run"""
+
+    def portfolio(self, *extra):
+        return Portfolio(Asset(**dict(a_job)),
+                         Asset(**{'kind': 'real estate', 'value': 150,
+                                  'debt': 30, 'monthly_repayment': 0.3,
+                                  'monthly_income': 0.8}),
+                         Asset(**{'kind': 'real estate', 'value': 100,
+                                  'debt': 20.5, 'monthly_repayment': 0.1,
+                                  'pay_debt_asap': True}),
+                         *extra, prd=150)
+
+    def simulate(self, pfolio):
+        fi_date = None
+        paid = {1: None, 2: None}
+        for i in range(pfolio.prd):
+            pfolio.update_monthly()
+            if fi_date is None and pfolio.fi:
+                fi_date = pfolio.date
+            for index in paid:
+                if paid[index] is None and not pfolio.assets[index].debt:
+                    paid[index] = pfolio.date
+        return fi_date, paid
+
+    def test_solved(self):
+        pfolio = self.portfolio()
+        self.assertTrue(pfolio._solvable())
+        fi_date, paid = self.simulate(self.portfolio())
+        self.assertEqual(pfolio.solve_fi_date(), fi_date)
+        self.assertEqual(pfolio.solve_payoff_dates(), paid)
+        self.assertEqual(paid[2], dt.date(2017, 9, 1))
+
+    def test_scheduled_debts(self):
+        """Debts not paid off asap are looked up in their schedules"""
+        def portfolio():
+            pfolio = self.portfolio()
+            pfolio.assets[2].pay_debt_asap = False
+            pfolio.assets[2].monthly_repayment = 0.7
+            pfolio.reindex()
+            return pfolio
+        fi_date, paid = self.simulate(portfolio())
+        pfolio = portfolio()
+        self.assertEqual(pfolio.solve_payoff_dates(), paid)
+        hits = amortize.cache_info().hits
+        self.assertEqual(pfolio.solve_fi_date(), fi_date)
+        self.assertEqual(amortize.cache_info().hits, hits + 2)
+
+    def test_simulated(self):
+        """Buying property falls back on stepping the whole Portfolio"""
+        stocks = {'kind': 'stocks', 'value': 60}
+        pfolio = self.portfolio(Asset(**stocks))
+        self.assertFalse(pfolio._solvable())
+        fi_date, paid = self.simulate(self.portfolio(Asset(**stocks)))
+        self.assertEqual(pfolio.solve_fi_date(), fi_date)
+        self.assertEqual(pfolio.solve_payoff_dates(), paid)
+        self.assertEqual(len(pfolio.assets), 4)
+        self.assertEqual(pfolio.assets[2].debt, 20.5)
+
+
+class TestTrace(unittest.TestCase):
+    """Tests for the full monthly state trace"""
+
+    def test_quads_from_trace(self):
+        for prd in (1, 60, 400):
+            trace = Portfolio(*app_assets(), prd=prd).trace()
+            expected = Portfolio(*app_assets(), prd=prd).gen_quads()
+            pd.testing.assert_frame_equal(trace.quads(), expected,
+                                          check_exact=True)
+
+    def test_states(self):
+        pfolio = Portfolio(*app_assets(), prd=400)
+        trace = pfolio.trace()
+        expected = Portfolio(*app_assets(), prd=400).run_until(
+            lambda portfolio: False).states
+        pd.testing.assert_frame_equal(trace.states, expected,
+                                      check_exact=True)
+        # properties bought during the run get their own columns
+        self.assertEqual(trace.value.shape, (400, len(pfolio.assets)))
+        self.assertGreater(len(pfolio.assets), 5)
+        self.assertEqual(trace.kinds[-1], 'real estate')
+        self.assertTrue(np.isnan(trace.value[0, -1]))
+        self.assertEqual(trace.value[-1, 3], pfolio.assets[3].value)
+        first = Portfolio(*app_assets(), prd=1)
+        first.trace()
+        self.assertEqual(trace.debt[0, 2], first.assets[2].debt)
+
+    def test_to_frame(self):
+        trace = Portfolio(*app_assets(), prd=24).trace()
+        frame = trace.to_frame()
+        self.assertEqual(len(frame), 24 * (len(STATE_FIELDS) + 2 * 5))
+        cash = frame[(frame['asset'] == -1) & (frame['field'] == 'cash')]
+        np.testing.assert_array_equal(cash['value'], trace.states['cash'])
+        debt = frame[(frame['asset'] == 2) & (frame['field'] == 'debt')]
+        np.testing.assert_array_equal(debt['value'], trace.debt[:, 2])
+        self.assertEqual(set(debt['kind']), {'real estate'})
+
+
+class TestRules(unittest.TestCase):
+    """Tests for the monthly buy and sell rules"""
+
+    def portfolio(self, *rules):
+        pfolio = Portfolio(*app_assets(), Asset(kind='stocks', value=45),
+                           prd=12)
+        pfolio.rules = rules
+        return pfolio
+
+    def test_default(self):
+        self.assertEqual(Portfolio().rules, (BuyProperty(),))
+        self.assertNotEqual(BuyProperty(), BuyProperty(pro_rata=True))
+        self.assertEqual(repr(Rebalance(0.5, 3)),
+                         'Rebalance(every=3, stocks=0.5)')
+
+    def test_pro_rata(self):
+        pfolio = self.portfolio()
+        pfolio.sell_shares(20, pro_rata=True)
+        values = [asset.value for asset in pfolio._by_kind['stocks']]
+        self.assertAlmostEqual(sum(values), 40)
+        self.assertAlmostEqual(values[1] / values[0], 3)
+        pfolio.sell_shares(50, pro_rata=True)
+        self.assertEqual([asset.value for asset in pfolio.assets[3::2]],
+                         [0, 0])
+
+    def test_rebalance(self):
+        pfolio = self.portfolio(Rebalance(stocks=0.25, every=4))
+        shares = {}
+
+        def after(portfolio, phase):
+            if phase == 'monthly_buy':
+                held = sum(asset.value for asset in portfolio.assets[3::2])
+                shares[portfolio._step] = held / (held + portfolio.assets[4]
+                                                  .value)
+        pfolio.add_hook(after=after)
+        for month in range(12):
+            pfolio.update_monthly()
+        self.assertAlmostEqual(shares[4], 0.25)
+        self.assertAlmostEqual(shares[8], 0.25)
+        self.assertGreater(shares[5], 0.25)
+        self.assertEqual(len(pfolio.assets), 6)
+
+
+class TestSolveFor(unittest.TestCase):
+    """Tests for goal seeking an Asset field for a target FI date"""
+
+    def fi_date(self, field, value):
+        assets = app_assets()
+        setattr(assets[field[0]], field[1], value)
+        return Portfolio(*assets, prd=400).solve_fi_date()
+
+    def test_income(self):
+        target = dt.date(2020, 1, 1)
+        field = (0, 'monthly_income')
+        value = Portfolio(*app_assets(), prd=400).solve_for(
+            field, target, (0.8, 10), tol=1e-3)
+        self.assertLessEqual(self.fi_date(field, value), target)
+        self.assertGreater(self.fi_date(field, value - 1e-3), target)
+
+    def test_debt(self):
+        target = dt.date(2028, 1, 1)
+        field = (2, 'debt')
+        value = Portfolio(*app_assets(), prd=400).solve_for(
+            field, target, (0, 300), tol=1e-3)
+        self.assertLessEqual(self.fi_date(field, value), target)
+        self.assertGreater(self.fi_date(field, value + 1e-3), target)
+
+    def test_out_of_reach(self):
+        pfolio = Portfolio(*app_assets(), prd=400)
+        field = (2, 'monthly_repayment')
+        self.assertIsNone(pfolio.solve_for(field, dt.date(2023, 1, 1),
+                                           (0.1, 0.75)))
+        # every value is in time, so the cheapest end is given
+        self.assertEqual(pfolio.solve_for(field, dt.date(2025, 1, 1),
+                                          (0.1, 0.75)), 0.1)
+        with self.assertRaises(ValueError):
+            pfolio.solve_for((2, 'kind'), dt.date(2024, 1, 1), (0, 1))
+
+
+class TestRunUntil(unittest.TestCase):
+    """Tests for stopping a projection early"""
+
+    def portfolio(self, repayment=0.5):
+        return Portfolio(Asset(**dict(a_job)),
+                         Asset(**{'kind': 'real estate', 'value': 150,
+                                  'debt': 70, 'monthly_income': 0.8,
+                                  'monthly_repayment': repayment,
+                                  'pay_debt_asap': True}),
+                         Asset(**{'kind': 'stocks', 'value': 15}), prd=200)
+
+    def test_fi(self):
+        result = self.portfolio().run_until('fi')
+        quads = self.portfolio().gen_quads()
+        fi = quads['color'].astype(str) == '#e65c00'
+        self.assertTrue(result.reached)
+        self.assertEqual(pd.Timestamp(result.date), quads['left'][fi].iloc[0])
+        self.assertEqual(len(result.states), result.month + 1)
+        self.assertTrue(result.states['fi'].iloc[-1])
+        self.assertFalse(result.states['fi'].iloc[:-1].any())
+
+    def test_not_reached(self):
+        result = self.portfolio().run_until(networth_above(1e9),
+                                            max_months=24)
+        self.assertFalse(result.reached)
+        self.assertIsNone(result.date)
+        self.assertEqual(len(result.states), 24)
+
+    def test_insolvent(self):
+        """A repayment that cant be met ends the run without raising"""
+        pfolio = self.portfolio(repayment=2.0)
+        result = pfolio.run_until('debt_free')
+        self.assertTrue(result.insolvent)
+        self.assertEqual(result.month, 0)
+        self.assertIn('repayment', result.error)
+        self.assertEqual(pfolio.assets[1].debt, 70)
+        with self.assertRaises(ValueError):
+            pfolio.run_until('rich')
+
+
+class TestEventLog(unittest.TestCase):
+    """Tests for the structured event log"""
+
+    def portfolio(self, verbose=False):
+        return Portfolio(Asset(**dict(a_job)),
+                         Asset(**{'kind': 'real estate', 'value': 150,
+                                  'debt': 10, 'monthly_repayment': 0.5,
+                                  'pay_debt_asap': True}),
+                         Asset(**{'kind': 'stocks', 'value': 60}),
+                         prd=120, verbose=verbose)
+
+    def test_events(self):
+        pfolio = self.portfolio()
+        output = io.StringIO()
+        with contextlib.redirect_stdout(output):
+            pfolio.gen_quads()
+        self.assertEqual(output.getvalue(), '')
+        bought = pfolio.events.query('property bought')
+        self.assertEqual(len(bought), len(pfolio.assets) - 3)
+        self.assertEqual(len(pfolio.events.query('shares sold')),
+                         len(bought))
+        self.assertEqual(
+            pfolio.events.query('debt cleared')['asset'].tolist(), [1, 3])
+        frame = pfolio.event_frame()
+        self.assertEqual(frame['event'][0], 'assets added')
+        self.assertEqual(frame['amount'][0], 3)
+        fi = frame[frame['event'] == 'fi reached']
+        self.assertEqual(fi['date'].iloc[0],
+                         self.portfolio().run_until('fi').date)
+
+    def test_overpaid_debt(self):
+        """A debt cleared by a pay_debt_asap overpayment is logged in the
+        month it is paid off, with what was owed.
+        """
+        pfolio = Portfolio(Asset(kind='job', monthly_income=3.0,
+                                 start_date=dt.date(2016, 6, 1)),
+                           Asset(kind='real estate', value=150, debt=3.0,
+                                 monthly_repayment=0.5, pay_debt_asap=True),
+                           prd=12)
+        payoff = pfolio.solve_payoff_dates()[1]
+        pfolio.gen_quads()
+        cleared = pfolio.event_frame().query('event == "debt cleared"')
+        self.assertEqual(cleared['date'].tolist(), [payoff])
+        self.assertEqual(cleared['amount'].tolist(), [2.5])
+
+    def test_verbose(self):
+        output = io.StringIO()
+        with contextlib.redirect_stdout(output):
+            self.portfolio(verbose=True).gen_quads()
+        self.assertIn('month 0: assets added 3.00', output.getvalue())
+        self.assertIn('property bought (asset 3)', output.getvalue())
+
+    def test_rewind(self):
+        """Rerunning from a checkpoint replaces the later events"""
+        pfolio = self.portfolio()
+        pfolio.gen_quads()
+        pfolio.edit({(0, 'monthly_expenses'): 1.2}, month=50)
+        full = self.portfolio()
+        full.edits = {50: [{(0, 'monthly_expenses'): 1.2}]}
+        full.gen_quads()
+        np.testing.assert_array_equal(pfolio.events.to_array(),
+                                      full.events.to_array())
+
+    def test_ring_buffer(self):
+        log = EventLog(capacity=4)
+        for step in range(6):
+            log.record(step, 'shares sold', amount=step)
+        self.assertEqual(len(log), 4)
+        self.assertEqual(log.dropped, 2)
+        self.assertEqual(log.to_array()['step'].tolist(), [2, 3, 4, 5])
+        log.truncate(5)
+        self.assertEqual(log.to_array()['step'].tolist(), [2, 3, 4])
+
+
+class TestAssetWindows(unittest.TestCase):
+    """Tests for the months assets take part in"""
+
+    def assets(self):
+        return [Asset(**dict(a_job)),
+                Asset(**{'kind': 'real estate', 'value': 150, 'debt': 30,
+                         'monthly_income': 0.5, 'monthly_repayment': 0.4,
+                         'start_date': dt.date(2017, 1, 1),
+                         'end_date': dt.date(2019, 1, 1)}),
+                Asset(**{'kind': 'stocks', 'value': 15,
+                         'end_date': dt.date(2020, 6, 15)})]
+
+    def test_start_date(self):
+        self.assertIsNone(Asset(kind='cash').start_date)
+        self.assertEqual(Portfolio(*self.assets()).date, dt.date(2016, 6, 1))
+        self.assertEqual(Portfolio(Asset(kind='cash')).date,
+                         dt.date.today())
+
+    def test_windows(self):
+        states = Portfolio(*self.assets(), prd=60).run_until(
+            lambda pfolio: False).states
+        passive = states['passive_income']
+        self.assertEqual(passive[dt.date(2016, 12, 1)], 0)
+        self.assertEqual(passive[dt.date(2017, 1, 1)], 0.5)
+        self.assertEqual(passive[dt.date(2018, 12, 1)], 0.5)
+        self.assertEqual(passive[dt.date(2019, 1, 1)], 0)
+        debt = states['debt']
+        self.assertEqual(debt[dt.date(2016, 12, 1)], 0)
+        self.assertEqual(debt[dt.date(2017, 1, 1)], 30 - 0.4)
+        self.assertEqual(debt[dt.date(2019, 1, 1)], 0)
+        self.assertEqual(states['net_investments'][dt.date(2020, 7, 1)], 0)
+
+    def test_solve_fi_date(self):
+        """Solving steps through the months the windows change in"""
+        pfolio = Portfolio(*self.assets(), prd=60)
+        self.assertFalse(pfolio._solvable())
+        fi = Portfolio(*self.assets(), prd=60).run_until('fi').date
+        self.assertEqual(pfolio.solve_fi_date(), fi)
+
+    def test_purchases_keep_windows(self):
+        """Buying properties over a long run extends the window arrays
+        rather than rebuilding them every month.
+        """
+        pfolio = Portfolio(*app_assets(), prd=1200)
+        built = []
+        window_arrays = pfolio._window_arrays
+
+        def counted():
+            built.append(1)
+            return window_arrays()
+        pfolio._window_arrays = counted
+        pfolio.gen_quads(output='records')
+        self.assertGreater(len(pfolio.assets), 100)
+        self.assertEqual(len(built), 1)
+        self.assertEqual(len(pfolio._windows[0]), len(pfolio.assets))
+
+    def test_add_later_asset(self):
+        """An asset added part way through waits for its start_date"""
+        pfolio = Portfolio(*self.assets(), prd=60)
+        pfolio.buy_property_threshold = 1e9
+        pfolio.run_until(lambda pfolio: False, max_months=24)
+        pfolio.add_new_asset(Asset(kind='real estate', monthly_income=1.0,
+                                   start_date=dt.date(2019, 1, 1),
+                                   end_date=dt.date(2020, 1, 1)))
+        added = pfolio.run_until(lambda pfolio: False,
+                                 max_months=36).states['passive_income']
+        base = Portfolio(*self.assets(), prd=60)
+        base.buy_property_threshold = 1e9
+        states = base.run_until(lambda pfolio: False).states
+        extra = added - states['passive_income'][24:]
+        self.assertEqual(extra[:dt.date(2018, 12, 1)].max(), 0)
+        self.assertEqual(extra[dt.date(2019, 1, 1):dt.date(2019, 12, 1)]
+                         .min(), 1.0)
+        self.assertEqual(extra[dt.date(2020, 1, 1):].max(), 0)
+
+    def test_edit_end_date(self):
+        pfolio = Portfolio(*self.assets(), prd=60)
+        pfolio.gen_quads()
+        quads, months = pfolio.edit({(1, 'end_date'): dt.date(2022, 1, 1)},
+                                    month=20)
+        fresh = Portfolio(*self.assets(), prd=60)
+        fresh.edits = {20: [{(1, 'end_date'): dt.date(2022, 1, 1)}]}
+        pd.testing.assert_frame_equal(quads, fresh.gen_quads(),
+                                      check_exact=True)
+
+
+class TestMonthTimeline(unittest.TestCase):
+    """Tests for the precomputed month calendar"""
+
+    def test_matches_relativedelta(self):
+        """Month ends are clipped and stay clipped, as relativedelta does"""
+        start = dt.date(2016, 1, 31)
+        dates = [start]
+        for i in range(25):
+            dates.append(dates[-1] + relativedelta(months=1))
+        timeline = month_timeline(start, 24)
+        self.assertEqual(timeline.dates, tuple(dates))
+        self.assertEqual(timeline.days.tolist(), dates)
+        self.assertEqual(timeline.months[2], np.datetime64('2016-03'))
+
+    def test_shared(self):
+        start = dt.date(2016, 6, 1)
+        self.assertIs(month_timeline(start, 60), month_timeline(start, 60))
+        self.assertFalse(month_timeline(start, 60).days.flags.writeable)
+
+    def test_portfolio_steps(self):
+        """The timeline grows if a Portfolio runs past prd months"""
+        pfolio = Portfolio(Asset(**dict(a_job)), prd=2)
+        quads = pfolio.gen_quads()
+        self.assertEqual(pfolio.date, dt.date(2016, 8, 1))
+        self.assertEqual(quads['left'][0], pd.Timestamp(2016, 7, 1))
+        self.assertEqual(quads['right'][7], pd.Timestamp(2016, 9, 1))
+        quads = pfolio.gen_quads()
+        self.assertEqual(pfolio.date, dt.date(2016, 10, 1))
+        self.assertEqual(quads['left'][0], pd.Timestamp(2016, 9, 1))
+
 if __name__ == '__main___':
     unittest.main()
@@ -0,0 +1,45 @@
+import unittest
+import numpy as np
+from fispy.fispy import Portfolio
+from fispy.batch import BatchPortfolio
+from fispy.montecarlo import monte_carlo, monthly_growth
+from fispy.tests.test_batch import app_assets
+
+
+class TestMonteCarloMethods(unittest.TestCase):
+    """Check the Monte Carlo projection"""
+
+    def test_zero_volatility_is_deterministic(self):
+        """With no spread every path follows the fixed stock growth"""
+        result = monte_carlo(Portfolio(*app_assets(), prd=120), paths=20,
+                             std=0.0, seed=0)
+        expected = BatchPortfolio(Portfolio(*app_assets(), prd=120)).run()
+        for q in (5, 50, 95):
+            np.testing.assert_array_equal(
+                result.bands['networth_p{0}'.format(q)], expected.networth[0])
+            np.testing.assert_array_equal(
+                result.bands['debt_p{0}'.format(q)], expected.debt[0])
+        first = expected.dates(0)[0][np.argmax(expected.fi[0])]
+        self.assertEqual(result.fi_date, {5: first, 50: first, 95: first})
+
+    def test_seed_repeats(self):
+        kw = {'paths': 50, 'seed': 42, 'distribution': 'lognormal'}
+        first = monte_carlo(Portfolio(*app_assets(), prd=60), **kw)
+        second = monte_carlo(Portfolio(*app_assets(), prd=60), **kw)
+        self.assertTrue(first.bands.equals(second.bands))
+
+    def test_bands_are_ordered(self):
+        history = np.random.RandomState(1).normal(0.005, 0.05, 240)
+        result = monte_carlo(Portfolio(*app_assets(), prd=120), paths=200,
+                             distribution='bootstrap', history=history,
+                             seed=3)
+        bands = result.bands
+        self.assertTrue((bands['networth_p5'] <= bands['networth_p50']).all())
+        self.assertTrue((bands['networth_p50'] <= bands['networth_p95']).all())
+
+    def test_bad_distribution(self):
+        rng = np.random.RandomState(0)
+        with self.assertRaises(ValueError):
+            monthly_growth('uniform', 10, rng)
+        with self.assertRaises(ValueError):
+            monthly_growth('bootstrap', 10, rng)
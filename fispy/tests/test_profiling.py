@@ -0,0 +1,59 @@
+import unittest
+from fispy.fispy import Portfolio, MONTHLY_PHASES
+from fispy.profiling import PhaseTimer
+from fispy.tests.test_batch import app_assets
+
+
+class TestPhaseTimer(unittest.TestCase):
+    """Check the phase hooks and the timing collector"""
+
+    def test_counts(self):
+        pfolio = Portfolio(*app_assets(), prd=24)
+        timer = PhaseTimer().attach(pfolio)
+        pfolio.gen_quads()
+        stats = timer.to_dict()
+        self.assertEqual(list(stats), list(MONTHLY_PHASES) +
+                         ['quad_positions'])
+        for phase in stats:
+            self.assertEqual(stats[phase]['calls'], 24)
+            self.assertGreater(stats[phase]['nanoseconds'], 0)
+
+    def test_same_result(self):
+        expected = Portfolio(*app_assets(), prd=60).gen_quads()
+        pfolio = Portfolio(*app_assets(), prd=60)
+        PhaseTimer().attach(pfolio)
+        self.assertTrue(expected.equals(pfolio.gen_quads()))
+
+    def test_hook_order(self):
+        calls = []
+        pfolio = Portfolio(*app_assets(), prd=1)
+        pfolio.add_hook(before=lambda p, phase: calls.append(('in', phase)),
+                        after=lambda p, phase: calls.append(('out', phase)))
+        pfolio.update_monthly()
+        self.assertEqual(calls[:3], [('in', 'next_month'),
+                                     ('out', 'next_month'),
+                                     ('in', 'monthly_buy')])
+        self.assertEqual(len(calls), 2 * len(MONTHLY_PHASES))
+
+    def test_detach(self):
+        pfolio = Portfolio(*app_assets(), prd=12)
+        timer = PhaseTimer().attach(pfolio)
+        pfolio.update_monthly()
+        timer.detach(pfolio)
+        self.assertIsNone(pfolio._hooks)
+        pfolio.update_monthly()
+        self.assertEqual(timer.calls['check_fi'], 1)
+
+    def test_prometheus(self):
+        pfolio = Portfolio(*app_assets(), prd=3)
+        timer = PhaseTimer().attach(pfolio)
+        pfolio.gen_quads()
+        text = timer.to_prometheus()
+        self.assertIn('# TYPE fispy_phase_calls_total counter', text)
+        self.assertIn('fispy_phase_calls_total{phase="monthly_repay"} 3',
+                      text)
+        self.assertIn('fispy_phase_seconds_total{phase="check_fi"}', text)
+
+
+if __name__ == '__main__':
+    unittest.main()
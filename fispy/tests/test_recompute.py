@@ -0,0 +1,80 @@
+import threading
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+from fispy.recompute import LatestRequest, iter_process
+
+
+class TestLatestRequest(unittest.TestCase):
+    """Check that requests are coalesced into the latest one"""
+
+    def setUp(self):
+        self.executor = ThreadPoolExecutor(max_workers=2)
+        self.gate = threading.Event()
+        self.finished = threading.Event()
+        self.calls = []
+        self.delivered = []
+
+    def tearDown(self):
+        self.gate.set()
+        self.executor.shutdown(wait=True)
+
+    def slow(self, value):
+        self.calls.append(value)
+        self.gate.wait(5)
+        if value < 0:
+            raise ValueError(value)
+        return value * 2
+
+    def deliver(self, result):
+        self.delivered.append(result)
+        self.finished.set()
+
+    def test_coalesced(self):
+        request = LatestRequest(self.slow, self.deliver,
+                                executor=self.executor)
+        request.submit(1)
+        request.submit(2)
+        request.submit(3)
+        self.assertTrue(request.busy)
+        self.gate.set()
+        self.assertTrue(self.finished.wait(5))
+        self.executor.shutdown(wait=True)
+        self.assertEqual(self.calls, [1, 3])
+        self.assertEqual(self.delivered, [6])
+        self.assertEqual(request.coalesced, 1)
+        self.assertEqual(request.dropped, 1)
+        self.assertFalse(request.busy)
+
+    def test_error(self):
+        errors = []
+        request = LatestRequest(self.slow, self.deliver,
+                                executor=self.executor,
+                                on_error=lambda error: (errors.append(error),
+                                                        self.finished.set()))
+        self.gate.set()
+        request.submit(-1)
+        self.assertTrue(self.finished.wait(5))
+        self.assertIsInstance(errors[0], ValueError)
+        self.assertEqual(self.delivered, [])
+
+
+class TestIterProcess(unittest.TestCase):
+    """Check generators run in a worker process"""
+
+    def test_items(self):
+        self.assertEqual(list(iter_process(range, 2, 5)), [2, 3, 4])
+
+    def test_error(self):
+        with self.assertRaises(ValueError):
+            list(iter_process(int, 'x'))
+
+    def test_close(self):
+        """Closing the generator early leaves the pool free"""
+        items = iter_process(range, 10 ** 9)
+        self.assertEqual(next(items), 0)
+        items.close()
+        self.assertEqual(list(iter_process(range, 2)), [0, 1])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,55 @@
+import shutil
+import tempfile
+import unittest
+import numpy as np
+import pandas as pd
+from fispy.fispy import Portfolio
+from fispy.batch import BatchPortfolio
+from fispy.store import PortfolioStore
+from fispy.results import ResultFile, ResultWriter, project_store
+from fispy.tests.test_batch import SCENARIOS, app_assets
+
+
+class TestResultFile(unittest.TestCase):
+    """Check projections written to and read back from disk"""
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.store = PortfolioStore()
+        self.store.save([Portfolio(*app_assets(**kw), prd=120)
+                         for kw in SCENARIOS] +
+                        [Portfolio(*app_assets(expenses=4), prd=120)])
+
+    def tearDown(self):
+        self.store.close()
+        shutil.rmtree(self.tmp)
+
+    def test_project_store(self):
+        results = project_store(self.store, self.tmp, prd=120, chunksize=4)
+        self.assertEqual(len(results), 6)
+        self.assertEqual(len(results.pending()), 0)
+        for i, kw in enumerate(SCENARIOS):
+            expected = Portfolio(*app_assets(**kw), prd=120).run_until(
+                lambda portfolio: False).states
+            states = results.states(results.row(i + 1))
+            pd.testing.assert_frame_equal(
+                states, expected[states.columns], check_exact=True)
+        self.assertEqual(len(results.states(5)), 0)
+        self.assertEqual(results.index['insolvent'][5], 0)
+
+    def test_append(self):
+        ids = self.store.ids()
+        with ResultWriter(self.tmp, ids, 120) as writer:
+            batch, _ = self.store.load_batch(ids[:2])
+            writer.write_result(0, batch.run())
+        results = ResultFile(self.tmp)
+        self.assertEqual(list(results.pending()), [2, 3, 4, 5])
+        with self.assertRaises(KeyError):
+            results.states(3)
+        project_store(self.store, self.tmp, prd=120)
+        expected = BatchPortfolio(*[Portfolio(*app_assets(**kw), prd=120)
+                                    for kw in SCENARIOS]).run()
+        np.testing.assert_array_equal(ResultFile(self.tmp).data['cash'][:5],
+                                      expected.cash)
+        with self.assertRaises(ValueError):
+            ResultWriter(self.tmp, ids, 60, append=True)
@@ -0,0 +1,61 @@
+import unittest
+import numpy as np
+from fispy.fispy import Portfolio
+from fispy.sensitivity import input_fields, sensitivity
+from fispy.tests.test_batch import app_assets
+
+
+class TestSensitivity(unittest.TestCase):
+    """Check the tornado table against separate scalar runs"""
+
+    def run_scalar(self, field=None, value=None):
+        assets = app_assets()
+        if field is not None:
+            setattr(assets[field[0]], field[1], value)
+        states = Portfolio(*assets, prd=300).run_until(
+            lambda portfolio: False).states
+        return states['networth'].iloc[-1], int(np.argmax(states['fi']))
+
+    def test_matches_scalar(self):
+        pfolio = Portfolio(*app_assets(), prd=300)
+        table = sensitivity(pfolio)
+        self.assertEqual(len(table), len(input_fields(pfolio)))
+        self.assertEqual((table.attrs['networth'], table.attrs['fi_month']),
+                         self.run_scalar())
+        for field, name in (((0, 'monthly_expenses'), 'monthly_expenses[0]'),
+                            ((2, 'debt'), 'debt[2]')):
+            row = table.loc[name]
+            self.assertEqual(self.run_scalar(field, row['low']),
+                             (row['networth_low'], row['fi_month_low']))
+            self.assertEqual(self.run_scalar(field, row['high']),
+                             (row['networth_high'], row['fi_month_high']))
+        # the assets of the portfolio are left alone
+        self.assertEqual(pfolio.assets[2].debt, 70)
+
+    def test_ranked(self):
+        table = sensitivity(Portfolio(*app_assets(), prd=300),
+                            fields=[(2, 'value'), (0, 'monthly_income'),
+                                    (0, 'monthly_expenses')], step=0.1)
+        self.assertEqual(list(table.index)[0], 'monthly_income[0]')
+        swings = table['fi_month_swing'].abs().to_numpy()
+        self.assertTrue((np.diff(swings) <= 0).all())
+        self.assertAlmostEqual(table.loc['value[2]', 'low'], 135)
+
+    def test_zero_fields(self):
+        """Fields at 0 are skipped, and can not be moved below 0"""
+        pfolio = Portfolio(*app_assets(debt=0, repayment=0), prd=300)
+        names = list(sensitivity(pfolio).index)
+        self.assertNotIn('debt[2]', names)
+        self.assertNotIn('monthly_repayment[2]', names)
+        table = sensitivity(pfolio, fields=[(2, 'debt'), (2, 'value')])
+        self.assertTrue((table['low'] >= 0).all())
+        row = table.loc['debt[2]']
+        self.assertEqual((row['low'], row['high']), (0, 0.05))
+        self.assertEqual(row['networth_low'], table.attrs['networth'])
+        self.assertEqual(row['d_networth'], row['networth_swing'] / 0.05)
+
+    def test_missing_fields(self):
+        """Fields an asset does not have can not be perturbed"""
+        pfolio = Portfolio(*app_assets(), prd=60)
+        with self.assertRaisesRegex(ValueError, 'Asset 0 has no max_cash'):
+            sensitivity(pfolio, fields=[(4, 'value'), (0, 'max_cash')])
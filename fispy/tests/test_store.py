@@ -0,0 +1,91 @@
+import os
+import shutil
+import tempfile
+import unittest
+import numpy as np
+import pandas as pd
+from fispy.fispy import (DEFAULT_RULES, AssetTable, BuyProperty, Portfolio,
+                         Rebalance, parse_rules)
+from fispy.batch import BatchPortfolio
+from fispy.store import PortfolioStore
+from fispy.tests.test_batch import SCENARIOS, app_assets
+
+
+class TestPortfolioStore(unittest.TestCase):
+    """Check portfolios survive a round trip through the store"""
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.store = PortfolioStore(os.path.join(self.tmp, 'fispy.db'))
+
+    def tearDown(self):
+        self.store.close()
+        shutil.rmtree(self.tmp)
+
+    def portfolios(self):
+        portfolios = [Portfolio(*app_assets(**kw), prd=120)
+                      for kw in SCENARIOS]
+        portfolios[1].stock_growth = 1.005
+        return portfolios
+
+    def test_round_trip(self):
+        ids = self.store.save(self.portfolios(),
+                              names=[str(i) for i in range(5)])
+        self.assertEqual(ids, [1, 2, 3, 4, 5])
+        self.assertEqual(len(self.store), 5)
+        for i, portfolio in zip(ids, self.portfolios()):
+            loaded = self.store.load(i)
+            pd.testing.assert_frame_equal(
+                AssetTable.from_assets(loaded.assets).to_frame(),
+                AssetTable.from_assets(portfolio.assets).to_frame())
+            self.assertEqual(loaded.stock_growth, portfolio.stock_growth)
+            pd.testing.assert_frame_equal(loaded.gen_quads(),
+                                          portfolio.gen_quads())
+        table, scenario, settings = self.store.load_table([4, 2])
+        self.assertEqual(list(settings.index), [2, 4])
+        self.assertEqual(list(settings['name']), ['1', '3'])
+        self.assertEqual(list(scenario), [0] * 5 + [1] * 5)
+        with self.assertRaises(KeyError):
+            self.store.load(9)
+
+    def test_load_batch(self):
+        self.store.save(self.portfolios())
+        batch, ids = self.store.load_batch()
+        self.assertEqual(ids, [1, 2, 3, 4, 5])
+        expected = BatchPortfolio(*self.portfolios()).run()
+        pd.testing.assert_frame_equal(batch.run().summary(),
+                                      expected.summary())
+
+    def test_rules(self):
+        rules = (Rebalance(stocks=0.7, every=6), BuyProperty(pro_rata=True))
+        portfolios = self.portfolios()
+        for portfolio in portfolios:
+            portfolio.rules = rules
+        ids = self.store.save(portfolios)
+        loaded = self.store.load(ids[0])
+        self.assertEqual(loaded.rules, rules)
+        pd.testing.assert_frame_equal(loaded.gen_quads(),
+                                      portfolios[0].gen_quads())
+        batch, ids = self.store.load_batch()
+        self.assertEqual(batch.rules, rules)
+        self.store.save(self.portfolios()[:1])
+        with self.assertRaises(ValueError):
+            self.store.load_batch()
+
+    def test_parse_rules(self):
+        rules = (Rebalance(stocks=0.7, every=6), BuyProperty(pro_rata=True))
+        self.assertEqual(parse_rules(repr(rules)), rules)
+        self.assertEqual(parse_rules(repr(DEFAULT_RULES)), DEFAULT_RULES)
+        for text in ('__import__("os")', 'BuyProperty(1)', 'Rebalance(x=f())'):
+            with self.assertRaises(ValueError):
+                parse_rules(text)
+
+    def test_save_table(self):
+        table = AssetTable.from_assets(app_assets() * 3)
+        ids = self.store.save_table(table, np.repeat([0, 1, 2], 5), prd=24)
+        self.store.delete(ids[:1])
+        batch, ids = self.store.load_batch()
+        self.assertEqual(ids, [2, 3])
+        self.assertEqual(batch.prd, 24)
+        self.assertEqual(self.store.connection.execute(
+            'SELECT COUNT(*) FROM assets').fetchone()[0], 10)
@@ -0,0 +1,33 @@
+import unittest
+from fispy.fispy import Portfolio
+from fispy.batch import BatchPortfolio
+from fispy.sweep import sweep
+from fispy.tests.test_batch import app_assets
+
+GRID = {(2, 'debt'): [0, 70, 140],
+        (2, 'monthly_repayment'): [0.3, 0.5],
+        (2, 'pay_debt_asap'): [False, True]}
+
+
+class TestSweepMethods(unittest.TestCase):
+    """Check the parameter sweep"""
+
+    def test_sweep_index(self):
+        results = sweep(app_assets(), GRID, prd=60)
+        self.assertEqual(len(results), 12)
+        self.assertEqual(list(results.index.names),
+                         ['debt[2]', 'monthly_repayment[2]',
+                          'pay_debt_asap[2]'])
+
+    def test_matches_single_run(self):
+        results = sweep(app_assets(), GRID, prd=60, chunksize=5)
+        assets = app_assets(debt=70, repayment=0.3, asap=True)
+        expected = BatchPortfolio(Portfolio(*assets, prd=60)).run().summary()
+        row = results.loc[(70, 0.3, True)]
+        self.assertEqual(row['fi_month'], expected['fi_month'][0])
+        self.assertEqual(row['networth'], expected['networth'][0])
+
+    def test_workers_give_identical_results(self):
+        single = sweep(app_assets(), GRID, prd=60, chunksize=5)
+        pooled = sweep(app_assets(), GRID, prd=60, workers=2, chunksize=5)
+        self.assertTrue(single.equals(pooled))